@@ -1,10 +1,27 @@
 """Jablotron System Component"""
+import asyncio
+import json
 import logging
-from homeassistant.helpers.discovery import load_platform
+import os
+import time
+from homeassistant.helpers.discovery import async_load_platform
 import homeassistant.helpers.config_validation as cv
 import voluptuous as vol
-from homeassistant.const import (CONF_PORT, CONF_CODE, CONF_NAME)
+from homeassistant.const import (CONF_PORT, CONF_CODE, CONF_NAME, EVENT_HOMEASSISTANT_STOP)
 from homeassistant.components import mqtt
+from homeassistant.config import load_yaml_config_file
+from homeassistant.core import callback
+from homeassistant.exceptions import HomeAssistantError
+
+try:
+    from homeassistant.core import SupportsResponse
+except ImportError:
+    # Home Assistant before 2023.7, service results are fired as an event
+    SupportsResponse = None
+
+from .events import EVENT_TYPES, LIMIT_RATE, LIMIT_SAMPLE
+from .protocol import CodeTables
+from .transport import valid_port
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -18,31 +35,254 @@ CONF_STATE_TOPIC = 'state_topic'
 CONF_COMMAND_TOPIC = 'command_topic'
 CONF_DATA_TOPIC = 'data_topic'
 CONF_MQTT_EXT_BROKER = 'mqtt_external'
+CONF_DEVICES_FILE = 'devices_file'
+CONF_USERS_FILE = 'users_file'
+CONF_CODES_FILE = 'codes_file'
+CONF_HISTORY_FILE = 'history_file'
+CONF_EVENTS = 'events'
+CONF_DEBOUNCE = 'debounce'
+CONF_MIN_ON = 'min_on'
+CONF_OFF_DELAY = 'off_delay'
+CONF_SENSOR_PREFIX = 'sensor_prefix'
+CONF_PANEL = 'panel'
 DEFAULT_STATE_TOPIC = 'home-assistant/mqtt_example/state'
 DEFAULT_COMMAND_TOPIC = 'home-assistant/mqtt_example/set'
 DEFAULT_DATA_TOPIC = 'home-assistant/mqtt_example/data'
+DEFAULT_SENSOR_PREFIX = 'jablotron'
+
+PLATFORMS = ('binary_sensor', 'alarm_control_panel', 'sensor')
+
+DATA_HUBS = 'hubs'
+DATA_RUNTIME = 'runtime'
+DATA_PROFILER = 'profiler'
+
+SERVICE_PROFILE = 'profile'
+ATTR_SECONDS = 'seconds'
+ATTR_STOP = 'stop'
+DEFAULT_PROFILE_SECONDS = 30
+
+PROFILE_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_SECONDS, default=DEFAULT_PROFILE_SECONDS): vol.All(vol.Coerce(float), vol.Range(min=1, max=3600)),
+    vol.Optional(ATTR_STOP, default=False): cv.boolean
+})
+
+SERVICE_DUMP_UNKNOWN = 'dump_unknown'
+ATTR_RESET = 'reset'
+
+DUMP_UNKNOWN_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_RESET, default=False): cv.boolean
+})
+
+SERVICE_SNAPSHOT = 'snapshot'
+ATTR_PUBLISH = 'publish'
+SNAPSHOT_TOPIC = '/snapshot'
+
+SNAPSHOT_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_PUBLISH, default=False): cv.boolean
+})
+
+SERVICE_HISTORY = 'history'
+ATTR_SENSORS = 'sensors'
+ATTR_WINDOW = 'window'
+DEFAULT_HISTORY_WINDOW = 3600
 
+HISTORY_SCHEMA = vol.Schema({
+    vol.Optional(ATTR_SENSORS, default=[]): vol.All(cv.ensure_list, [cv.string]),
+    vol.Optional(ATTR_WINDOW, default=DEFAULT_HISTORY_WINDOW): vol.All(vol.Coerce(float), vol.Range(min=1))
+})
+
+
+def _unique_ports(panels):
+    """Make sure no port is configured for more than one panel."""
+    ports = [panel[CONF_PORT] for panel in panels]
+    if len(ports) != len(set(ports)):
+        raise vol.Invalid('every panel needs its own port')
+    return panels
+
+
+# rate limit and sampling per event type, see events.py
+EVENT_LIMIT_SCHEMA = vol.Schema({
+    vol.Optional(LIMIT_RATE): vol.All(vol.Coerce(float), vol.Range(min=0, min_included=False)),
+    vol.Optional(LIMIT_SAMPLE): cv.positive_int
+})
+
+# debounce of binary sensors per device_class, in seconds
+DEBOUNCE_SCHEMA = vol.Schema({
+    vol.Optional(CONF_MIN_ON, default=0): vol.All(vol.Coerce(float), vol.Range(min=0)),
+    vol.Optional(CONF_OFF_DELAY, default=0): vol.All(vol.Coerce(float), vol.Range(min=0))
+})
 
 # code required, since binary_sensor is using code to get 55 packets send
+PANEL_SCHEMA = vol.Schema({
+    vol.Required(CONF_PORT, default=DEFAULT_PORT): vol.All(cv.string, valid_port),
+    vol.Required(CONF_CODE): cv.string,
+    vol.Optional(CONF_MQTT_EXT_BROKER, default=False): cv.boolean,
+    vol.Optional(CONF_CODE_ARM_REQUIRED, default=False): cv.boolean,
+    vol.Optional(CONF_CODE_DISARM_REQUIRED, default=True): cv.boolean,
+    vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
+    vol.Optional(CONF_STATE_TOPIC): mqtt.valid_subscribe_topic,
+    vol.Optional(CONF_COMMAND_TOPIC): mqtt.valid_subscribe_topic,
+    vol.Optional(CONF_DATA_TOPIC): mqtt.valid_subscribe_topic,
+    vol.Optional(CONF_DEVICES_FILE): cv.string,
+    vol.Optional(CONF_USERS_FILE): cv.string,
+    vol.Optional(CONF_CODES_FILE): cv.string,
+    vol.Optional(CONF_HISTORY_FILE): cv.string,
+    vol.Optional(CONF_EVENTS, default={}): vol.Schema({vol.In(EVENT_TYPES): EVENT_LIMIT_SCHEMA}),
+    vol.Optional(CONF_DEBOUNCE, default={}): vol.Schema({cv.string: DEBOUNCE_SCHEMA}),
+    vol.Optional(CONF_SENSOR_PREFIX): cv.slug
+})
+
+# A single panel can still be configured as a mapping, several panels as a list
 CONFIG_SCHEMA = vol.Schema({
-    DOMAIN: vol.Schema({
-        vol.Required(CONF_PORT, default=DEFAULT_PORT): cv.string,
-        vol.Required(CONF_CODE): cv.string,
-        vol.Optional(CONF_MQTT_EXT_BROKER, default=False): cv.boolean,
-        vol.Optional(CONF_CODE_ARM_REQUIRED, default=False): cv.boolean,
-        vol.Optional(CONF_CODE_DISARM_REQUIRED, default=True): cv.boolean,
-        vol.Optional(CONF_NAME, default=DEFAULT_NAME): cv.string,
-        vol.Optional(CONF_STATE_TOPIC, default=DEFAULT_STATE_TOPIC): mqtt.valid_subscribe_topic,
-        vol.Optional(CONF_COMMAND_TOPIC, default=DEFAULT_COMMAND_TOPIC): mqtt.valid_subscribe_topic,
-        vol.Optional(CONF_DATA_TOPIC, default=DEFAULT_DATA_TOPIC): mqtt.valid_subscribe_topic
-    })
+    DOMAIN: vol.All(cv.ensure_list, [PANEL_SCHEMA], _unique_ports)
 }, extra=vol.ALLOW_EXTRA)
 
-def setup(hass, config):
-    """Your controller/hub specific code."""
 
-    hass.data[DOMAIN] = config[DOMAIN]
+def _panel_defaults(index, panel):
+    """Fill in the per panel topics, files and sensor prefix defaults.
+
+    The first panel keeps the original topics, file names and entity ids, so
+    existing single panel installations are not affected.
+    """
+    suffix = '' if index == 0 else '_%d' % index
+    panel.setdefault(CONF_STATE_TOPIC, DEFAULT_STATE_TOPIC + suffix)
+    panel.setdefault(CONF_COMMAND_TOPIC, DEFAULT_COMMAND_TOPIC + suffix)
+    panel.setdefault(CONF_DATA_TOPIC, DEFAULT_DATA_TOPIC + suffix)
+    panel.setdefault(CONF_DEVICES_FILE, 'jablotron/jablotron_devices%s.yaml' % suffix)
+    panel.setdefault(CONF_USERS_FILE, 'jablotron/jablotron_users%s.yaml' % suffix)
+    panel.setdefault(CONF_CODES_FILE, 'jablotron/jablotron_codes%s.yaml' % suffix)
+    panel.setdefault(CONF_HISTORY_FILE, 'jablotron/jablotron_history%s.bin' % suffix)
+    panel.setdefault(CONF_SENSOR_PREFIX, DEFAULT_SENSOR_PREFIX + suffix)
+    return panel
+
+def load_codes(hass, panel):
+    """Load the protocol code tables of a panel, with the overrides of its codes file."""
+    path = hass.config.path(panel[CONF_CODES_FILE])
+    overrides = None
+    if os.path.exists(path):
+        overrides = load_yaml_config_file(path)
+        _LOGGER.info('load_codes(): code overrides loaded from %s', path)
+    return CodeTables.load(overrides)
+
+def make_config_dir(hass):
+    """Create the jablotron folder in the config dir, for the devices, users, codes and log files."""
+    os.makedirs(hass.config.path('jablotron'), exist_ok=True)
+
+async def async_setup(hass, config):
+    """Set up the panels, all file I/O runs in the executor."""
+    from .hub import JablotronHub
+    from .runtime import JablotronRuntime
+
+    panels = [_panel_defaults(index, dict(panel)) for index, panel in enumerate(config[DOMAIN])]
+
+    try:
+        await hass.async_add_executor_job(make_config_dir, hass)
+        codes = await asyncio.gather(*(hass.async_add_executor_job(load_codes, hass, panel) for panel in panels))
+    except (HomeAssistantError, ValueError, OSError) as err:
+        _LOGGER.error('async_setup(): unable to load the code tables: %s', err)
+        return False
+
+    runtime = JablotronRuntime()
+    hubs = [JablotronHub(hass, index, panel, runtime, codes[index]) for index, panel in enumerate(panels)]
+
+    hass.data[DOMAIN] = {
+        DATA_HUBS: hubs,
+        DATA_RUNTIME: runtime,
+    }
+
+    await asyncio.gather(*(hass.async_add_executor_job(hub.history.load) for hub in hubs))
+
+    async def async_shutdown(event):
+        _LOGGER.debug('async_shutdown() called')
+        await hass.async_add_executor_job(runtime.stop)
+        await asyncio.gather(*(hass.async_add_executor_job(hub.stop) for hub in hubs))
+        _LOGGER.debug('exiting async_shutdown()')
+
+    hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, async_shutdown)
+
+    def profile(call):
+        """Sample the stacks of the Jablotron threads for a number of seconds."""
+        from .profiler import ThreadProfiler
+
+        running = hass.data[DOMAIN].get(DATA_PROFILER)
+        if call.data[ATTR_STOP]:
+            if running is not None:
+                running.stop()
+            return
+        if running is not None and running.running:
+            _LOGGER.warning('profile(): a profile is already being recorded')
+            return
+
+        path = hass.config.path('jablotron', time.strftime('profile_%Y%m%d_%H%M%S.txt'))
+        profiler = ThreadProfiler(runtime.threads, call.data[ATTR_SECONDS], path)
+        hass.data[DOMAIN][DATA_PROFILER] = profiler
+        profiler.start()
+
+    hass.services.async_register(DOMAIN, SERVICE_PROFILE, profile, schema=PROFILE_SCHEMA)
+
+    def dump_unknown(call):
+        """Write the histogram of unknown messages of all panels to a file."""
+        lines = []
+        for hub in hubs:
+            lines.append('# Jablotron unknown messages, panel %s, %d in total' % (hub.name, hub.stats.unknown.total))
+            lines.extend(hub.stats.unknown.dump())
+            lines.append('')
+            if call.data[ATTR_RESET]:
+                hub.stats.unknown.reset()
+
+        path = hass.config.path('jablotron', time.strftime('unknown_%Y%m%d_%H%M%S.txt'))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as out:
+            out.write('\n'.join(lines))
+        _LOGGER.info('dump_unknown(): unknown messages written to %s', path)
+
+    hass.services.async_register(DOMAIN, SERVICE_DUMP_UNKNOWN, dump_unknown, schema=DUMP_UNKNOWN_SCHEMA)
+
+    @callback
+    def history(call):
+        """Return the last trips and the trips in a window of the sensors, and the last arming of every panel."""
+        window = call.data[ATTR_WINDOW]
+        wanted = set(call.data[ATTR_SENSORS])
+        result = {'sensors': {}, 'panels': {}}
+        for hub in hubs:
+            prefix = hub.sensor_prefix + '_'
+            for number in hub.history.sensors():
+                dev_id = prefix + str(number)
+                if not wanted or dev_id in wanted:
+                    result['sensors'][dev_id] = hub.history.sensor(number, window)
+            result['panels'][hub.name] = hub.history.arm(window)
+
+        if SupportsResponse is None:
+            hass.bus.async_fire(DOMAIN, dict(result, type=SERVICE_HISTORY))
+            return None
+        return result
+
+    @callback
+    def snapshot(call):
+        """Return the state, model, availability, d8 08 bitmap and all sensor states of every panel at once."""
+        result = {'panels': [hub.snapshot() for hub in hubs]}
+
+        if call.data[ATTR_PUBLISH]:
+            for hub, panel in zip(hubs, result['panels']):
+                topic = hub.config[CONF_DATA_TOPIC] + SNAPSHOT_TOPIC
+                hass.async_create_task(mqtt.async_publish(hass, topic, json.dumps(panel), retain=True))
+
+        if SupportsResponse is None:
+            hass.bus.async_fire(DOMAIN, dict(result, type=SERVICE_SNAPSHOT))
+            return None
+        return result
+
+    for service, handler, schema in ((SERVICE_HISTORY, history, HISTORY_SCHEMA),
+                                     (SERVICE_SNAPSHOT, snapshot, SNAPSHOT_SCHEMA)):
+        if SupportsResponse is None:
+            hass.services.async_register(DOMAIN, service, handler, schema=schema)
+        else:
+            hass.services.async_register(DOMAIN, service, handler, schema=schema,
+                                         supports_response=SupportsResponse.OPTIONAL)
 
-    load_platform(hass, 'binary_sensor', DOMAIN, {}, config)
-    load_platform(hass, 'alarm_control_panel', DOMAIN, {}, config)
-    return True
\ No newline at end of file
+    runtime.start()
+    for hub in hubs:
+        hub.start()
+        for platform in PLATFORMS:
+            hass.async_create_task(async_load_platform(hass, platform, DOMAIN, {CONF_PANEL: hub.index}, config))
+    return True
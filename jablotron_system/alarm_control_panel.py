@@ -1,54 +1,47 @@
 """Jablotron Alarm control panel platform"""
 import logging
 import re
-import time
-import asyncio
 import threading
-import binascii
 
-from . import DOMAIN
+from .protocol import HEADER_JA80_STATE, HEADER_JA100_STATE, KIND_HEARTBEAT, KIND_KEY_PRESS, decode_state
+from .commands import JA100_ACTIONS
+from .events import EVENT_ALARM_STATE, EVENT_HEARTBEAT, EVENT_KEY_PRESS
+from .panel import PanelStateMachine
+from . import DOMAIN, DATA_HUBS, CONF_PANEL, CONF_CODE_ARM_REQUIRED, CONF_CODE_DISARM_REQUIRED, CONF_STATE_TOPIC, CONF_COMMAND_TOPIC
 
 import homeassistant.components.alarm_control_panel as alarm
-from homeassistant.const import (
-    CONF_CODE, CONF_DEVICE, CONF_NAME, CONF_VALUE_TEMPLATE,
-    STATE_ALARM_ARMED_AWAY, STATE_ALARM_ARMED_HOME, STATE_ALARM_ARMED_NIGHT,
-    STATE_ALARM_DISARMED, STATE_ALARM_PENDING, STATE_ALARM_ARMING, STATE_ALARM_TRIGGERED)
+from homeassistant.const import CONF_CODE
 from homeassistant.components.alarm_control_panel.const import (
     SUPPORT_ALARM_ARM_AWAY,
     SUPPORT_ALARM_ARM_HOME,
     SUPPORT_ALARM_TRIGGER,
     SUPPORT_ALARM_ARM_NIGHT)
 from homeassistant.core import callback
-import homeassistant.helpers.config_validation as cv
-from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.typing import ConfigType, HomeAssistantType
-from homeassistant.components import mqtt
 
 _LOGGER = logging.getLogger(__name__)
 
 async def async_setup_platform(hass: HomeAssistantType, config: ConfigType, async_add_entities, discovery_info=None):
-    async_add_entities([JablotronAlarm(hass, config)])
+    hub = hass.data[DOMAIN][DATA_HUBS][discovery_info[CONF_PANEL]]
+    async_add_entities([JablotronAlarm(hass, hub)])
 
 class JablotronAlarm(alarm.AlarmControlPanelEntity):
     """Representation of a Jaboltron alarm status."""
 
-    def __init__(self, hass, config):
+    def __init__(self, hass, hub):
         """Init the Alarm Control Panel."""
         self._state = None
         self._sub_state = None
-        self._name = hass.data[DOMAIN]['name']
-        self._file_path = hass.data[DOMAIN]['port']
-        self._available = False
-        self._code = hass.data[DOMAIN]['code']
-        self._code_arm_required = hass.data[DOMAIN]['code_arm_required']
-        self._code_disarm_required = hass.data[DOMAIN]['code_disarm_required']
-        self._f = None
+        self._hub = hub
+        self._name = hub.name
+        self._file_path = hub.port
+        self._code = hub.config[CONF_CODE]
+        self._code_arm_required = hub.config[CONF_CODE_ARM_REQUIRED]
+        self._code_disarm_required = hub.config[CONF_CODE_DISARM_REQUIRED]
         self._hass = hass
-        self._config = config
         self._model = 'Unknown'
+        self._state_machine = PanelStateMachine()
         self._lock = threading.BoundedSemaphore()
-        self._stop = threading.Event()
-        self._data_flowing = threading.Event()
         
         """Setup the MQTT component, if the mqtt.publish service is available."""
         """Since MQTT is run on separate instance I will connect directly"""
@@ -58,30 +51,28 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
         
         if self._mqtt_enabled:
           self._mqtt = hass.components.mqtt
-          self._state_topic = hass.data[DOMAIN]['state_topic']
-          self._command_topic = hass.data[DOMAIN]['command_topic']
+          self._state_topic = hub.config[CONF_STATE_TOPIC]
+          self._command_topic = hub.config[CONF_COMMAND_TOPIC]
 
-        try:         
-            hass.bus.async_listen('homeassistant_stop', self.shutdown_threads)
-
-            from concurrent.futures import ThreadPoolExecutor
-            self._io_pool_exc = ThreadPoolExecutor(max_workers=5)    
+    async def async_added_to_hass(self):
+        """Subscribe to MQTT and start handling the reports of the hub, once added to Home Assistant."""
+        try:
             if self._mqtt_enabled:
-                self._mqtt_init_future = self._io_pool_exc.submit(self._mqtt_init)
-            self._read_loop_future = self._io_pool_exc.submit(self._read_loop)
-            self._watcher_loop_future = self._io_pool_exc.submit(self._watcher_loop)
-            self._io_pool_exc.submit(self._startup_message)
+                await self._async_mqtt_init()
+
+            self._hub.add_handler(self._handle_frames)
+            self._hub.add_snapshot_handler(self._snapshot)
+            self._hub.add_watcher(1, self._watcher)
+            self._startup_message()
 
         except Exception as ex:
             _LOGGER.error('Unexpected error: %s', format(ex) )
 
-
-
-    def _mqtt_init(self):
+    async def _async_mqtt_init(self):
         """Subscribe to MQTT topic"""
 
         _LOGGER.info('(mqtt_init) subscribing to topic: %s', self._command_topic)
-        self._mqtt.subscribe(self._command_topic, self.message_received)
+        await self._mqtt.async_subscribe(self._command_topic, self.message_received)
         _LOGGER.info('(mqtt_init) successfully subscribed to topic: %s', self._command_topic)
 
 
@@ -92,17 +83,10 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
         _alarm_state = msg.payload.lower()
         _LOGGER.info("(message_received) calling service: alarm_control_panel.alarm_%s", _alarm_state)
 
-        """ Todo: change 'jablotron_alarm' to proper entity_id based on self._name """
         if (_alarm_state[0:3] == 'arm' and self._code_arm_required) or (_alarm_state[0:6] == 'disarm' and self._code_disarm_required):
-            self._hass.services.call("alarm_control_panel", "alarm_"+_alarm_state, {"entity_id":"alarm_control_panel.jablotron_alarm", "code":self._code})
+            self._hass.services.call("alarm_control_panel", "alarm_"+_alarm_state, {"entity_id":self.entity_id, "code":self._code})
         else:
-            self._hass.services.call("alarm_control_panel", "alarm_"+_alarm_state, {"entity_id":"alarm_control_panel.jablotron_alarm"})
-
-
-    def shutdown_threads(self, event):
-        _LOGGER.debug('handle_shutdown() called' )
-        self._stop.set()
-        _LOGGER.debug('exiting handle_shutdown()' )
+            self._hass.services.call("alarm_control_panel", "alarm_"+_alarm_state, {"entity_id":self.entity_id})
 
 #    @property
 #    def unique_id(self):
@@ -126,7 +110,7 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
 
     @property
     def available(self):
-        return self._available
+        return self._state_machine.available
 
     @property
     def code_format(self):
@@ -150,170 +134,122 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
             self.async_schedule_update_ha_state()
             self._update_required.clear()
 
-    async def _update(self):
-
-            self.async_schedule_update_ha_state()
+    def _watcher(self):
+        """Retry the startup message while no data is received, runs on the io thread."""
 
-    def _watcher_loop(self):
+        if self._hub.idle_for(1):
+            _LOGGER.debug("Data has not been received for 1 seconds, retry startup message")
+            self._startup_message()
+        else:
+            _LOGGER.debug("Data is flowing, wait 1 seconds before checking again")
+        return 1
 
-        while not self._stop.is_set():
-            
-            if not self._data_flowing.wait(1):
-                _LOGGER.debug("Data has not been received for 1 seconds, retry startup message")
-                self._startup_message()
-            else:
-                _LOGGER.debug("Data is flowing, wait 1 seconds before checking again")
-                time.sleep(0.5)
+    def _handle_frames(self, report):
+        """Handle the messages of a report read by the hub, called from the io thread.
 
-    def _read_loop(self):
+        The link to the panel only affects availability, never the alarm state.
+        """
+        if report is None:
+            _LOGGER.warn("No packets")
+            self._set_available(False)
+            return
 
-        try:
+        self._set_available(True)
+        for offset in report.offsets:
+            new_state = self._read(report, offset)
+            if new_state is not None:
+                self._update_state(new_state)
 
-            while not self._stop.is_set():
-                _LOGGER.debug("self model: %s", self._model)
-                #_LOGGER.debug("_read_loop: Acquiring lock...")
-                #self._lock.acquire()
-                #_LOGGER.debug("_read_loop: Lock aquired.")
+    def _snapshot(self):
+        """Return the state, model and availability of the panel, for JablotronHub.snapshot()"""
+        return {'state': self._state, 'model': self._model, 'available': self._state_machine.available}
 
-                self._f = open(self._file_path, 'rb', 64)
+    def _set_available(self, available):
+        """Update availability, the state is only written when it changed."""
 
-                _LOGGER.debug("_read_loop: trying to read data")
-                new_state = self._read()
-                _LOGGER.debug("_read_loop: succesfully read data")
+        if self._state_machine.set_available(available):
+            self._hub.handoff.put(self.async_schedule_update_ha_state)
 
-                if new_state != self._state:
-                    _LOGGER.info("Jablotron state changed: %s to %s", self._state, new_state )
-                    self._state = new_state
+    def _update_state(self, new_state):
 
-                    if self._mqtt_enabled:
-                        # "arming" is not recognized as an MQTT alarm state, so we'll use "pending" instead.
-                        # https://www.home-assistant.io/components/alarm_control_panel.mqtt
-                        # if new_state == "arming":
-                            # new_state = "pending"
+        previous = self._state_machine.state
+        if self._state_machine.transition(new_state):
+            self._hub.events.fire(EVENT_ALARM_STATE, new_state, previous)
 
-                        # Send MQTT message with new state
-                        _LOGGER.info("Sending MQTT message with state '%s' to remote alarm_control_panel", new_state)
-                        self._mqtt.publish(self._state_topic, new_state, retain=True)
+            if self._mqtt_enabled:
+                # "arming" is not recognized as an MQTT alarm state, so we'll use "pending" instead.
+                # https://www.home-assistant.io/components/alarm_control_panel.mqtt
+                # if new_state == "arming":
+                    # new_state = "pending"
 
-                    asyncio.run_coroutine_threadsafe(self._update(), self._hass.loop)
-                else:
-                    _LOGGER.info("ReadLoop: no state change")
+                # Send MQTT message with new state
+                _LOGGER.info("Sending MQTT message with state '%s' to remote alarm_control_panel", new_state)
+                self._mqtt.publish(self._state_topic, new_state, retain=True)
 
-                self._f.close()
-                _LOGGER.debug("_read_loop: closed connection")
+            """Every state change is written, they are never dropped by the hand-off queue"""
+            self._hub.handoff.put(self._async_write_state, new_state)
 
-                #_LOGGER.debug("_read_loop: Releasing lock...")
-                #self._lock.release()
-                #_LOGGER.debug("_read_loop: Lock released.")
+    @callback
+    def _async_write_state(self, state):
+        """Write a new alarm state, runs on the event loop."""
+        self._state = state
+        self.async_schedule_update_ha_state()
 
-                time.sleep(1)
+    def _read(self, report, offset):
+        """Decode a message, returns the new state or None if the message holds no state."""
 
-        except Exception as ex:
-            _LOGGER.error('Unexpected error: %s', format(ex) )
+        state = None
+        header = report.header(offset)
 
-        finally:
-            _LOGGER.debug('exiting read_loop()' )
-
-    def _read(self):
-
-        ja82codes = {
-            b'@': STATE_ALARM_DISARMED,
-            b'A': STATE_ALARM_ARMED_HOME, # Set (Zone A)
-            b'B': STATE_ALARM_ARMED_NIGHT, # Set (Zone A & B)
-            b'C': STATE_ALARM_ARMED_AWAY, # Set (Zone A, B & C)
-            b'Q': STATE_ALARM_PENDING, # Setting (Zone A)
-            b'R': STATE_ALARM_PENDING, # Setting (Zones A & B)
-            b'S': STATE_ALARM_ARMING, # Setting (Full)
-            b'G': STATE_ALARM_TRIGGERED, 
-            b'\xff': "Heartbeat?", # 25 second heatbeat
-            b'\xed': "Heartbeat?",
-            b'\x80': "Key Press",
-            b'\x81': "Key Press",
-            b'\x82': "Key Press",
-            b'\x83': "Key Press",
-            b'\x84': "Key Press",
-            b'\x85': "Key Press",
-            b'\x86': "Key Press",
-            b'\x87': "Key Press",
-            b'\x88': "Key Press",
-            b'\x89': "Key Press",
-            b'\x8e': "Key Press",
-            b'\x8f': "Key Press"
-        }
-
-        ja100codes = {
-            b'\x01': STATE_ALARM_DISARMED, # unsure which zone
-            b'\x21': STATE_ALARM_DISARMED, # unsure which zone
-            b'\x83': STATE_ALARM_ARMING, # Setting (Full)
-            b'\xa3': STATE_ALARM_ARMING, # unsure which zone
-            b'\x82': STATE_ALARM_ARMING, # Setting (Partial - at home)
-            b'\x03': STATE_ALARM_ARMED_AWAY, # Set (Full)
-            b'\x23': STATE_ALARM_ARMED_AWAY,  # unsure which zone
-            b'\x02': STATE_ALARM_ARMED_HOME  # Set (Partial - at home)
-        }
-               
         try:
-            while True:
-
-                self._data_flowing.clear()
-                packet = self._f.read(64)
-                self._data_flowing.set()                
-                if not packet:
-                    _LOGGER.warn("No packets")
-                    self._available = False
-                    return 'No Signal'   
-
-                self._available = True
-
-                if packet[:2] == b'\x82\x01': # Jablotron JA-82
-                    _LOGGER.info("JA-80")
-                    self._model = 'Jablotron JA-80 Series'
-                    state = ja82codes.get(packet[2:3])
-
-                    if state is None:
-                        _LOGGER.info("Unknown status packet is x82 x01 %s", packet[2:3])
-
-                    elif state != "Heartbeat?" and state !="Key Press":
-                        _LOGGER.info("No heartbeat or key press")
-                        break
-
-                elif packet[:2] == b'\x51\x22' or packet[14:16] == b'\x51\x22': # Jablotron JA-100
-                    _LOGGER.info("JA-100")
-                    _LOGGER.info("Packet: %s", str(binascii.hexlify(packet), 'utf-8'))
-                    self._model = 'Jablotron JA-100 Series'
-                    
-                    if packet[:2] == b'\x51\x22':
-                        _LOGGER.info("Get Packet %s", packet[2:3])
-                        state = ja100codes.get(packet[2:3])
-                    elif packet[14:16] == b'\x51\x22':
-                        _LOGGER.info("Get Packet %s", packet[16:17])
-                        state = ja100codes.get(packet[16:17])
-
-                    if state is None:
-                        _LOGGER.info("Unknown status packet is x51 x22 %s", packet[2:3])
-
-                    elif state != "Heartbeat?" and state !="Key Press":
-                        _LOGGER.info("No heartbeat or key press")
-                        self._startup_message() # let's try sending another startup message here!
-                        break
+            if header == HEADER_JA80_STATE: # Jablotron JA-82
+                _LOGGER.debug("JA-80")
+                self._model = 'Jablotron JA-80 Series'
+                code = report.data[offset + 2]
+                state = decode_state(self._hub.codes, report, offset)
+
+                if state is None:
+                    self._hub.unknown_frame(report, offset)
+
+                elif state == KIND_HEARTBEAT:
+                    self._hub.events.fire(EVENT_HEARTBEAT, code)
+
+                elif state == KIND_KEY_PRESS:
+                    self._hub.events.fire(EVENT_KEY_PRESS, code)
+
+                else:
+                    _LOGGER.debug("No heartbeat or key press")
+                    return state
+
+            elif header == HEADER_JA100_STATE: # Jablotron JA-100
+                self._model = 'Jablotron JA-100 Series'
+                code = report.data[offset + 2]
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    _LOGGER.debug("JA-100")
+                    _LOGGER.debug("Packet: %s", report.frame(offset).hex())
+                    _LOGGER.debug("Get Packet %02x", code)
+                state = decode_state(self._hub.codes, report, offset)
+
+                if state is None:
+                    self._hub.unknown_frame(report, offset)
+
+                elif state == KIND_HEARTBEAT:
+                    self._hub.events.fire(EVENT_HEARTBEAT, code)
+
+                elif state == KIND_KEY_PRESS:
+                    self._hub.events.fire(EVENT_KEY_PRESS, code)
 
                 else:
-                    _LOGGER.info("Unknown model")
-                    _LOGGER.info("Unknown packet: %s", packet)
-                    _LOGGER.debug("Unrecognised data stream, device type likely not a JA-82 or JA101 control panel. Please raise an issue at https://github.com/mattsaxon/HASS-Jablotron80/issues with this packet info [%s]", packet)
-                    #self._stop.set() 
+                    _LOGGER.debug("No heartbeat or key press")
+                    self._startup_message() # let's try sending another startup message here!
+                    return state
 
-        except (IndexError, FileNotFoundError, IsADirectoryError,
-                UnboundLocalError, OSError):
-            _LOGGER.warning("File or data not present at the moment: %s", self._file_path)
-            return 'Failed'
+            # messages with other headers are counted by the hub, see the jablotron_system.dump_unknown service
 
         except Exception as ex:
             _LOGGER.error('Unexpected error: %s', format(ex) )
-            return 'Failed'
-
 
-        return state
+        return None
 
     async def async_alarm_disarm(self, code=None):
         _LOGGER.info("Send disarm command")
@@ -381,38 +317,7 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
             payload += code
         
         _LOGGER.info("Using keys for model %s", self._model)
-        if self._model == 'Jablotron JA-80 Series':
-            switcher = {
-                "0": b'\x80',
-                "1": b'\x81',
-                "2": b'\x82',
-                "3": b'\x83',
-                "4": b'\x84',
-                "5": b'\x85',
-                "6": b'\x86',
-                "7": b'\x87',
-                "8": b'\x88',
-                "9": b'\x89',
-                "#": b'\x8e',
-                "?": b'\x8e',
-                "*": b'\x8f'
-            }
-           
-        elif self._model == 'Jablotron JA-100 Series':
-            switcher = {
-                "0": b'\x30',
-                "1": b'\x31',
-                "2": b'\x32',
-                "3": b'\x33',
-                "4": b'\x34',
-                "5": b'\x35',
-                "6": b'\x36',
-                "7": b'\x37',
-                "8": b'\x38',
-                "9": b'\x39'
-            }
-        else:
-            switcher = {}
+        commands = self._hub.commands
 
         try:
             _LOGGER.debug("_sendKeys: Acquiring lock...")
@@ -421,41 +326,19 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
 
             if self._model == 'Jablotron JA-80 Series':
 
-                packet_no = 0
-                for c in payload:
-                    packet_no +=1
-                    packet = b'\x00\x02\x01' + switcher.get(c)
-                    _LOGGER.info('sending packet %i, message: %s', packet_no, packet)
-                    self._sendPacket(packet)
-              
+                """Key presses are prebuilt for the configured code, one packet per key"""
+                packets = commands.ja80(action, code)
+                _LOGGER.info('sending %i key packets', len(packets))
+                self._hub.send_packets(packets, 'keys')
+
             elif self._model == 'Jablotron JA-100 Series':
 
-                packet_code = b''
-                for c in code:
-                    packet_code = packet_code + switcher.get(c)
-
-                #packet = b'\x80\x08\x03\x39\x39\x39' + packet_code
-                packet = b'\x80\x08\x03\x30' + packet_code
-                _LOGGER.info("Submitting alarmcode...")
-                self._sendPacket(packet)
-
-                if action == "*0":
-                    packet = b'\x80\x02\x0d\x90'
-                    _LOGGER.info('Disarming now...')
-                    _LOGGER.debug('sending packet: %s', packet)
-                    self._sendPacket(packet)
-                elif action == "*1":
-                    packet = b'\x80\x02\x0d\xa0'
-                    _LOGGER.info('Arming away...')
-                    _LOGGER.debug('sending packet: %s', packet)
-                    self._sendPacket(packet)
-                elif action == "*2":
-                    packet = b'\x80\x02\x0d\xb0'
-                    _LOGGER.info('Arming at home...')
-                    _LOGGER.debug('sending packet: %s', packet)
-                    self._sendPacket(packet)
-                elif action == "*3":
+                if action == "*3":
                     _LOGGER.warn('Arm night, but no actions defined yet! Use arm away instead, until arm night packets have been sniffed.')
+                elif action in JA100_ACTIONS:
+                    """The code and the action are prebuilt for the configured code, and sent back-to-back"""
+                    _LOGGER.info('Submitting alarmcode and action %s...', action)
+                    self._hub.send_packets(commands.ja100(action, code), 'keys')
                 else:
                     _LOGGER.debug("Unknown action: %s", action)
             else:
@@ -470,11 +353,8 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
             _LOGGER.debug("_sendKeys: Lock released.")
 
 
-    def _sendPacket(self, packet):
-        f = open(self._file_path, 'wb')
-        f.write(packet)
-        time.sleep(0.1) # lower reliability without this delay
-        f.close()        
+    def _sendPacket(self, packet, kind='keys'):
+        self._hub.send_packet(packet, kind)
 
     def _startup_message(self):
         """ Send Start Message to panel"""
@@ -486,7 +366,7 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
                 _LOGGER.debug("_startup_message: Lock acquired.")
 
                 _LOGGER.debug('Sending startup message')
-                self._sendPacket(b'\x00\x00\x01\x01')
+                self._sendPacket(b'\x00\x00\x01\x01', 'startup')
                 _LOGGER.debug('Successfully sent startup message')
 
             finally:
@@ -503,5 +383,5 @@ class JablotronAlarm(alarm.AlarmControlPanelEntity):
 
         else:
             _LOGGER.debug('Sending startup message')
-            self._sendPacket(b'\x00\x00\x01\x01')
+            self._sendPacket(b'\x00\x00\x01\x01', 'startup')
             _LOGGER.debug('Successfully sent startup message')
@@ -0,0 +1,385 @@
+"""Jablotron capture analyzer
+
+ Offline analysis of raw captures of the port, to find out the meaning of new
+ codes without scrolling through the Home Assistant log. A capture is the
+ reports read from the port written one after the other, 64 bytes each, for
+ example made with:
+
+   cat /dev/hidraw0 > capture.bin
+   nc 192.168.1.10 4000 > capture.bin
+
+ Run it with the python of Home Assistant, or any python 3:
+
+   python custom_components/jablotron_system/analyze.py capture.bin [...]
+
+ The captures are memory mapped and split into messages just like the
+ integration does (see protocol.py), with the same code tables including the
+ overrides given with --codes. When NumPy is installed, all reports are
+ decoded at once as a 2D array of fixed width records, which handles
+ captures of several days within seconds. Without NumPy the reports are
+ decoded one by one.
+
+ The result holds:
+ - headers  : number of messages per header
+ - bytes    : histogram of the values of some message bytes (3 to 6 by
+              default, numbered from 1 like in binary_sensor.py) per header,
+              with their meaning from the code tables
+ - timeline : alarm state changes, sensor changes of d8 08 status messages
+              and 55 sensor messages, and arming, with the record they
+              were found in
+
+ written as JSON, or as one CSV file per part.
+
+ This module does not depend on Home Assistant.
+"""
+
+import argparse
+import collections
+import csv
+import json
+import mmap
+import os
+import sys
+
+if __package__:
+    from .protocol import (REPORT_SIZE, HEADER_JA80_STATE, HEADER_JA100_STATE, HEADER_STATUS, HEADER_WIRED,
+                           HEADER_WIRELESS, KNOWN_HEADERS, ALARM_STATES, FrameParser, Report, load_tables)
+else:
+    # run as a script, protocol.py is next to this file
+    from protocol import (REPORT_SIZE, HEADER_JA80_STATE, HEADER_JA100_STATE, HEADER_STATUS, HEADER_WIRED,
+                          HEADER_WIRELESS, KNOWN_HEADERS, ALARM_STATES, FrameParser, Report, load_tables)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DEFAULT_BYTES = (3, 4, 5, 6)
+STATE_HEADERS = (HEADER_JA80_STATE, HEADER_JA100_STATE)
+SENSOR_HEADERS = (HEADER_WIRED, HEADER_WIRELESS)
+
+TIMELINE_FIELDS = ('file', 'record', 'header', 'event', 'subject', 'value', 'code')
+
+
+class Timeline():
+    """State changes in the order they were captured, decoded like the integration does"""
+
+    def __init__(self, tables):
+        self._tables = tables
+        self._state = None
+        self._bits = 0
+        self._sensors = {}
+        self.rows = []
+        self.file = None
+
+    def _add(self, record, header, event, subject, value, code):
+        self.rows.append({'file': self.file, 'record': record, 'header': '%04x' % header, 'event': event,
+                          'subject': subject, 'value': value, 'code': code})
+
+    def state(self, record, header, code):
+        """Alarm state message, 82 01 or 51 22"""
+        table = self._tables.ja80_state if header == HEADER_JA80_STATE else self._tables.ja100_state
+        state = table[code]
+        if state in ALARM_STATES and state != self._state:
+            self._add(record, header, 'alarm_state', self._state, state, '%02x' % code)
+            self._state = state
+
+    def status(self, record, bits):
+        """Status message d8 08, bit x is ON for sensor x"""
+        changed = bits ^ self._bits
+        while changed:
+            bit = changed & -changed
+            changed ^= bit
+            self._add(record, HEADER_STATUS, 'status', bit.bit_length() - 1, 'on' if bits & bit else 'off', '%04x' % bits)
+        self._bits = bits
+
+    def sensor(self, record, header, byte3, byte4, word):
+        """Sensor or arm message, 55 08 or 55 09"""
+        tables = self._tables
+        if tables.sensor_type[byte3] is not None:
+            sensor = word // 64
+            if tables.sensor_tamper[byte4] is not None:
+                self._add(record, header, 'tamper', sensor, tables.sensor_tamper[byte4], '%02x' % byte4)
+                return
+            state = 'on' if tables.sensor_on[byte4] is not None else 'off'
+            if self._sensors.get(sensor) != state:
+                self._add(record, header, 'sensor', sensor, state, '%02x' % byte4)
+                self._sensors[sensor] = state
+        elif tables.arm[byte3] is not None:
+            self._add(record, header, 'arm', '%02x' % byte4, tables.arm[byte3], '%02x' % byte3)
+
+
+class Analysis():
+    """Counters of all captures analyzed so far"""
+
+    def __init__(self, tables, positions=DEFAULT_BYTES):
+        self.tables = tables
+        self.positions = tuple(positions)
+        self.timeline = Timeline(tables)
+        self.headers = collections.Counter()
+        self.values = collections.Counter()
+        self.files = []
+        self.records = 0
+        self.messages = 0
+        self.truncated = 0
+        self.resyncs = 0
+
+    def add_file(self, path):
+        """Analyze one capture, captures are taken to follow each other."""
+        self.timeline.file = os.path.basename(path)
+        with open(path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            records = size // REPORT_SIZE
+            if size % REPORT_SIZE:
+                print('%s: ignoring the last %d bytes, not a full report' % (path, size % REPORT_SIZE), file=sys.stderr)
+            if records:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if np is not None:
+                        self._add_vectorised(mm, records)
+                    else:
+                        self._add_reports(mm, records)
+        self.files.append(path)
+        self.records += records
+
+    def _add_reports(self, mm, records):
+        """Decode the reports one by one, with the parser of the integration"""
+        parser = FrameParser()
+        report = Report()
+        data = report.data
+        timeline = self.timeline
+
+        def byte(position):
+            # a message shorter than position reads the last byte of the report, like the vectorised decoding
+            return data[min(offset + position - 1, REPORT_SIZE - 1)]
+
+        for record in range(records):
+            data[:] = mm[record * REPORT_SIZE:(record + 1) * REPORT_SIZE]
+            for offset in parser.feed(report, REPORT_SIZE):
+                header = report.header(offset)
+                self.headers[header] += 1
+                end = offset + 2 + data[offset + 1]
+                for position in self.positions:
+                    if offset + position <= end:
+                        self.values[header, position, data[offset + position - 1]] += 1
+
+                if header in STATE_HEADERS:
+                    timeline.state(record, header, byte(3))
+                elif header == HEADER_STATUS:
+                    timeline.status(record, byte(4) | byte(5) << 8)
+                elif header in SENSOR_HEADERS:
+                    timeline.sensor(record, header, byte(3), byte(4), byte(5) | byte(6) << 8)
+        self.messages += parser.frames
+        self.truncated += parser.truncated
+        self.resyncs += parser.resyncs
+
+    def _add_vectorised(self, mm, records):
+        """Decode all reports at once, only the state changes are handed to the timeline one by one"""
+        data = np.frombuffer(mm, dtype=np.uint8, count=records * REPORT_SIZE).reshape(records, REPORT_SIZE)
+        record, offset, fallback = _split(data)
+
+        if fallback.any():
+            # reports with cut off messages or data after the padding need the parser
+            keep = ~fallback[record]
+            record, offset = record[keep], offset[keep]
+            parser = FrameParser()
+            report = Report()
+            extra_record, extra_offset = [], []
+            for index in np.flatnonzero(fallback):
+                report.data[:] = data[index].tobytes()
+                for found in parser.feed(report, REPORT_SIZE):
+                    extra_record.append(index)
+                    extra_offset.append(found)
+            self.resyncs += parser.resyncs
+            self.truncated += parser.truncated
+            record = np.concatenate((record, np.array(extra_record, dtype=np.int64)))
+            offset = np.concatenate((offset, np.array(extra_offset, dtype=np.int64)))
+            order = np.lexsort((offset, record))
+            record, offset = record[order], offset[order]
+
+        def byte(position):
+            return data[record, np.minimum(offset + position - 1, REPORT_SIZE - 1)].astype(np.int64)
+
+        length = byte(2)
+        header = byte(1) << 8 | length
+        end = offset + 2 + length
+        self.messages += len(record)
+
+        keys, counts = np.unique(header, return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            self.headers[key] += count
+
+        for position in self.positions:
+            valid = offset + position <= end
+            keys, counts = np.unique(header[valid] << 8 | byte(position)[valid], return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                self.values[key >> 8, position, key & 0xff] += count
+
+        self._vectorised_timeline(record, header, byte)
+
+    def _vectorised_timeline(self, record, header, byte):
+        """Hand the messages which may change the timeline to it, in the order they were captured"""
+        tables = self.tables
+        rows = []
+
+        # alarm states, only where the state differs from the state message before it
+        codes = byte(3)
+        state = np.full(len(record), -1)
+        for state_header, table in ((HEADER_JA80_STATE, tables.ja80_state), (HEADER_JA100_STATE, tables.ja100_state)):
+            lookup = np.array([sorted(ALARM_STATES).index(value) if value in ALARM_STATES else -1 for value in table])
+            match = header == state_header
+            state[match] = lookup[codes[match]]
+        index = np.flatnonzero(state >= 0)
+        rows.extend((i, 0) for i in _changes(index, state[index]).tolist())
+
+        # status bitmaps, only where the bitmap differs from the status message before it
+        index = np.flatnonzero(header == HEADER_STATUS)
+        bits = byte(4)[index] | byte(5)[index] << 8
+        rows.extend((i, 1) for i in _changes(index, bits).tolist())
+
+        # sensor and arm messages, only those with a known type
+        known = np.array([tables.sensor_type[code] is not None or tables.arm[code] is not None for code in range(256)])
+        index = np.flatnonzero(np.isin(header, SENSOR_HEADERS) & known[codes])
+        rows.extend((i, 2) for i in index.tolist())
+
+        rows.sort()
+        record, header, codes = record.tolist(), header.tolist(), codes.tolist()
+        byte4, byte5, byte6 = byte(4).tolist(), byte(5).tolist(), byte(6).tolist()
+        timeline = self.timeline
+        for i, kind in rows:
+            if kind == 0:
+                timeline.state(record[i], header[i], codes[i])
+            elif kind == 1:
+                timeline.status(record[i], byte4[i] | byte5[i] << 8)
+            else:
+                timeline.sensor(record[i], header[i], codes[i], byte4[i], byte5[i] | byte6[i] << 8)
+
+    def meaning(self, header, position, value):
+        """Return what a byte value means according to the code tables, None if unknown."""
+        tables = self.tables
+        if position != 3 and not (position == 4 and header in SENSOR_HEADERS):
+            return None
+        if header == HEADER_JA80_STATE:
+            return tables.ja80_state[value]
+        if header == HEADER_JA100_STATE:
+            return tables.ja100_state[value]
+        if header in SENSOR_HEADERS and position == 3:
+            if tables.sensor_type[value] is not None:
+                return 'sensor_type: %s' % tables.sensor_type[value]
+            if tables.arm[value] is not None:
+                return 'arm: %s' % tables.arm[value]
+        if header in SENSOR_HEADERS and position == 4:
+            if tables.sensor_tamper[value] is not None:
+                return 'tamper: %s' % tables.sensor_tamper[value]
+            if tables.sensor_on[value] is not None:
+                return 'on: %s' % tables.sensor_on[value]
+        return None
+
+    def result(self):
+        """Return the analysis as a dict of lists of rows."""
+        return {
+            'summary': {
+                'files': self.files,
+                'records': self.records,
+                'messages': self.messages,
+                'truncated': self.truncated,
+                'resyncs': self.resyncs,
+                'vectorised': np is not None,
+            },
+            'headers': [{'header': '%04x' % header, 'count': count, 'known': header in KNOWN_HEADERS}
+                        for header, count in self.headers.most_common()],
+            'bytes': [{'header': '%04x' % header, 'byte': position, 'value': '%02x' % value, 'count': count,
+                       'meaning': self.meaning(header, position, value)}
+                      for (header, position, value), count in sorted(self.values.items())],
+            'timeline': self.timeline.rows,
+        }
+
+
+def _split(data):
+    """Find the messages of all reports at once.
+
+    Returns the record and offset of every message, in no particular order,
+    and which reports need FrameParser, their messages are not in the result.
+    Those are the reports with a cut off message, or with data after the
+    padding, where the parser searches for known headers.
+    """
+    records = len(data)
+    rows = np.arange(records)
+    offset = np.zeros(records, dtype=np.int64)
+    fallback = np.zeros(records, dtype=bool)
+    found_record, found_offset = [], []
+
+    active = rows
+    while len(active):
+        at = offset[active]
+        kind = data[active, at].astype(np.int64)
+        length = data[active, at + 1].astype(np.int64)
+        end = at + 2 + length
+        message = kind != 0
+        fits = message & (end <= REPORT_SIZE)
+        found_record.append(active[fits])
+        found_offset.append(at[fits])
+        fallback[active[message & ~fits]] = True
+
+        offset[active[fits]] = end[fits]
+        active = active[fits & (end + 2 <= REPORT_SIZE)]
+
+    # offset is where the walk stopped, anything but padding after it needs the parser
+    fallback |= (data.astype(bool) & (np.arange(REPORT_SIZE) >= offset[:, None])).any(axis=1)
+    return np.concatenate(found_record), np.concatenate(found_offset), fallback
+
+
+def _changes(index, values):
+    """Return the part of index where values differs from the value before it, the first always differs."""
+    if not len(index):
+        return index
+    return index[np.concatenate(([True], values[1:] != values[:-1]))]
+
+
+def write_csv(result, prefix):
+    """Write headers, bytes and timeline to <prefix>_<part>.csv, returns the paths."""
+    paths = []
+    for part, fields in (('headers', ('header', 'count', 'known')),
+                         ('bytes', ('header', 'byte', 'value', 'count', 'meaning')),
+                         ('timeline', TIMELINE_FIELDS)):
+        path = '%s_%s.csv' % (prefix, part)
+        with open(path, 'w', newline='') as out:
+            writer = csv.DictWriter(out, fields)
+            writer.writeheader()
+            writer.writerows(result[part])
+        paths.append(path)
+    return paths
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Analyze raw captures of a Jablotron panel, 64 bytes per report.')
+    parser.add_argument('captures', nargs='+', help='capture files, in the order they were captured')
+    parser.add_argument('--codes', help='code overrides, like jablotron/jablotron_codes.yaml')
+    parser.add_argument('--bytes', default=','.join(map(str, DEFAULT_BYTES)),
+                        help='message bytes to make histograms of, numbered from 1 (default %(default)s)')
+    parser.add_argument('--format', choices=('json', 'csv'), default='json')
+    parser.add_argument('--output', help='json: file to write (default stdout), csv: prefix of the files (default jablotron)')
+    args = parser.parse_args(argv)
+
+    positions = [int(position) for position in args.bytes.split(',')]
+    if not all(1 <= position <= REPORT_SIZE for position in positions):
+        parser.error('--bytes must be between 1 and %d' % REPORT_SIZE)
+
+    analysis = Analysis(load_tables(args.codes), positions)
+    for path in args.captures:
+        analysis.add_file(path)
+    result = analysis.result()
+
+    if args.format == 'csv':
+        for path in write_csv(result, args.output or 'jablotron'):
+            print(path, file=sys.stderr)
+    elif args.output:
+        with open(args.output, 'w') as out:
+            json.dump(result, out, indent=1)
+    else:
+        json.dump(result, sys.stdout, indent=1)
+        print()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -19,7 +19,7 @@
  d8 08 00 00 01 00 00 00  00 00 55 09 00 88 00 02  |..........U.....|    : one or multiple devices has been activated
 
  byte number:
-  4 and  5 = accumulated sensor ID's of devices which are ON. See hextobin() function for decoding. This data is not being used right now.
+  4 and  5 = accumulated sensor ID's of devices which are ON, little endian bitmap where bit x is sensor x.
 ------------ the next bytes are not used, but already deciphered
  11 and 12 = if 55 09, a specific sensor recently caused this d8 packet
         14 = specific on/off status of a sensor which has changed state
@@ -48,21 +48,18 @@
 """
 
 import logging
-import binascii
-import sys
-import re
 import time
 import asyncio
 import threading
 import voluptuous as vol
-import os
 
-from . import DOMAIN
+from .protocol import (HEADER_JA80_STATE, HEADER_JA100_STATE, HEADER_STATUS, HEADER_WIRED, HEADER_WIRELESS,
+                       KIND_SENSOR, KIND_TAMPER, STATUS_BITS, decode_status, decode_sensor)
+from .events import EVENT_SENSOR, EVENT_TAMPER, EVENT_ARM
+from .debounce import SensorDebouncer
+from . import DOMAIN, DATA_HUBS, CONF_PANEL, CONF_DATA_TOPIC, CONF_MQTT_EXT_BROKER, CONF_DEVICES_FILE, CONF_USERS_FILE, CONF_DEBOUNCE, CONF_MIN_ON, CONF_OFF_DELAY
 
-from concurrent.futures import ThreadPoolExecutor
-from homeassistant.helpers.entity import Entity
 from homeassistant.components.binary_sensor import (
-    PLATFORM_SCHEMA,
     BinarySensorEntity,
     DEVICE_CLASSES_SCHEMA,
 )
@@ -72,47 +69,49 @@ from homeassistant.const import (
     CONF_NAME,
     CONF_DEVICE_CLASS
 )
-import homeassistant.components.sensor as sensor
 import homeassistant.helpers.config_validation as cv
 
 from homeassistant import util
 from homeassistant.config import load_yaml_config_file, async_log_exception
 from homeassistant.core import callback
 from homeassistant.exceptions import HomeAssistantError
-from homeassistant.helpers.dispatcher import async_dispatcher_connect
 from homeassistant.helpers.typing import ConfigType, HomeAssistantType
 from homeassistant.util.yaml import dump
-#Add MQTT
-from homeassistant.components import mqtt
 
 _LOGGER = logging.getLogger(__name__)
 
 users = []
 devices = []
-YAML_DEVICES = 'jablotron/jablotron_devices.yaml'
 LOG_INFO = 'jablotron/jablotron.log'
-YAML_USERS = 'jablotron/jablotron_users.yaml'
+RESYNC_TIMEOUT = 5
+RESYNC_ATTEMPTS = 5     # status requests per resync, the wait for the status doubles after every request
 
 async def async_setup_platform(hass: HomeAssistantType, config: ConfigType, async_add_entities, discovery_info=None):
-    if not os.path.exists(hass.config.path('jablotron')):
-        os.makedirs(hass.config.path('jablotron'))
-    yaml_path = hass.config.path(YAML_DEVICES)
-    user_path = hass.config.path(YAML_USERS)
-    devices = await async_load_config(yaml_path, hass, config, async_add_entities)
-    users = await async_load_users(user_path, hass, config, async_add_entities)
-    data = DeviceScanner(hass, config, async_add_entities, devices, users)
+    hub = hass.data[DOMAIN][DATA_HUBS][discovery_info[CONF_PANEL]]
+    yaml_path = hass.config.path(hub.config[CONF_DEVICES_FILE])
+    user_path = hass.config.path(hub.config[CONF_USERS_FILE])
+    """Devices and users are read in the executor, at the same time"""
+    devices, users = await asyncio.gather(
+        async_load_config(yaml_path, hass, config, async_add_entities),
+        async_load_users(user_path, hass, config, async_add_entities))
+    scanner = DeviceScanner(hass, hub, async_add_entities, devices, users)
+    scanner.start()
 
 
 class JablotronSensor(BinarySensorEntity):
     """Representation of a Sensor."""
 
-    def __init__(self, hass: HomeAssistantType, dev_id: str, name: str, device_class: DEVICE_CLASSES_SCHEMA):
+    def __init__(self, hass: HomeAssistantType, dev_id: str, name: str, device_class: DEVICE_CLASSES_SCHEMA, min_on: float = None, off_delay: float = None):
         self._hass = hass
         self._name = 'Jablotron sensor'
         self._state = STATE_OFF
         self.dev_id = dev_id
         self.dev_name = name
         self.dev_class = device_class
+        self.min_on = min_on
+        self.off_delay = off_delay
+        self._history = None
+        self._number = None
         _LOGGER.info('JablotronSensor.__init__(): dev_id created: %s name: %s class: %s', self.dev_id, self.dev_name, self.dev_class)
 
     @property
@@ -144,7 +143,20 @@ class JablotronSensor(BinarySensorEntity):
     def device_class(self):
         return self.dev_class
 
-    async def async_seen(self, state: str = None):
+    @property
+    def extra_state_attributes(self):
+        """Return the last trip and the trips of the last hour and day, from the event history."""
+        if self._history is None:
+            return None
+        return self._history.attributes(self._number)
+
+    def attach_history(self, history, number):
+        """Show the event history of the sensor with that number as attributes."""
+        self._history = history
+        self._number = number
+
+    @callback
+    def async_seen(self, state: str = None):
         """Mark the device as seen."""
         if self._state != state:
             self._state = state
@@ -157,31 +169,36 @@ class JablotronSensor(BinarySensorEntity):
 class DeviceScanner():
     """ Read configuration and serial port and check for incoming data"""
 
-    def __init__(self, hass, config, async_add_entities, devices, users):
+    def __init__(self, hass, hub, async_add_entities, devices, users):
         self._state = None
         self._sub_state = None
-        self._file_path = hass.data[DOMAIN]['port']
+        self._hub = hub
+        self._file_path = hub.port
         self._available = False
-        self._f = None
         self._hass = hass
-        self._config = config
         self._model = 'Unknown'
         self._lock = threading.BoundedSemaphore()
-        self._stop = threading.Event()
-        self._data_flowing = threading.Event()
         self._async_add_entities = async_add_entities
         self.devices = {dev.dev_id: dev for dev in devices}
+        for device in devices:
+            self._attach_history(device)
         self.users = users
         self._is_updating = asyncio.Lock()
-        self._activation_packet = b''
+        """ activation packet containing the alarm code, to trigger the right sensor packets """
+        self._activation_packet = hub.commands.activation
         self._mode = '55'
+        self._devices_path = hass.config.path(hub.config[CONF_DEVICES_FILE])
+        self._debounce = hub.config[CONF_DEBOUNCE]
+        self._debouncers = {}
+        self._resync_pending = False
+        self._resync_attempts = 0
+        self._new_devices = []
 
-        """ default binary strings for comparing states in d8 packets """
-        self._old_bin_string = '0'.zfill(32)
-        self._new_bin_string = '0'.zfill(32)
+        """ default bitmap for comparing states in d8 packets, bit x is sensor x """
+        self._old_bits = 0
 
         """Since MQTT is run on separate instance I will connect directly"""        
-        if hass.data[DOMAIN]['mqtt_external']:
+        if hub.config[CONF_MQTT_EXT_BROKER]:
             self._mqtt_enabled = True
             _LOGGER.info("(__init__) MQTT external: %s", self._mqtt_enabled)
         else:
@@ -190,46 +207,20 @@ class DeviceScanner():
         
         if self._mqtt_enabled:
           self._mqtt = hass.components.mqtt
-          self._data_topic = hass.data[DOMAIN]['data_topic']
+          self._data_topic = hub.config[CONF_DATA_TOPIC]
 
         _LOGGER.info('DeviceScanner.__init__(): serial port: %s', format(self._file_path))
 
-        switcher = {
-            "0": b'\x30',
-            "1": b'\x31',
-            "2": b'\x32',
-            "3": b'\x33',
-            "4": b'\x34',
-            "5": b'\x35',
-            "6": b'\x36',
-            "7": b'\x37',
-            "8": b'\x38',
-            "9": b'\x39'
-        }
-
-        try:
-
-            """ generate activation packet containing the alarm code, to trigger the right sensor packets """
-            packet_code = b''
-            for c in hass.data[DOMAIN]['code']:
-                packet_code = packet_code + switcher.get(c)
-            self._activation_packet = b'\x80\x08\x03\x39\x39\x39' + packet_code
-
-            hass.bus.async_listen('homeassistant_stop', self.shutdown_threads)
-
-            self._io_pool_exc = ThreadPoolExecutor(max_workers=5)
-            self._read_loop_future = self._io_pool_exc.submit(self._read_loop)
-            self._watcher_loop_keepalive_future = self._io_pool_exc.submit(self._watcher_loop_keepalive)
-            self._watcher_loop_triggersensorupdate_future = self._io_pool_exc.submit(self._watcher_loop_triggersensorupdate)
-
-
-        except Exception as ex:
-            _LOGGER.error('Unexpected error 1: %s', format(ex) )
-
-    def shutdown_threads(self, event):
-        _LOGGER.debug('DeviceScanner.shutdown_threads: handle_shutdown() called' )
-        self._stop.set()
-        _LOGGER.debug('DeviceScanner.shutdown_threads: exiting handle_shutdown()' )
+    def start(self):
+        """Start handling the reports of the hub and sending the keepalive and sensor update packets."""
+        self._hub.add_handler(self._read)
+        self._hub.add_resync_handler(self._resync)
+        self._hub.add_snapshot_handler(self._snapshot)
+        """A reader daemon sends the keepalive itself, while Home Assistant is restarting too"""
+        if not self._hub.transport.sends_keepalive:
+            self._hub.add_watcher(0.5, self._watcher_keepalive)
+        """The port may have been opened before, read the status of the sensors once now"""
+        self._resync()
 
     @property
     def name(self):
@@ -248,259 +239,264 @@ class DeviceScanner():
 
 
 
-    def _watcher_loop_keepalive(self):
-        """Trigger keepalive message to get d8 08 packets."""
-        while not self._stop.is_set():
-            if not self._data_flowing.wait(0.5):
-                self._keepalive()
-            else:
-                time.sleep(1)
-
-    def _watcher_loop_triggersensorupdate(self):
-        """Trigger authentication message to get 55 09 packets."""
-        while not self._stop.is_set():
-            if not self._data_flowing.wait(0.5):
-                self._triggersensorupdate()
-            else:
-                time.sleep(10)
-
-    def _read_loop(self):
-        """Read incoming data"""
-        try:
-            while not self._stop.is_set():
-
-                self._f = open(self._file_path, 'rb', 64)
-                new_state = self._read()
-
-                self._f.close()
-                time.sleep(0.5)
-
-        except Exception as ex:
-            _LOGGER.error('DeviceScanner._read_loop(): Unexpected error: %s', format(ex) )
-
-        finally:
-            _LOGGER.debug('DeviceScanner._read_loop(): Exiting _read_loop()' )
-
-    # function to transform a hex string into a binary string
-    def _hextobin(self, hexstring):
-        dec = int.from_bytes(hexstring, byteorder=sys.byteorder) # turn to 'little' if sys.byteorder is wrong
-        bin_dec = bin(dec)
-        binstring = bin_dec[2:]
-        binstring = binstring.zfill(32)
-        revstring = binstring [::-1]
-        return revstring
+    def _watcher_keepalive(self):
+        """Trigger keepalive message to get d8 08 packets, runs on the io thread."""
+        if self._hub.idle_for(0.5):
+            self._keepalive()
+            return 0.5
+        return 1
 
+    def _resync(self):
+        """Request the full sensor status, called from the io thread after (re)connect or a gap."""
+        if self._resync_pending or self._model == 'Jablotron JA-80 Series':
+            return
+        self._resync_pending = True
+        self._resync_attempts = 0
+        self._hub.add_watcher(0, self._watcher_resync)
 
+    def _watcher_resync(self):
+        """Send the status request until the status arrived, runs on the io thread.
 
-    async def async_see(self, dev_id: str = None, state: str = None):
-        """Create binary sensor.
-        This method is a coroutine.
+        JA-80 panels never answer it, so it is not sent once the panel is
+        known to be a JA-80. While the model is still unknown it is sent
+        anyway, at most RESYNC_ATTEMPTS times with a growing wait in between.
         """
+        if not self._resync_pending or self._hub.stopped:
+            return None
+        if self._model == 'Jablotron JA-80 Series':
+            """JA-80 panels never answer with a status"""
+            self._resync_pending = False
+            return None
+        if self._resync_attempts >= RESYNC_ATTEMPTS:
+            _LOGGER.warning('DeviceScanner: no status after %d requests, giving up until the next resync', RESYNC_ATTEMPTS)
+            self._resync_pending = False
+            return None
+
+        if self._resync_attempts:
+            _LOGGER.debug('DeviceScanner: no status after resync request %d, repeating it', self._resync_attempts)
+        self._triggersensorupdate()
+        self._resync_attempts += 1
+        return RESYNC_TIMEOUT * 2 ** (self._resync_attempts - 1)
+
+    @callback
+    def async_see(self, dev_id: str = None, state: str = None):
+        """Update or create a binary sensor, runs on the event loop."""
 
         dev_id = cv.slug(str(dev_id).lower())
         device = self.devices.get(dev_id)
 
-        """State received of already known device"""
+        """State received of already known device, passed on through its debouncer"""
         if device:
-            await device.async_seen(state)
-            await device.async_update_ha_state()
+            debouncer = self._debouncers.get(dev_id)
+            if debouncer is None:
+                debouncer = self._debouncers[dev_id] = self._create_debouncer(device)
+            debouncer.async_update(state)
             return
 
         """State received of unknown device, default device class is motion"""
         dev_id = util.ensure_unique_string(dev_id, self.devices.keys())
         device = JablotronSensor(self._hass, dev_id, 'unknown', 'motion')
+        self._attach_history(device)
         self.devices[dev_id] = device
+        device.async_seen(state)
+
+        """New devices seen in the same hand-off are added together, once it is done"""
+        if not self._new_devices:
+            self._hass.loop.call_soon(self._async_add_new_devices)
+        self._new_devices.append(device)
 
-        await device.async_seen(state)
+    @callback
+    def _async_add_new_devices(self):
+        """Add the new devices in one batch, runs on the event loop."""
+        new_devices, self._new_devices = self._new_devices, []
 
-        """Update known_devices.yaml"""
+        """Update known_devices.yaml, all new devices at once"""
         self._hass.async_create_task(
-            self.async_update_config(
-                self._hass.config.path(YAML_DEVICES), dev_id, device)
+            self.async_update_config(self._devices_path, new_devices)
         )
 
-        self._async_add_entities([device])
-        _LOGGER.info('DeviceScanner.async_see(): added entity %s', device)
-        
+        self._async_add_entities(new_devices)
+        _LOGGER.info('DeviceScanner.async_see(): added entities %s', ', '.join(device.dev_id for device in new_devices))
 
 
-    async def async_update_config(self, path, dev_id, device):
-        """Add device to YAML configuration file.
+
+    def _create_debouncer(self, device):
+        """Debouncer of a device, settings of the device itself override those of its device_class"""
+        settings = self._debounce.get(device.dev_class, {})
+        min_on = device.min_on if device.min_on is not None else settings.get(CONF_MIN_ON, 0)
+        off_delay = device.off_delay if device.off_delay is not None else settings.get(CONF_OFF_DELAY, 0)
+        return SensorDebouncer(self._hass.loop, device, min_on, off_delay)
+
+    async def async_update_config(self, path, devices):
+        """Add devices to YAML configuration file.
         This method is a coroutine.
         """
         async with self._is_updating:
             await self._hass.async_add_executor_job(
-                update_config, self._hass.config.path(YAML_DEVICES),
-                dev_id, device)
-
-    def _read(self):
-        """Read incoming data on port"""
+                update_config, path, devices)
+
+    def _read(self, report):
+        """Handle the messages of a report read by the hub, called from the io thread"""
+        if report is None:
+            _LOGGER.warn("PortScanner._read(): No packets")
+            self._available = False
+            return 'No Signal'
+
+        self._state = True
+
+        offsets = report.offsets
+        last = len(offsets) - 1
+        for idx, offset in enumerate(offsets):
+            """A d8 08 message directly followed by a 55 message reports about 1 specific device"""
+            followed_by_55 = idx < last and report.data[offsets[idx + 1]] == 0x55
+            self._read_frame(report, offset, followed_by_55)
+
+    def _read_frame(self, report, offset, followed_by_55):
+        """Decode a single message, fields are read as integers from the report"""
+        data = report.data
+        header = report.header(offset)
         try:
-            while True:
-
-                """Try to read data"""
-                self._data_flowing.clear()
-                packet = self._f.read(64)
-                self._data_flowing.set()
-
-                if not packet:
-                    _LOGGER.warn("PortScanner._read(): No packets")
-                    self._available = False
-                    return 'No Signal'
-
-                self._state = True
-
-                """If data can be read, scan for specific incoming packets"""
-                if packet[:2] == b'\xd8\x08':
-
-                    _LOGGER.debug('PortScanner._read(): d8 08 packet, part 1: %s', str(binascii.hexlify(packet[0:8]), 'utf-8'))
-                    _LOGGER.debug('PortScanner._read(): d8 08 packet, part 2: %s', str(binascii.hexlify(packet[8:16]), 'utf-8'))
-
-                    byte3 = packet[2:3]  # 3rd byte unknown, always 00
-                    byte4 = packet[3:4]  # 4th byte, last part of id
-                    byte5 = packet[4:5]  # 5th byte, first part of id
-
-                    """Decode sensor ID from 4th and 5th byte, create a binary string and compare this with the last generated binary string. 0 = OFF, 1 = ON"""
-                    self._new_bin_string = self._hextobin(byte4+byte5)
-                    _LOGGER.debug('PortScanner._read(): old_bin_string: %s', self._old_bin_string)
-                    _LOGGER.debug('PortScanner._read(): new_bin_string: %s', self._new_bin_string)
-
-                    for idx, (x, y) in enumerate(zip(self._old_bin_string, self._new_bin_string)):
-                      
-                        """Continue for devices which has been changed to ON or OFF."""
-                        if x != y:
-
-                            dev_id = 'jablotron_' + str(idx)
-                            entity_id = 'binary_sensor.' + dev_id
-
-                            if y == '1':
-                                _device_state = STATE_ON
-                            else:
-                                _device_state = STATE_OFF
-
-                            """Only create or update a sensor when this packet is the first d8 08 packet received since startup,
-                               or if d8 08 packet reports about 1 specific device (by containing a 55 packet) or,
-                               or if a specific device is not active anymore (y == '0')"""
-                            if self._mode == 'd8' or (self._mode == '55' and (self._available == False or (y == '1' and packet[10:11] == b'\x55') or y == '0')):
-
-                                """ Create or update sensor """
-                                self._hass.add_job(
-                                    self.async_see(dev_id, _device_state)
-                                )
-
-                    """Retain last binary string"""
-                    _LOGGER.debug('PortScanner._read(): updating bin string to %s', self._new_bin_string)
-                    self._old_bin_string = self._new_bin_string
-
-                    """Set available to True since we know which devices are ON"""
-                    self._available = True
-
-
-                elif self._mode == '55' and packet[:2] in (b'\x55\x08', b'\x55\x09'):
-
-                    _LOGGER.debug('PortScanner._read(): %s packet, part 1: %s', str(binascii.hexlify(packet[0:2]), 'utf-8'), str(binascii.hexlify(packet[0:8]), 'utf-8'))
-                    _LOGGER.debug('PortScanner._read(): %s packet, part 2: %s', str(binascii.hexlify(packet[0:2]), 'utf-8'), str(binascii.hexlify(packet[8:16]), 'utf-8'))
-
-                    packetpart = packet[0:10]
-
-                    byte3 = packetpart[2:3]  # 3rd byte, ??
-                    byte4 = packetpart[3:4]  # 4th byte, state of device
-                    byte5 = packetpart[4:5]  # 5th byte, first part of device ID
-                    byte6 = packetpart[5:6]  # 6th byte, second part of device ID                    
-                    _LOGGER.debug('Sensor ID: %s%s : State: %s', str(binascii.hexlify(byte5), 'utf-8'), str(binascii.hexlify(byte6), 'utf-8'), str(binascii.hexlify(byte4), 'utf-8') )
-                    """Enable when finding Sensors"""
-                    # log = "device: %s%s : state: %s" % (str(binascii.hexlify(byte5), 'utf-8'), str(binascii.hexlify(byte6), 'utf-8'), str(binascii.hexlify(byte4), 'utf-8'))
-                    # write_log(self._hass, log)
-                    
-
-#                    _LOGGER.info('State: %s', str(binascii.hexlify(byte4), 'utf-8') )
-                    
-                    """Only process specific state changes"""
-                    if byte3 in (b'\x00', b'\x01', b'\x80'):
-						# Added 80 for upstairs
-                        if byte4 in (b'\x6c', b'\x70', b'\x74', b'\x78', b'\x7c', b'\x80', b'\x84', b'\x88', b'\x8c'):
-						# 6c Groventre Dörr     (6e) 4000
-                        # 70 Förrådet           (72) 8000
-                        # 74 Huvudentre         (76) C000
-						# 78 Kontoret           (7a) 0001
-                        # 7c Lillhallen         (7e) 4001
-                        # 80 Huvudentre Dörr    (82) 8001
-                        # 84 Sovrum             (86) C001
-                        # 88 vardagsrummet      (8a) 0002
-						# 8c Hallen ovan        (8e) 4002
-						
-                            _device_state = STATE_ON
-                        else:
-                            _device_state = STATE_OFF
-
-                        """Decode sensor ID from 5th and 6th byte"""
-                        dec = int.from_bytes(byte5+byte6, byteorder=sys.byteorder) # turn to 'little' if sys.byteorder is wrong
-                        i = int(dec/64)
-                        dev_id = 'jablotron_' + str(i)
-                        entity_id = 'binary_sensor.' + dev_id
+            """Scan for specific incoming messages"""
+            if header == HEADER_STATUS:
+
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    _LOGGER.debug('PortScanner._read(): d8 08 packet: %s', report.frame(offset).hex())
+
+                """Decode sensor ID's from 4th and 5th byte, bit x is ON for sensor x. Compare this with the last bitmap."""
+                new_bits = decode_status(report, offset)
+                resync = self._resync_pending
+                if resync:
+                    """Requested full status, compare with the sensors which are ON now"""
+                    self._resync_pending = False
+                    changed = new_bits ^ self._sensors_on()
+                else:
+                    changed = new_bits ^ self._old_bits
+
+                while changed:
+                    """Continue for devices which has been changed to ON or OFF."""
+                    bit = changed & -changed
+                    changed ^= bit
+                    idx = bit.bit_length() - 1
+                    is_on = bool(new_bits & bit)
+
+                    """Only create or update a sensor when this packet is the first d8 08 packet received since startup,
+                       or if d8 08 packet reports about 1 specific device (by containing a 55 packet) or,
+                       or if a specific device is not active anymore"""
+                    if resync or self._mode == 'd8' or (self._mode == '55' and (self._available == False or (is_on and followed_by_55) or not is_on)):
+
+                        _device_state = STATE_ON if is_on else STATE_OFF
+
                         """ Create or update sensor """
-                        self._hass.add_job(
-                            self.async_see(dev_id, _device_state)
-                        )
-
-                        """If armed_home, armed_away or disarmed sent. this and who did the action will be sent to MQTT broker"""
-                    elif byte3 in (b'\xae', b'\x0c', b'\x2e'):
-                        if byte3 == b'\xae':
-                            state = '{"state":"armed_home",'
-                        elif byte3 == b'\x0c':
-                            state = '{"state":"disarm",'
-                        elif byte3 == b'\x2e':
-                            state = '{"state":"armed_away",'
-
-                        if self._mqtt_enabled:                            
-                            payload = state + translate_hex(self._hass, str(binascii.hexlify(byte4), 'utf-8'), self.users)
-                            write_log(self._hass, payload)
-                            self._mqtt.publish(self._data_topic, payload , retain=True)
-
-                    else:
-                        _LOGGER.info("New unknown %s packet: %s %s %s %s", str(binascii.hexlify(packet[0:2]), 'utf-8'), str(binascii.hexlify(byte3), 'utf-8'), str(binascii.hexlify(byte4), 'utf-8'), str(binascii.hexlify(byte5), 'utf-8'), str(binascii.hexlify(byte6), 'utf-8'))
-                        _LOGGER.info('PortScanner._read(): %s packet, part 1: %s', str(binascii.hexlify(packet[0:2]), 'utf-8'), str(binascii.hexlify(packet[0:8]), 'utf-8'))
-                        _LOGGER.info('PortScanner._read(): %s packet, part 2: %s', str(binascii.hexlify(packet[0:2]), 'utf-8'), str(binascii.hexlify(packet[8:16]), 'utf-8'))
+                        self._sensor_seen(idx, _device_state)
+
+                """Retain last bitmap"""
+                self._old_bits = new_bits
+
+                """Set available to True since we know which devices are ON"""
+                self._available = True
+
+
+            elif header == HEADER_JA80_STATE:
+                """The model decides whether the status can be requested, the state itself is read by the alarm panel"""
+                self._model = 'Jablotron JA-80 Series'
+
+            elif header == HEADER_JA100_STATE:
+                self._model = 'Jablotron JA-100 Series'
+
+            elif self._mode == '55' and header in (HEADER_WIRED, HEADER_WIRELESS):
+
+                byte4 = data[offset + 3]  # 4th byte, state of device
+                byte5 = data[offset + 4]  # 5th byte, first part of device ID
+                byte6 = data[offset + 5]  # 6th byte, second part of device ID
+                if _LOGGER.isEnabledFor(logging.DEBUG):
+                    _LOGGER.debug('PortScanner._read(): %04x packet: %s', header, report.frame(offset).hex())
+                    _LOGGER.debug('Sensor ID: %02x%02x : State: %02x', byte5, byte6, byte4)
+                """Enable when finding Sensors"""
+                # log = "device: %02x%02x : state: %02x" % (byte5, byte6, byte4)
+                # write_log(self._hass, log)
+
+                """Only process specific state changes, the sensor ID is decoded from the 5th and 6th byte"""
+                decoded = decode_sensor(self._hub.codes, report, offset)
+                if decoded is None:
+                    self._hub.unknown_frame(report, offset)
+                    return
+                kind, subject, value = decoded
 
+                if kind == KIND_TAMPER:
+                    dev_id = self._hub.sensor_prefix + '_' + str(subject)
+                    self._hub.history.add_tamper(subject, value)
+                    self._hub.events.fire(EVENT_TAMPER, dev_id, value)
+
+                elif kind == KIND_SENSOR:
+                    """ Create or update sensor """
+                    self._sensor_seen(subject, STATE_ON if value else STATE_OFF)
+
+                    """If armed_home, armed_away or disarmed sent. this and who did the action will be sent to MQTT broker"""
                 else:
-#                    log = "Unknown packet: %s" % str(binascii.hexlify(packet))
-#                    write_log(self._hass, log)
-                    pass
-#                    _LOGGER.info("Unknown packet: %s", packet)
-#                    self._stop.set()
+                    user_id = '%02x' % value
+                    local, user_name = lookup_user(self._hass, user_id, self.users)
+                    self._hub.history.add_arm(subject, value)
+                    self._hub.events.fire(EVENT_ARM, subject, user_name, local)
 
-        except (IndexError, FileNotFoundError, IsADirectoryError, UnboundLocalError, OSError):
-            _LOGGER.warning("PortScanner._read(): File or data not present at the moment: %s", self._file_path)
-            return 'Failed'
+                    if self._mqtt_enabled:
+                        state = '{"state":"%s",' % subject
+                        payload = state + translate_hex(self._hass, user_id, self.users)
+                        write_log(self._hass, payload)
+                        self._mqtt.publish(self._data_topic, payload , retain=True)
 
         except Exception as ex:
             _LOGGER.error('PortScanner._read(): Unexpected error 3: %s', format(ex) )
-            return 'Failed'
-
-        return state
 
-    def _sendPacket(self, packet):
-        f = open(self._file_path, 'wb')
-        f.write(packet)
-        time.sleep(0.1) # lower reliability without this delay
-        f.close()
+    def _sensor_seen(self, number, state):
+        """Record and fire the sensor event and create or update the sensor, only its latest state is kept while the event loop is busy"""
+        dev_id = self._hub.sensor_prefix + '_' + str(number)
+        self._hub.history.add_sensor(number, state == STATE_ON)
+        self._hub.events.fire(EVENT_SENSOR, dev_id, state)
+        self._hub.handoff.put_latest(('binary_sensor', dev_id), self.async_see, dev_id, state)
+
+    def _snapshot(self):
+        """Return the d8 08 bitmap and the state and last change of every sensor, for JablotronHub.snapshot()"""
+        prefix = self._hub.sensor_prefix + '_'
+        changes = self._hub.history.changes()
+        sensors = {}
+        for dev_id, device in list(self.devices.items()):
+            number = dev_id[len(prefix):]
+            changed = changes.get(int(number)) if dev_id.startswith(prefix) and number.isdigit() else None
+            sensors[dev_id] = {'name': device.name, 'device_class': device.device_class,
+                               'state': device.state, 'last_change': changed}
+        return {'mode': self._mode, 'bitmap': '%04x' % self._old_bits, 'sensors': sensors}
+
+    def _attach_history(self, device):
+        """Show the event history of this panel on a sensor named prefix_number"""
+        prefix = self._hub.sensor_prefix + '_'
+        number = device.dev_id[len(prefix):]
+        if device.dev_id.startswith(prefix) and number.isdigit():
+            device.attach_history(self._hub.history, int(number))
+
+    def _sendPacket(self, packet, kind):
+        self._hub.send_packet(packet, kind)
+
+    def _sensors_on(self):
+        """Return the bitmap of the sensors of this panel which are ON, bit x is sensor x"""
+        prefix = self._hub.sensor_prefix + '_'
+        bits = 0
+        for dev_id, device in list(self.devices.items()):
+            number = dev_id[len(prefix):]
+            if device.is_on and dev_id.startswith(prefix) and number.isdigit():
+                bits |= 1 << int(number)
+        return bits & STATUS_BITS
 
     def _triggersensorupdate(self):
-        """ Send trigger for sensor update to system"""
+        """ Send trigger for sensor update to system, the panel answers with the full d8 08 status"""
 
-
-        self._sendPacket(self._activation_packet)
-        self._sendPacket(b'\x52\x02\x13\x05\x9a')
-
-        # Sending OFF signal
-        for dev_id, device in self.devices.items():
-            self._hass.add_job(
-                self.async_see(dev_id, STATE_OFF)
-            )
+        if self._activation_packet is None:
+            self._sendPacket(b'\x52\x02\x13\x05\x9a', 'resync')
+            return
+        self._hub.send_packets((self._activation_packet, b'\x52\x02\x13\x05\x9a'), 'resync')
 
     def _keepalive(self):
         """ Send keepalive to system"""
-        self._sendPacket(b'\x52\x01\x02')
+        self._sendPacket(b'\x52\x01\x02', 'keepalive')
 
 
 
@@ -511,7 +507,9 @@ async def async_load_config(path: str, hass: HomeAssistantType, config: ConfigTy
     dev_schema = vol.Schema({
         vol.Required('dev_id'): cv.string,
         vol.Optional(CONF_NAME, default=''): cv.string,
-        vol.Optional(CONF_DEVICE_CLASS, default='motion'): DEVICE_CLASSES_SCHEMA
+        vol.Optional(CONF_DEVICE_CLASS, default='motion'): DEVICE_CLASSES_SCHEMA,
+        vol.Optional(CONF_MIN_ON): vol.All(vol.Coerce(float), vol.Range(min=0)),
+        vol.Optional(CONF_OFF_DELAY): vol.All(vol.Coerce(float), vol.Range(min=0)),
 #        vol.Optional(CONF_ICON, default=None): vol.Any(None, cv.icon),
 #        vol.Optional('track', default=False): cv.boolean,
 #        vol.Optional(CONF_MAC, default=None):
@@ -526,7 +524,7 @@ async def async_load_config(path: str, hass: HomeAssistantType, config: ConfigTy
     try:
         _LOGGER.debug("async_load_config(): reading config file %s", path)
 
-        devices = await hass.async_add_job(
+        devices = await hass.async_add_executor_job(
             load_yaml_config_file, path)
 
         _LOGGER.debug('async_load_config(): devices loaded from config file: %s', devices)
@@ -539,6 +537,7 @@ async def async_load_config(path: str, hass: HomeAssistantType, config: ConfigTy
         return []
 
 
+    """Validate all devices in one pass"""
     for dev_id, device in devices.items():
         # Deprecated option. We just ignore it to avoid breaking change
 #        device.pop('vendor', None)
@@ -549,30 +548,30 @@ async def async_load_config(path: str, hass: HomeAssistantType, config: ConfigTy
             async_log_exception(exp, dev_id, devices, hass)
         else:           
             _LOGGER.debug('device: %s', device)
-            dev = JablotronSensor(hass, **device)
-            result.append(dev)
+            result.append(JablotronSensor(hass, **device))
 
-            """ Create sensors for each device in devices """
-#            device = JablotronSensor(hass, dev_id)
-            async_add_entities([dev])        
+    """ Create sensors for all devices at once """
+    if result:
+        async_add_entities(result)
     return result
 
-def update_config(path: str, dev_id: str, device: JablotronSensor):
-    """Add device to YAML configuration file."""
+def update_config(path: str, devices):
+    """Add devices to YAML configuration file."""
 
     with open(path, 'a') as out:
-        device = {device.dev_id: {
-            'dev_id': device.dev_id,
-#            ATTR_NAME: device._name,
-#            ATTR_MAC: sensor.mac,
-#            ATTR_ICON: sensor.icon,
-#            'picture': sensor.config_picture,
-#            'track': sensor.track,
-#            CONF_AWAY_HIDE: sensor.away_hide,
-        }}
-        out.write('\n')
-        out.write(dump(device))
-    _LOGGER.debug('update_config(): updated %s with sensor %s', path, dev_id)
+        for device in devices:
+            device = {device.dev_id: {
+                'dev_id': device.dev_id,
+#                ATTR_NAME: device._name,
+#                ATTR_MAC: sensor.mac,
+#                ATTR_ICON: sensor.icon,
+#                'picture': sensor.config_picture,
+#                'track': sensor.track,
+#                CONF_AWAY_HIDE: sensor.away_hide,
+            }}
+            out.write('\n')
+            out.write(dump(device))
+    _LOGGER.debug('update_config(): updated %s with sensors %s', path, ', '.join(device.dev_id for device in devices))
 
 def write_log(hass, log: str):
     """Internal log function in order to save over a longer time then ordinary debug log"""
@@ -587,19 +586,22 @@ def write_log(hass, log: str):
         out.write('\n')
         out.write(log)
 
-def translate_hex(hass, hex: str, users):
-    """Translate the hex user code into a User from the saved YAML"""
+def lookup_user(hass, hex: str, users):
+    """Return (local, user name) of the hex user code from the saved YAML"""
     for user in users:
         if user['remote_id'] == hex:
-            response = '"local":"false","user":"%s"}' % ( user['user_name'] )
-            return response
+            return 'false', user['user_name']
         elif user['local_id'] == hex:
-            response = '"local":"true","user":"%s"}' % ( user['user_name'] )
-            return response
-    
-    log = "Unknown ID armed/disarmed: %s" % (hex)
-    write_log(hass, log)
-    return '"local":"unknown","user":"unknown"}' 
+            return 'true', user['user_name']
+    return 'unknown', 'unknown'
+
+def translate_hex(hass, hex: str, users):
+    """Translate the hex user code into a User from the saved YAML"""
+    local, user_name = lookup_user(hass, hex, users)
+    if local == 'unknown':
+        log = "Unknown ID armed/disarmed: %s" % (hex)
+        write_log(hass, log)
+    return '"local":"%s","user":"%s"}' % (local, user_name)
 
 
 async def async_load_users(path: str, hass: HomeAssistantType, config: ConfigType, async_add_entities):
@@ -613,7 +615,7 @@ async def async_load_users(path: str, hass: HomeAssistantType, config: ConfigTyp
     result = []
     try:
         _LOGGER.debug("async_load_users(): reading config file %s", path)
-        users = await hass.async_add_job(
+        users = await hass.async_add_executor_job(
             load_yaml_config_file, path)
 
         _LOGGER.debug('async_load_users(): devices loaded from config file: %s', users)
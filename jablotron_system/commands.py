@@ -0,0 +1,90 @@
+"""Jablotron command packets
+
+ The packets sent to the panel, built once per panel instead of on every
+ command. Every packet is one HID report, so it is written on its own:
+
+ JA-100 series
+  80 08 03 30 + code digits   : submit the code
+  80 02 0d 90                 : disarm
+  80 02 0d a0                 : arm away
+  80 02 0d b0                 : arm home
+  80 08 03 39 39 39 + code    : activation, makes the panel send the sensor
+                                messages (see binary_sensor.py)
+  digits are sent as ASCII, 1 is 31
+
+ JA-80 series
+  00 02 01 + key              : one key press, digits are 80 to 89, # is 8e
+                                and * is 8f
+
+ This module does not depend on Home Assistant.
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+JA100_DIGITS = {str(digit): 0x30 + digit for digit in range(10)}
+JA80_KEYS = dict({str(digit): 0x80 + digit for digit in range(10)}, **{'#': 0x8e, '?': 0x8e, '*': 0x8f})
+
+JA100_SUBMIT_CODE = b'\x80\x08\x03\x30'
+JA100_ACTIVATION = b'\x80\x08\x03\x39\x39\x39'
+JA100_ACTIONS = {
+    '*0': b'\x80\x02\x0d\x90',  # disarm
+    '*1': b'\x80\x02\x0d\xa0',  # arm away
+    '*2': b'\x80\x02\x0d\xb0',  # arm home
+}
+JA80_KEY = b'\x00\x02\x01'
+JA80_ACTIONS = ('*0', '*1', '*2', '*3')
+
+
+def encode(code, keys):
+    """Return the code as key bytes, raises ValueError for a key the panel does not have."""
+    try:
+        return bytes(keys[key] for key in code)
+    except KeyError as ex:
+        raise ValueError('invalid key %s in code' % ex) from None
+
+
+class CommandEncoder():
+    """Packets of one panel for its configured code, built once and served from a cache"""
+
+    def __init__(self, code):
+        self.activation = None
+        self._ja100 = {}
+        self._ja80 = {}
+        try:
+            self.activation = JA100_ACTIVATION + encode(code, JA100_DIGITS)
+            known_codes = (code, '')
+        except ValueError as ex:
+            _LOGGER.error('CommandEncoder: the configured code cannot be sent to the panel: %s', format(ex))
+            known_codes = ('',)
+
+        for known in known_codes:
+            submit = JA100_SUBMIT_CODE + encode(known, JA100_DIGITS)
+            for action, packet in JA100_ACTIONS.items():
+                self._ja100[action, known] = (submit, packet)
+            for action in JA80_ACTIONS:
+                self._ja80[action, known] = self._build_ja80(action + known)
+
+    def ja100(self, action, code):
+        """Return the packets to submit code and take action, in the order they are sent.
+
+        Raises KeyError for an action the JA-100 series has no packet for.
+        """
+        code = code or ''
+        packets = self._ja100.get((action, code))
+        if packets is None:
+            packets = (JA100_SUBMIT_CODE + encode(code, JA100_DIGITS), JA100_ACTIONS[action])
+        return packets
+
+    def ja80(self, action, code):
+        """Return the key presses of action followed by code, one packet per key."""
+        code = code or ''
+        packets = self._ja80.get((action, code))
+        if packets is None:
+            packets = self._build_ja80(action + code)
+        return packets
+
+    @staticmethod
+    def _build_ja80(keys):
+        return tuple(JA80_KEY + bytes((key,)) for key in encode(keys, JA80_KEYS))
@@ -0,0 +1,227 @@
+"""Jablotron reader daemon
+
+ Optional standalone process which owns the port of one panel, so reading
+ and keeping the link alive do not compete with Home Assistant for the GIL,
+ a stalled or restarting Home Assistant does not drop the link to the panel,
+ and the daemon can be pinned to its own core (taskset). Run it with any
+ python 3, next to protocol.py, transport.py and runtime.py:
+
+   python custom_components/jablotron_system/daemon.py --port /dev/hidraw0 --socket /run/jablotron/panel.sock
+
+ and point the port option of the panel to the socket:
+
+   port: unix:///run/jablotron/panel.sock
+
+ Every report read from the port is split into messages (see protocol.py),
+ reports without messages are dropped and the others are cut off after their
+ last message. These compact reports are streamed to every connected client
+ as records of a kind byte, a length byte and the payload (see transport.py).
+ With --frames every message is also run through the decoders of the
+ platforms, with the code tables of the component and the overrides given
+ with --codes, and streamed as a decoded frame, a JSON object like
+
+   {"type":"sensor","sensor":7,"state":"on"}
+
+ so other clients do not have to know the protocol. Home Assistant only
+ reads the reports, so the frames are off by default and do not cost the
+ daemon and Home Assistant their decoding and skipping. Clients send
+ packets for the panel back the same way, they are written in the order
+ they arrive. While no data arrives the daemon sends the keepalive of the
+ binary sensor platform itself, so the panel keeps sending, Home Assistant
+ does not send its own through the daemon.
+
+ Opening, reading and writing the port is shared with the hub (see link.py).
+
+ This module does not depend on Home Assistant.
+"""
+
+import argparse
+import collections
+import json
+import logging
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+if __package__:
+    from .link import PanelLink
+    from .protocol import decode, load_tables
+    from .runtime import JablotronRuntime
+    from .transport import DAEMON_FRAME, DAEMON_REPORT, DAEMON_WRITE, RECV_SIZE, RecordBuffer, daemon_record
+else:
+    # run as a script, the other modules are next to this file
+    from link import PanelLink
+    from protocol import decode, load_tables
+    from runtime import JablotronRuntime
+    from transport import DAEMON_FRAME, DAEMON_REPORT, DAEMON_WRITE, RECV_SIZE, RecordBuffer, daemon_record
+
+_LOGGER = logging.getLogger(__name__)
+
+KEEPALIVE_IDLE = 0.5
+KEEPALIVE_PACKET = b'\x52\x01\x02'
+MAX_CLIENTS = 8
+
+
+class ReaderDaemon(PanelLink):
+    """Own the port of one panel and serve its reports, and optionally decoded frames, on a Unix socket"""
+
+    def __init__(self, port, path, keepalive=KEEPALIVE_IDLE, codes=None, frames=False):
+        super().__init__(port, JablotronRuntime())
+        self._path = path
+        self._keepalive = keepalive
+        self._decode = frames
+        self._codes = load_tables() if frames and codes is None else codes
+        self._server = None
+        self._clients = {}
+        self.frames = collections.Counter()
+
+    @property
+    def clients(self):
+        """Return the number of connected clients."""
+        return len(self._clients)
+
+    def start(self):
+        """Listen on the socket and start reading the port."""
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._server.bind(self._path)
+        self._server.listen(MAX_CLIENTS)
+        self._server.setblocking(False)
+
+        self._runtime.start()
+        self._runtime.add_reader(self._server.fileno(), self._accept)
+        self._runtime.call_later(0, self._open)
+        if self._keepalive:
+            self._runtime.call_later(self._keepalive, self._watcher_keepalive)
+        _LOGGER.info('ReaderDaemon.start(): serving %s on %s', self._file_path, self._path)
+
+    def stop(self):
+        """Stop reading and close the port, the clients and the socket."""
+        self._runtime.stop()
+        for client in list(self._clients.values()):
+            client[0].close()
+        self._clients.clear()
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        if os.path.exists(self._path):
+            os.unlink(self._path)
+        self.close()
+
+    def _handle_report(self, size):
+        """Pass the messages of the report just read on to the clients, as compact report and optional decoded frames"""
+        self._last_rx = time.monotonic()
+        report = self._report
+        offsets = self._parser.feed(report, size)
+        if not offsets:
+            return
+
+        last = offsets[-1]
+        records = [daemon_record(DAEMON_REPORT, report.data[:last + 2 + report.data[last + 1]])]
+        if not self._decode:
+            self._broadcast(records[0])
+            return
+        for offset in offsets:
+            frame = decode(self._codes, report, offset)
+            if frame is None:
+                self.frames['unknown'] += 1
+                continue
+            self.frames[frame['type']] += 1
+            records.append(daemon_record(DAEMON_FRAME, json.dumps(frame, separators=(',', ':')).encode()))
+        self._broadcast(b''.join(records))
+
+    def _broadcast(self, record):
+        for fd, (conn, _) in list(self._clients.items()):
+            try:
+                # a client which cannot keep up is dropped, it reconnects and resyncs
+                if conn.send(record) != len(record):
+                    raise BlockingIOError
+            except OSError:
+                _LOGGER.warning('ReaderDaemon._broadcast(): dropping client %d, it does not keep up', fd)
+                self._drop(fd)
+
+    def _accept(self):
+        """Accept a client"""
+        try:
+            conn, _ = self._server.accept()
+        except (BlockingIOError, InterruptedError):
+            return
+        if len(self._clients) >= MAX_CLIENTS:
+            _LOGGER.warning('ReaderDaemon._accept(): more than %d clients, refusing', MAX_CLIENTS)
+            conn.close()
+            return
+
+        conn.setblocking(False)
+        fd = conn.fileno()
+        self._clients[fd] = (conn, RecordBuffer())
+        self._runtime.add_reader(fd, lambda: self._on_client(fd))
+        _LOGGER.info('ReaderDaemon._accept(): client %d connected', fd)
+
+    def _drop(self, fd):
+        conn, _ = self._clients.pop(fd, (None, None))
+        if conn is not None:
+            self._runtime.remove_reader(fd)
+            conn.close()
+            _LOGGER.info('ReaderDaemon._drop(): client %d disconnected', fd)
+
+    def _on_client(self, fd):
+        """Read the packets a client wants written to the panel"""
+        conn, records = self._clients[fd]
+        try:
+            data = conn.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b''
+        if not data:
+            self._drop(fd)
+            return
+
+        records.feed(data)
+        record = records.next()
+        while record is not None:
+            kind, packet = record
+            if kind == DAEMON_WRITE:
+                self._runtime.submit(lambda packet=packet: self._write_packet(packet))
+            record = records.next()
+
+    def _watcher_keepalive(self):
+        """Send the keepalive while no data arrives, runs on the io thread"""
+        if self._transport.connected and time.monotonic() - self._last_rx >= self._keepalive:
+            self._runtime.submit(lambda: self._write_packet(KEEPALIVE_PACKET))
+        return self._keepalive
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read a Jablotron panel and serve its reports on a Unix socket.')
+    parser.add_argument('--port', required=True, help='port of the panel, like the port option: /dev/hidraw0, tcp://host:port')
+    parser.add_argument('--socket', required=True, help='path of the Unix socket to serve on')
+    parser.add_argument('--keepalive', type=float, default=KEEPALIVE_IDLE,
+                        help='send a keepalive after this many seconds without data, 0 to never (default %(default)s)')
+    parser.add_argument('--frames', action='store_true', help='also stream every message decoded as a JSON frame')
+    parser.add_argument('--codes', help='code overrides for the decoded frames, like jablotron/jablotron_codes.yaml')
+    parser.add_argument('--log-level', default='INFO')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+
+    stopping = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stopping.set())
+
+    daemon = ReaderDaemon(args.port, args.socket, args.keepalive, load_tables(args.codes) if args.frames else None,
+                          args.frames)
+    daemon.start()
+    try:
+        stopping.wait()
+    finally:
+        daemon.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
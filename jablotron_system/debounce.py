@@ -0,0 +1,68 @@
+"""Jablotron sensor debouncing
+
+ Sits between the decoded states of a sensor and its entity. ON is passed on
+ at once, OFF only once the sensor has been OFF for off_delay seconds and ON
+ for at least min_on seconds, an ON in the meantime cancels it. A chattering
+ PIR thus becomes one ON period instead of a stream of state writes.
+
+ The debouncer runs on the event loop and uses its clock and timers, the
+ device is the entity (see JablotronSensor in binary_sensor.py).
+
+ This module does not depend on Home Assistant.
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# the values of homeassistant.const.STATE_ON and STATE_OFF
+STATE_ON = 'on'
+STATE_OFF = 'off'
+
+
+class SensorDebouncer():
+    """Debounce between the decoded states of a sensor and its entity.
+
+    loop is the event loop, device needs dev_id, state, _state and
+    async_schedule_update_ha_state().
+    """
+
+    def __init__(self, loop, device, min_on, off_delay):
+        self._loop = loop
+        self._device = device
+        self._min_on = min_on
+        self._off_delay = off_delay
+        self._on_since = 0.0
+        self._off_timer = None
+        self.suppressed = 0
+
+    def async_update(self, state):
+        """Handle a decoded state of the sensor, runs on the event loop."""
+        device = self._device
+        if state == STATE_ON:
+            if self._off_timer is not None:
+                self._off_timer.cancel()
+                self._off_timer = None
+                self.suppressed += 1
+            if device.state != STATE_ON:
+                self._on_since = self._loop.time()
+                self._write(STATE_ON)
+            return
+
+        if device.state == STATE_OFF or self._off_timer is not None:
+            return
+
+        delay = max(self._off_delay, self._on_since + self._min_on - self._loop.time())
+        if delay <= 0:
+            self._write(STATE_OFF)
+        else:
+            self._off_timer = self._loop.call_later(delay, self._async_off)
+
+    def _async_off(self):
+        self._off_timer = None
+        self._write(STATE_OFF)
+
+    def _write(self, state):
+        self._device._state = state
+        _LOGGER.debug('SensorDebouncer._write(): %s updated to %s', self._device.dev_id, state)
+        self._device.async_schedule_update_ha_state()
@@ -0,0 +1,136 @@
+"""Jablotron event stream
+
+ Every decoded message is fired as a jablotron_system event on the Home
+ Assistant bus, with a type telling what it is about:
+
+ type          data
+ ------------  -----------------------------------------------------
+ sensor        dev_id, state (on/off)
+ tamper        dev_id, code
+ key_press     code
+ heartbeat     code
+ heartbeat_gap seconds (time without any data from the panel)
+ alarm_state   state, previous
+ arm           state (armed_home/armed_night/armed_away/disarm), user, local
+
+ Every event also holds the name of the panel. Each type has its own rate
+ limit (events per second, token bucket with a burst of one second) and
+ sampling (fire one out of every n events), so heartbeats cannot flood the
+ bus. Types without a rate are never dropped.
+
+ This module does not depend on Home Assistant.
+"""
+
+import logging
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+EVENT_SENSOR = 'sensor'
+EVENT_TAMPER = 'tamper'
+EVENT_KEY_PRESS = 'key_press'
+EVENT_HEARTBEAT = 'heartbeat'
+EVENT_HEARTBEAT_GAP = 'heartbeat_gap'
+EVENT_ALARM_STATE = 'alarm_state'
+EVENT_ARM = 'arm'
+
+LIMIT_RATE = 'rate'
+LIMIT_SAMPLE = 'sample'
+
+# rate is in events per second, None means no limit
+DEFAULT_LIMITS = {
+    EVENT_SENSOR: {LIMIT_RATE: 20.0, LIMIT_SAMPLE: 1},
+    EVENT_TAMPER: {LIMIT_RATE: None, LIMIT_SAMPLE: 1},
+    EVENT_KEY_PRESS: {LIMIT_RATE: 5.0, LIMIT_SAMPLE: 1},
+    EVENT_HEARTBEAT: {LIMIT_RATE: 1 / 60, LIMIT_SAMPLE: 1},
+    EVENT_HEARTBEAT_GAP: {LIMIT_RATE: None, LIMIT_SAMPLE: 1},
+    EVENT_ALARM_STATE: {LIMIT_RATE: None, LIMIT_SAMPLE: 1},
+    EVENT_ARM: {LIMIT_RATE: None, LIMIT_SAMPLE: 1},
+}
+
+EVENT_TYPES = tuple(DEFAULT_LIMITS)
+
+# the data of every event type, in the order fire() takes it
+EVENT_FIELDS = {
+    EVENT_SENSOR: ('dev_id', 'state'),
+    EVENT_TAMPER: ('dev_id', 'code'),
+    EVENT_KEY_PRESS: ('code',),
+    EVENT_HEARTBEAT: ('code',),
+    EVENT_HEARTBEAT_GAP: ('seconds',),
+    EVENT_ALARM_STATE: ('state', 'previous'),
+    EVENT_ARM: ('state', 'user', 'local'),
+}
+
+# events which are never dropped on the way to the event loop, the others are dropped while the hand-off queue is full
+NEVER_DROPPED = frozenset((EVENT_TAMPER, EVENT_HEARTBEAT_GAP, EVENT_ALARM_STATE, EVENT_ARM))
+
+
+class EventLimiter():
+    """Rate limit and sampling of one event type"""
+
+    __slots__ = ('rate', 'sample', '_tokens', '_updated', '_seen', 'fired', 'dropped')
+
+    def __init__(self, rate=None, sample=1):
+        self.rate = rate
+        self.sample = max(1, sample)
+        self._tokens = max(1.0, rate or 0)
+        self._updated = time.monotonic()
+        self._seen = 0
+        self.fired = 0
+        self.dropped = 0
+
+    def allow(self):
+        """Return True if the next event of this type may be fired."""
+        self._seen += 1
+        if self._seen % self.sample:
+            self.dropped += 1
+            return False
+
+        if self.rate is not None:
+            now = time.monotonic()
+            burst = max(1.0, self.rate)
+            self._tokens = min(burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens < 1:
+                self.dropped += 1
+                return False
+            self._tokens -= 1
+
+        self.fired += 1
+        return True
+
+
+class EventStream():
+    """Fire typed events of one panel through fire(data), rate limited per type"""
+
+    def __init__(self, fire, panel, limits=None):
+        self._fire = fire
+        self._panel = panel
+        self._limiters = {}
+        for event_type, default in DEFAULT_LIMITS.items():
+            limit = dict(default)
+            limit.update((limits or {}).get(event_type) or {})
+            self._limiters[event_type] = EventLimiter(limit[LIMIT_RATE], limit[LIMIT_SAMPLE])
+
+    def fire(self, event_type, *values):
+        """Fire an event with the values of its EVENT_FIELDS, unless its type is over its rate limit or not sampled.
+
+        The data of the event is only built once the limiter allowed it.
+        """
+        if not self._limiters[event_type].allow():
+            return False
+
+        data = dict(zip(EVENT_FIELDS[event_type], values))
+        data['type'] = event_type
+        data['panel'] = self._panel
+        try:
+            self._fire(data)
+        except Exception as ex:
+            _LOGGER.error('EventStream.fire(): Unexpected error: %s', format(ex))
+            return False
+        return True
+
+    def stats(self):
+        """Return the number of fired and dropped events per type."""
+        return {event_type: {'fired': limiter.fired, 'dropped': limiter.dropped}
+                for event_type, limiter in self._limiters.items()}
@@ -0,0 +1,114 @@
+"""Jablotron hand-off to the event loop
+
+ The io thread hands its work for the event loop (entity state writes and
+ events) to a HandoffQueue, instead of scheduling every call on the loop by
+ itself. While the loop is busy, the queue does not grow without a bound:
+ - put_latest() calls replace the pending call with the same key, so only
+   the latest state of every sensor is written. They are never dropped,
+   the keys are bounded by the number of sensors.
+ - put_bounded() calls (sensor, key press and heartbeat events) are all run,
+   every event is fired, but once maxsize calls without a key are pending
+   new ones are dropped and counted.
+ - put() calls (arm, alarm state) are never dropped, when they take the
+   calls without a key over maxsize this is counted as overflow.
+
+ The loop is woken up once for all calls pending at that time, which are then
+ run in the order they were first queued.
+
+ This module does not depend on Home Assistant.
+"""
+
+import collections
+import itertools
+import logging
+import threading
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_MAXSIZE = 1024
+
+_BOUNDED = object()
+_NEVER_DROPPED = object()
+
+
+class HandoffQueue():
+    """Bounded queue of calls from the io thread to the event loop"""
+
+    def __init__(self, call_soon_threadsafe, maxsize=DEFAULT_MAXSIZE):
+        self._call_soon_threadsafe = call_soon_threadsafe
+        self._maxsize = maxsize
+        self._lock = threading.Lock()
+        self._pending = collections.OrderedDict()
+        self._seq = itertools.count()
+        self._calls = 0     # pending calls without a key, put_bounded() and put()
+        self._scheduled = False
+        self.queued = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.overflow = 0
+        self.max_pending = 0
+        self.batches = 0
+
+    def put_latest(self, key, callback, *args):
+        """Queue callback(*args), replacing a pending call with the same key, it is never dropped."""
+        with self._lock:
+            if key in self._pending:
+                self._pending[key] = (callback, args)
+                self.coalesced += 1
+                return True
+            self._pending[key] = (callback, args)
+            return self._queued()
+
+    def put_bounded(self, callback, *args):
+        """Queue callback(*args), unless maxsize calls without a key are pending, then it is dropped."""
+        with self._lock:
+            if self._calls >= self._maxsize:
+                self.dropped += 1
+                return False
+            self._calls += 1
+            self._pending[_BOUNDED, next(self._seq)] = (callback, args)
+            return self._queued()
+
+    def put(self, callback, *args):
+        """Queue callback(*args), it is never dropped."""
+        with self._lock:
+            if self._calls >= self._maxsize:
+                self.overflow += 1
+            self._calls += 1
+            self._pending[_NEVER_DROPPED, next(self._seq)] = (callback, args)
+            return self._queued()
+
+    def _queued(self):
+        self.queued += 1
+        self.max_pending = max(self.max_pending, len(self._pending))
+        if not self._scheduled:
+            self._scheduled = True
+            self._call_soon_threadsafe(self._drain)
+        return True
+
+    def _drain(self):
+        """Run the pending calls, on the event loop"""
+        with self._lock:
+            pending = self._pending
+            self._pending = collections.OrderedDict()
+            self._calls = 0
+            self._scheduled = False
+            self.batches += 1
+
+        for callback, args in pending.values():
+            try:
+                callback(*args)
+            except Exception as ex:
+                _LOGGER.error('HandoffQueue._drain(): Unexpected error: %s', format(ex))
+
+    def stats(self):
+        """Return the counters of the queue."""
+        return {
+            'pending': len(self._pending),
+            'max_pending': self.max_pending,
+            'queued': self.queued,
+            'coalesced': self.coalesced,
+            'dropped': self.dropped,
+            'overflow': self.overflow,
+            'batches': self.batches,
+        }
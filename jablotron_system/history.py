@@ -0,0 +1,285 @@
+"""Jablotron event history
+
+ A compact history of the decoded sensor, tamper and arm events of one panel,
+ to answer "when did zone 7 last trip" or "trips per hour of the hallway PIR"
+ without going through the recorder. Every event is one fixed width record:
+
+   time (microseconds since the epoch, 8 bytes) | number (2) | kind (1) | value (1)
+
+ number is the sensor number (jablotron_<number>) or, for arm events, the
+ user code. value is the state of the sensor (0 off, 1 on), the tamper code
+ or the arm state (see ARM_STATES). Sensor records are only written when the
+ state of the sensor changes.
+
+ The records live in a ring buffer of capacity records, the oldest are
+ overwritten. Per sensor an index keeps its state, the time of its last
+ change and the times it tripped (went on) which are still in the ring, so
+ last trips and trips in a window are found with a binary search. The io
+ thread adds records, flush() appends the new ones to a segment file on
+ disk, which is rewritten from the ring once it holds twice the capacity.
+ load() reads the ring and the index back from the segment at startup.
+
+ This module does not depend on Home Assistant.
+"""
+
+import bisect
+import datetime
+import logging
+import os
+import struct
+import threading
+import time
+from array import array
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD = struct.Struct('<qHBB')
+DEFAULT_CAPACITY = 65536 # records, 12 bytes each
+
+KIND_SENSOR = 1
+KIND_TAMPER = 2
+KIND_ARM = 3
+
+SENSOR_OFF = 0
+SENSOR_ON = 1
+
+ARM_STATES = ('disarm', 'armed_home', 'armed_night', 'armed_away')
+ARM_UNKNOWN = 0xff
+
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+class _Index():
+    """State, last change and trip times of one sensor"""
+
+    __slots__ = ('state', 'changed', 'trips', 'start')
+
+    def __init__(self):
+        self.state = None
+        self.changed = None
+        self.trips = array('q')
+        self.start = 0
+
+    def add(self, now, state):
+        if state == self.state:
+            return False
+        self.state = state
+        self.changed = now
+        if state == SENSOR_ON:
+            self.trips.append(now)
+        return True
+
+    def evict(self):
+        """Forget the oldest trip, it got overwritten in the ring"""
+        self.start += 1
+        if self.start >= 1024 and self.start * 2 >= len(self.trips):
+            del self.trips[:self.start]
+            self.start = 0
+
+    def count(self, since):
+        trips = self.trips
+        return len(trips) - bisect.bisect_left(trips, since, self.start)
+
+    def last_trip(self):
+        return self.trips[-1] if len(self.trips) > self.start else None
+
+
+class EventHistory():
+    """Append only history of the events of one panel, in a ring buffer with a segment on disk"""
+
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY):
+        self._path = path
+        self._capacity = capacity
+        self._ring = bytearray(capacity * RECORD.size)
+        self._lock = threading.Lock()
+        self._written = 0
+        self._flushed = 0
+        self._segment = 0
+        self._sensors = {}
+        self._tampers = {}
+        self._arm = _Index()
+        self._last_arm = None
+        self._last = 0
+
+    def add_sensor(self, number, on):
+        """Record the state of a sensor, if it changed. Returns True if it was recorded."""
+        state = SENSOR_ON if on else SENSOR_OFF
+        with self._lock:
+            index = self._sensors.get(number)
+            if index is not None and index.state == state:
+                return False
+            return self._append(_now(), number, KIND_SENSOR, state)
+
+    def add_tamper(self, number, code):
+        """Record a tamper message of a sensor."""
+        with self._lock:
+            return self._append(_now(), number, KIND_TAMPER, code)
+
+    def add_arm(self, state, user):
+        """Record arming or disarming by the user with that code."""
+        value = ARM_STATES.index(state) if state in ARM_STATES else ARM_UNKNOWN
+        with self._lock:
+            return self._append(_now(), user, KIND_ARM, value)
+
+    def _append(self, now, number, kind, value):
+        # the wall clock may step back (NTP), the trips are bisected so time must not go back
+        now = self._last = max(now, self._last)
+        position = self._written % self._capacity * RECORD.size
+        if self._written >= self._capacity:
+            self._evict(*RECORD.unpack_from(self._ring, position))
+        RECORD.pack_into(self._ring, position, now, number, kind, value)
+        self._written += 1
+        self._index(now, number, kind, value)
+        return True
+
+    def _index(self, now, number, kind, value):
+        if kind == KIND_SENSOR:
+            index = self._sensors.get(number)
+            if index is None:
+                index = self._sensors[number] = _Index()
+            index.add(now, value)
+        elif kind == KIND_TAMPER:
+            self._tampers[number] = now
+        elif kind == KIND_ARM:
+            self._arm.trips.append(now)
+            self._last_arm = (now, number, value)
+
+    def _evict(self, now, number, kind, value):
+        if kind == KIND_SENSOR and value == SENSOR_ON:
+            index = self._sensors.get(number)
+            if index is not None and index.last_trip() is not None:
+                index.evict()
+        elif kind == KIND_ARM:
+            self._arm.evict()
+
+    def _records(self, first, last):
+        """Return the records first up to last still in the ring, as one block of bytes"""
+        first = max(first, last - self._capacity)
+        start = first % self._capacity * RECORD.size
+        end = start + (last - first) * RECORD.size
+        if end <= len(self._ring):
+            return bytes(self._ring[start:end])
+        return bytes(self._ring[start:]) + bytes(self._ring[:end - len(self._ring)])
+
+    def flush(self):
+        """Append the new records to the segment on disk, blocking, runs on the worker thread."""
+        if self._path is None:
+            return
+        with self._lock:
+            written = self._written
+            compact = self._segment + written - self._flushed > 2 * self._capacity
+            data = self._records(0 if compact else self._flushed, written)
+            self._flushed = written
+
+        if not data and not compact:
+            return
+        try:
+            if compact:
+                tmp = self._path + '.tmp'
+                with open(tmp, 'wb') as out:
+                    out.write(data)
+                os.replace(tmp, self._path)
+                self._segment = len(data) // RECORD.size
+            else:
+                with open(self._path, 'ab') as out:
+                    out.write(data)
+                self._segment += len(data) // RECORD.size
+        except OSError as ex:
+            _LOGGER.warning('EventHistory.flush(): unable to write %s: %s', self._path, format(ex))
+
+    def load(self):
+        """Read the last capacity records of the segment on disk, blocking, call before adding records."""
+        if self._path is None or not os.path.exists(self._path):
+            return 0
+        try:
+            with open(self._path, 'rb') as f:
+                size = os.fstat(f.fileno()).st_size
+                records = size // RECORD.size
+                skip = max(0, records - self._capacity)
+                f.seek(skip * RECORD.size)
+                data = f.read((records - skip) * RECORD.size)
+        except OSError as ex:
+            _LOGGER.warning('EventHistory.load(): unable to read %s: %s', self._path, format(ex))
+            return 0
+
+        with self._lock:
+            for record in RECORD.iter_unpack(data):
+                self._append(*record)
+            self._flushed = self._written
+            self._segment = records
+        _LOGGER.info('EventHistory.load(): %d records loaded from %s', self._written, self._path)
+        return self._written
+
+    def sensor(self, number, window=HOUR):
+        """Return the state, last change, last trip and trips in the last window seconds of a sensor."""
+        now = _now()
+        with self._lock:
+            index = self._sensors.get(number)
+            tamper = self._tampers.get(number)
+            if index is None:
+                return {'state': None, 'last_change': None, 'last_trip': None, 'last_tamper': _iso(tamper),
+                        'trips': 0, 'trips_per_hour': 0.0}
+            trips = index.count(now - int(window * 1e6))
+            return {
+                'state': 'on' if index.state == SENSOR_ON else 'off',
+                'last_change': _iso(index.changed),
+                'last_trip': _iso(index.last_trip()),
+                'last_tamper': _iso(tamper),
+                'trips': trips,
+                'trips_per_hour': round(trips * HOUR / window, 2),
+            }
+
+    def sensors(self):
+        """Return the numbers of the sensors with recorded events."""
+        with self._lock:
+            return sorted(self._sensors)
+
+    def changes(self):
+        """Return the time of the last change of every sensor."""
+        with self._lock:
+            return {number: _iso(index.changed) for number, index in self._sensors.items()}
+
+    def arm(self, window=DAY):
+        """Return the last arm state, who set it and when, and the arm changes in the last window seconds."""
+        now = _now()
+        with self._lock:
+            changes = self._arm.count(now - int(window * 1e6))
+            if self._last_arm is None:
+                return {'state': None, 'user': None, 'changed': None, 'changes': changes}
+            changed, user, value = self._last_arm
+        return {
+            'state': ARM_STATES[value] if value < len(ARM_STATES) else 'unknown',
+            'user': '%02x' % user,
+            'changed': _iso(changed),
+            'changes': changes,
+        }
+
+    def attributes(self, number):
+        """Return the history of a sensor as entity attributes."""
+        with self._lock:
+            index = self._sensors.get(number)
+            if index is None:
+                return {}
+            now = _now()
+            return {
+                'last_trip': _iso(index.last_trip()),
+                'trips_last_hour': index.count(now - HOUR * 1000000),
+                'trips_last_day': index.count(now - DAY * 1000000),
+            }
+
+    def stats(self):
+        """Return the number of records written and still in the ring."""
+        with self._lock:
+            return {'records': self._written, 'in_ring': min(self._written, self._capacity),
+                    'capacity': self._capacity, 'unflushed': self._written - self._flushed}
+
+
+def _now():
+    return time.time_ns() // 1000
+
+
+def _iso(micros):
+    if micros is None:
+        return None
+    return datetime.datetime.fromtimestamp(micros / 1e6, datetime.timezone.utc).isoformat()
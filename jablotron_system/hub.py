@@ -0,0 +1,244 @@
+"""Jablotron panel hub
+
+ One JablotronHub exists per configured panel. The hub owns the port of that
+ panel: every report read from it is split into the messages it holds (see
+ protocol.py) and these are handed to the handlers registered by the
+ platforms (alarm_control_panel and binary_sensor).
+
+ The hubs do not own any threads. Reading, the watchers of the platforms and
+ writing all run on the shared JablotronRuntime (see runtime.py), work for
+ the event loop is handed over through a bounded HandoffQueue (see
+ handoff.py). Opening, reading and writing the port is shared with the
+ reader daemon (see link.py). The health of the link is counted in
+ LinkStats (see stats.py), the decoded sensor and arm events are kept in an
+ EventHistory (see history.py).
+"""
+
+import logging
+import time
+
+from homeassistant.const import CONF_PORT, CONF_NAME, CONF_CODE
+
+from . import DOMAIN, CONF_SENSOR_PREFIX, CONF_EVENTS, CONF_HISTORY_FILE
+from .commands import CommandEncoder
+from .events import EventStream, EVENT_HEARTBEAT_GAP, NEVER_DROPPED
+from .handoff import HandoffQueue
+from .history import EventHistory
+from .link import PanelLink
+from .protocol import KNOWN_HEADERS
+from .stats import LinkStats
+
+_LOGGER = logging.getLogger(__name__)
+
+HEARTBEAT_GAP = 5.0
+UNKNOWN_SUMMARY_INTERVAL = 600
+HISTORY_FLUSH_INTERVAL = 60
+
+
+class JablotronHub(PanelLink):
+    """Shared port access of one Jablotron panel"""
+
+    def __init__(self, hass, index, config, runtime, codes):
+        super().__init__(config[CONF_PORT], runtime)
+        self._hass = hass
+        self.index = index
+        self.config = config
+        self.codes = codes
+        self.commands = CommandEncoder(config[CONF_CODE])
+        self.handoff = HandoffQueue(hass.loop.call_soon_threadsafe)
+        self.events = EventStream(self._fire, self.name, config[CONF_EVENTS])
+        self._handlers = []
+        self._resync_handlers = []
+        self._snapshot_handlers = []
+        self.stats = LinkStats()
+        self.history = EventHistory(hass.config.path(config[CONF_HISTORY_FILE]))
+        self.available = False
+
+    @property
+    def name(self):
+        """Return the name of the panel."""
+        return self.config[CONF_NAME]
+
+    @property
+    def sensor_prefix(self):
+        """Return the prefix used for the sensor ids of this panel."""
+        return self.config[CONF_SENSOR_PREFIX]
+
+    @property
+    def stopped(self):
+        """Return True once the runtime has been asked to stop."""
+        return self._runtime.stopped
+
+    def diagnostics(self):
+        """Return the counters and gauges of the link, the transport, the parser and the events."""
+        diagnostics = self.stats.as_dict()
+        diagnostics['dropped_frames'] += self._parser.resyncs
+        diagnostics['truncated_frames'] = self._parser.truncated
+        diagnostics['transport'] = dict(self._transport.metrics)
+        diagnostics['events'] = self.events.stats()
+        diagnostics['handoff'] = self.handoff.stats()
+        diagnostics['history'] = self.history.stats()
+        return diagnostics
+
+    def _fire(self, data):
+        """Fire an event on the bus, through the hand-off queue"""
+        if data['type'] in NEVER_DROPPED:
+            self.handoff.put(self._hass.bus.async_fire, DOMAIN, data)
+        else:
+            self.handoff.put_bounded(self._hass.bus.async_fire, DOMAIN, data)
+
+    def add_handler(self, handler):
+        """Register a handler, called from the io thread for every report.
+
+        The handler gets the Report with the offsets of the messages found in
+        it, in the order they were sent, or None when the link to the panel
+        is lost. The Report is reused for the next read.
+        """
+        self._handlers.append(handler)
+
+    def add_resync_handler(self, handler):
+        """Register a handler, called from the io thread when the state of the panel has to be read again.
+
+        That is once the port is (re)opened and after a gap of more than
+        HEARTBEAT_GAP seconds without any data, in which messages may have
+        been missed.
+        """
+        self._resync_handlers.append(handler)
+
+    def add_snapshot_handler(self, handler):
+        """Register a handler, called from the event loop to build a snapshot of the panel.
+
+        The handler returns a dict with its part of the state of the panel,
+        read from memory only.
+        """
+        self._snapshot_handlers.append(handler)
+
+    def snapshot(self):
+        """Return the state of the panel and all of its sensors in one dict."""
+        snapshot = {'panel': self.name, 'port': self._file_path, 'available': self.available}
+        for handler in self._snapshot_handlers:
+            try:
+                snapshot.update(handler())
+            except Exception as ex:
+                _LOGGER.error('JablotronHub.snapshot(): Unexpected error: %s', format(ex))
+        return snapshot
+
+    def add_watcher(self, delay, watcher):
+        """Call watcher() from the io thread after delay seconds.
+
+        The watcher returns the number of seconds until it should run again.
+        Watchers must not block, packets are sent with send_packet().
+        """
+        self._runtime.call_later(delay, watcher)
+
+    def submit(self, fn, *args):
+        """Run a blocking function on the worker thread."""
+        self._runtime.submit(lambda: fn(*args))
+
+    def start(self):
+        """Start reading the port."""
+        _LOGGER.info('JablotronHub.start(): panel %s on port %s', self.name, self._file_path)
+        self._runtime.call_later(0, self._open)
+        self._runtime.call_later(0, self.stats.snapshot)
+        self._runtime.call_later(UNKNOWN_SUMMARY_INTERVAL, self._summarize_unknown)
+        self._runtime.call_later(HISTORY_FLUSH_INTERVAL, self._flush_history)
+
+    def stop(self):
+        """Close the port and write the last events to the history, blocking, once the runtime is stopped."""
+        _LOGGER.info('JablotronHub.stop(): panel %s on port %s', self.name, self._file_path)
+        self.close()
+        self.history.flush()
+
+    def unknown_frame(self, report, offset):
+        """Count a message that could not be decoded, see UnknownFrames."""
+        self.stats.unknown.add(report, offset)
+
+    def _summarize_unknown(self):
+        """Log the unknown messages of the last interval in one line"""
+        summary = self.stats.unknown.summary()
+        if summary:
+            _LOGGER.info('JablotronHub: unknown messages of panel %s in the last %d s: %s',
+                         self.name, UNKNOWN_SUMMARY_INTERVAL, summary)
+        return UNKNOWN_SUMMARY_INTERVAL
+
+    def _flush_history(self):
+        """Append the new records of the event history to its segment on disk, on the worker thread"""
+        self._runtime.submit(self.history.flush)
+        return HISTORY_FLUSH_INTERVAL
+
+    def _resync(self, reason):
+        _LOGGER.info('JablotronHub._resync(): resync of panel %s after %s', self.name, reason)
+        self.stats.resyncs += 1
+        for handler in self._resync_handlers:
+            try:
+                handler()
+            except Exception as ex:
+                _LOGGER.error('JablotronHub._resync(): Unexpected error: %s', format(ex))
+
+    def _dispatch(self, report):
+        for handler in self._handlers:
+            try:
+                handler(report)
+            except Exception as ex:
+                if report is not None:
+                    self.stats.dropped_frames += len(report.offsets)
+                _LOGGER.error('JablotronHub._dispatch(): Unexpected error: %s', format(ex))
+
+    def _connected(self):
+        self.stats.connected()
+        self._resync('connect')
+
+    def _disconnected(self):
+        self.available = False
+        self._dispatch(None)
+
+    def _handle_report(self, size):
+        """Split the report just read into messages and dispatch them"""
+        now = time.monotonic()
+        if self._last_rx and now - self._last_rx > HEARTBEAT_GAP:
+            self.events.fire(EVENT_HEARTBEAT_GAP, round(now - self._last_rx, 1))
+            self._resync('gap')
+        self._last_rx = now
+        self.stats.report(now)
+        self.available = True
+        report = self._report
+        if self._parser.feed(report, size):
+            stats = self.stats
+            for offset in report.offsets:
+                header = report.header(offset)
+                stats.frame(header)
+                if header not in KNOWN_HEADERS:
+                    stats.unknown.add(report, offset)
+            self._dispatch(report)
+
+    def send_packet(self, packet, kind='command'):
+        """Queue a packet for the panel, writes of all platforms are serialised.
+
+        kind tells what the packet is for, written packets are counted per kind.
+        """
+        self.stats.tx_queued(1)
+        self._runtime.submit(lambda: self._write(packet, kind))
+
+    def send_packets(self, packets, kind='command'):
+        """Queue packets for the panel, written back-to-back so no packet of another platform gets in between.
+
+        Every packet is written on its own, a packet is one HID report. When
+        one fails the rest is not written.
+        """
+        self.stats.tx_queued(len(packets))
+        self._runtime.submit(lambda: self._write_all(packets, kind))
+
+    def _write_all(self, packets, kind):
+        """Write packets to the panel in order, runs on the worker thread"""
+        for index, packet in enumerate(packets):
+            if not self._write(packet, kind):
+                self.stats.tx_dropped(len(packets) - index - 1)
+                return
+
+    def _write(self, packet, kind):
+        """Write a packet to the panel, runs on the worker thread"""
+        if not self._write_packet(packet):
+            self.stats.tx_dropped(1)
+            return False
+        self.stats.tx_written(kind)
+        return True
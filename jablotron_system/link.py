@@ -0,0 +1,132 @@
+"""Jablotron panel link
+
+ Reading and writing the port of one panel, shared by the hub of the
+ integration (see hub.py) and the reader daemon (see daemon.py). The port is
+ opened through the transport its port option selects (see transport.py) and
+ opened again after the link got lost. Reports are read on the io thread of
+ a JablotronRuntime into one preallocated Report and handed to
+ _handle_report(), packets are written on its worker thread one at a time.
+
+ This module does not depend on Home Assistant.
+"""
+
+import logging
+import time
+
+if __package__:
+    from .protocol import FrameParser, Report
+    from .transport import open_transport
+else:
+    # imported by a script next to this file
+    from protocol import FrameParser, Report
+    from transport import open_transport
+
+_LOGGER = logging.getLogger(__name__)
+
+RECONNECT_DELAY = 0.5
+CONNECT_POLL = 0.1
+SEND_DELAY = 0.1 # lower reliability without this delay
+MAX_BUFFERED_REPORTS = 32 # reports handled per wake up, so one panel cannot starve the others
+
+
+class PanelLink():
+    """Port of one panel, opened, read and written on a JablotronRuntime.
+
+    Subclasses implement _handle_report() and may override _connected() and
+    _disconnected(), all of them are called from the io thread.
+    """
+
+    def __init__(self, port, runtime):
+        self._file_path = port
+        self._runtime = runtime
+        self._transport = open_transport(port)
+        self._parser = FrameParser()
+        self._report = Report()
+        self._last_rx = 0.0
+
+    @property
+    def port(self):
+        """Return the port the panel is connected to."""
+        return self._file_path
+
+    @property
+    def transport(self):
+        """Return the transport used to reach the panel."""
+        return self._transport
+
+    def idle_for(self, seconds):
+        """Return True if nothing has been received for the last seconds."""
+        return time.monotonic() - self._last_rx >= seconds
+
+    def close(self):
+        """Close the port, once the runtime is stopped."""
+        if self._transport.connected:
+            self._runtime.remove_reader(self._transport.fileno())
+        self._transport.close()
+
+    def _connected(self):
+        """The port got opened"""
+
+    def _disconnected(self):
+        """The link got lost, the port is opened again after RECONNECT_DELAY"""
+
+    def _handle_report(self, size):
+        """Handle the report of size bytes just read into self._report"""
+        raise NotImplementedError
+
+    def _open(self):
+        """Open the port for reading, retried until it succeeds"""
+        try:
+            if not self._transport.open():
+                return CONNECT_POLL
+        except OSError:
+            _LOGGER.warning("PanelLink._open(): File or data not present at the moment: %s", self._file_path)
+            return RECONNECT_DELAY
+
+        self._runtime.add_reader(self._transport.fileno(), self._on_readable)
+        self._connected()
+        return None
+
+    def _close(self):
+        """Close the port after losing the link and retry opening it"""
+        if self._transport.connected:
+            self._runtime.remove_reader(self._transport.fileno())
+        self._transport.close()
+
+        self._disconnected()
+        if not self._runtime.stopped:
+            self._runtime.call_later(RECONNECT_DELAY, self._open)
+
+    def _on_readable(self):
+        """Read the reports which are there into the preallocated buffer and handle them"""
+        for _ in range(MAX_BUFFERED_REPORTS):
+            try:
+                size = self._transport.read_into(self._report.data)
+                if size is None:
+                    return
+            except OSError:
+                _LOGGER.warning("PanelLink._on_readable(): File or data not present at the moment: %s", self._file_path)
+                self._close()
+                return
+
+            if not size:
+                _LOGGER.warning("PanelLink._on_readable(): No packets")
+                self._close()
+                return
+
+            self._handle_report(size)
+            if not self._transport.buffered:
+                return
+
+        # more reports are buffered, handle them after the other panels had their turn
+        self._runtime.call_later(0, self._on_readable)
+
+    def _write_packet(self, packet):
+        """Write a packet to the panel and wait SEND_DELAY, runs on the worker thread. Returns False if it failed."""
+        try:
+            self._transport.write(packet)
+        except OSError:
+            _LOGGER.warning("PanelLink._write_packet(): unable to write to %s", self._file_path)
+            return False
+        self._runtime.wait(SEND_DELAY)
+        return True
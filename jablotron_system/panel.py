@@ -0,0 +1,73 @@
+"""Jablotron alarm state machine
+
+ Tracks the alarm state the panel reports and the availability of the link
+ to it, for the alarm control panel entity (see alarm_control_panel.py).
+ Both change on the io thread, the entity writes them on the event loop.
+
+ This module does not depend on Home Assistant.
+"""
+
+import logging
+
+_LOGGER = logging.getLogger(__name__)
+
+# the values of the homeassistant.const.STATE_ALARM_* constants
+STATE_ALARM_DISARMED = 'disarmed'
+STATE_ALARM_ARMING = 'arming'
+STATE_ALARM_PENDING = 'pending'
+STATE_ALARM_ARMED_HOME = 'armed_home'
+STATE_ALARM_ARMED_NIGHT = 'armed_night'
+STATE_ALARM_ARMED_AWAY = 'armed_away'
+STATE_ALARM_TRIGGERED = 'triggered'
+
+"""Transitions a panel is expected to make, arming goes disarmed -> arming/pending -> armed_*"""
+PANEL_TRANSITIONS = {
+    STATE_ALARM_DISARMED: {STATE_ALARM_ARMING, STATE_ALARM_PENDING, STATE_ALARM_ARMED_HOME,
+                           STATE_ALARM_ARMED_NIGHT, STATE_ALARM_ARMED_AWAY, STATE_ALARM_TRIGGERED},
+    STATE_ALARM_ARMING: {STATE_ALARM_PENDING, STATE_ALARM_ARMED_HOME, STATE_ALARM_ARMED_NIGHT,
+                         STATE_ALARM_ARMED_AWAY, STATE_ALARM_DISARMED},
+    STATE_ALARM_PENDING: {STATE_ALARM_ARMING, STATE_ALARM_ARMED_HOME, STATE_ALARM_ARMED_NIGHT,
+                          STATE_ALARM_ARMED_AWAY, STATE_ALARM_DISARMED, STATE_ALARM_TRIGGERED},
+    STATE_ALARM_ARMED_HOME: {STATE_ALARM_DISARMED, STATE_ALARM_PENDING, STATE_ALARM_TRIGGERED, STATE_ALARM_ARMING},
+    STATE_ALARM_ARMED_NIGHT: {STATE_ALARM_DISARMED, STATE_ALARM_PENDING, STATE_ALARM_TRIGGERED, STATE_ALARM_ARMING},
+    STATE_ALARM_ARMED_AWAY: {STATE_ALARM_DISARMED, STATE_ALARM_PENDING, STATE_ALARM_TRIGGERED},
+    STATE_ALARM_TRIGGERED: {STATE_ALARM_DISARMED, STATE_ALARM_ARMED_HOME, STATE_ALARM_ARMED_NIGHT,
+                            STATE_ALARM_ARMED_AWAY},
+}
+
+
+class PanelStateMachine():
+    """Track the alarm state reported by the panel.
+
+    Only real alarm states are accepted, anything else (heartbeats, key
+    presses, link problems) never changes the state. The panel is the
+    authority, so an unexpected transition is still taken, but logged.
+    """
+
+    def __init__(self):
+        self.state = None
+        self.available = False
+        self.transitions = 0
+        self.unexpected = 0
+
+    def transition(self, new_state):
+        """Move to new_state, returns True if the state really changed."""
+        if new_state not in PANEL_TRANSITIONS or new_state == self.state:
+            return False
+
+        if self.state is not None and new_state not in PANEL_TRANSITIONS[self.state]:
+            self.unexpected += 1
+            _LOGGER.warning("Unexpected Jablotron state transition: %s to %s", self.state, new_state)
+
+        _LOGGER.info("Jablotron state changed: %s to %s", self.state, new_state)
+        self.state = new_state
+        self.transitions += 1
+        return True
+
+    def set_available(self, available):
+        """Track the link to the panel, returns True if the availability changed. The state is kept."""
+        if available == self.available:
+            return False
+        _LOGGER.info("Jablotron link %s", 'restored' if available else 'lost')
+        self.available = available
+        return True
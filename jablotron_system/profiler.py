@@ -0,0 +1,116 @@
+"""Jablotron thread profiler
+
+ Sampling profiler for the threads of the component. While running, it looks
+ at the stacks of the profiled threads every few milliseconds with
+ sys._current_frames(), which costs nothing in the profiled threads
+ themselves. The result is written as a text file with the busy time per
+ thread, the functions most often on top of the stack, and the stacks in
+ collapsed format (one line per stack, usable with flamegraph.pl).
+
+ Samples where a thread is just waiting for data or jobs count as idle.
+
+ This module does not depend on Home Assistant.
+"""
+
+import collections
+import logging
+import os
+import sys
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 0.005
+TOP_FUNCTIONS = 25
+
+# functions a thread of the runtime waits in, when on top of the stack
+IDLE_FUNCTIONS = frozenset(('_io_loop', '_worker_loop', 'select', 'wait', 'get'))
+
+
+class ThreadProfiler():
+    """Sample the stacks of some threads for a number of seconds"""
+
+    def __init__(self, threads, seconds, path, interval=DEFAULT_INTERVAL):
+        self._threads = {thread.ident: thread.name for thread in threads if thread.ident is not None}
+        self._seconds = seconds
+        self._path = path
+        self._interval = interval
+        self._stop = threading.Event()
+        self._stacks = collections.Counter()
+        self._top = collections.Counter()
+        self._samples = collections.Counter()
+        self._busy = collections.Counter()
+        self._thread = threading.Thread(target=self._run, name='jablotron_profiler', daemon=True)
+
+    @property
+    def running(self):
+        """Return True while sampling."""
+        return self._thread.is_alive()
+
+    def start(self):
+        """Start sampling, the profile is written when done."""
+        _LOGGER.info('ThreadProfiler.start(): profiling %s for %s s', sorted(self._threads.values()), self._seconds)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling early, the profile is still written."""
+        self._stop.set()
+
+    def _run(self):
+        started = time.monotonic()
+        deadline = started + self._seconds
+        try:
+            while not self._stop.is_set() and time.monotonic() < deadline:
+                self._sample()
+                self._stop.wait(self._interval)
+            self._write(time.monotonic() - started)
+        except Exception as ex:
+            _LOGGER.error('ThreadProfiler._run(): Unexpected error: %s', format(ex))
+
+    def _sample(self):
+        frames = sys._current_frames()
+        for ident, name in self._threads.items():
+            frame = frames.get(ident)
+            if frame is None:
+                continue
+
+            self._samples[name] += 1
+            code = frame.f_code
+            if code.co_name in IDLE_FUNCTIONS:
+                continue
+
+            self._busy[name] += 1
+            self._top['%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), frame.f_lineno)] += 1
+
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code.co_name)
+                frame = frame.f_back
+            stack.append(name)
+            self._stacks[';'.join(reversed(stack))] += 1
+
+    def _write(self, elapsed):
+        lines = ['# Jablotron profile, %.1f s, a sample every %.0f ms' % (elapsed, self._interval * 1000), '']
+
+        lines.append('## busy samples per thread')
+        for name in sorted(self._samples):
+            samples = self._samples[name]
+            busy = self._busy[name]
+            lines.append('%-20s %6d of %6d samples busy (%.1f%%)' % (name, busy, samples, 100.0 * busy / samples))
+        lines.append('')
+
+        lines.append('## functions on top of the stack while busy')
+        for function, count in self._top.most_common(TOP_FUNCTIONS):
+            lines.append('%6d %s' % (count, function))
+        lines.append('')
+
+        lines.append('## collapsed stacks')
+        for stack, count in self._stacks.most_common():
+            lines.append('%s %d' % (stack, count))
+
+        os.makedirs(os.path.dirname(self._path), exist_ok=True)
+        with open(self._path, 'w') as out:
+            out.write('\n'.join(lines))
+            out.write('\n')
+        _LOGGER.info('ThreadProfiler._write(): profile written to %s', self._path)
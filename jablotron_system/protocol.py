@@ -0,0 +1,324 @@
+"""Jablotron protocol helpers
+
+ A report read from the port is 64 bytes long and holds one or more messages.
+ Every message starts with a type byte and a length byte, followed by that
+ many bytes of payload:
+
+  1  2  3  4  5  6  7  8   9 10 11 12 13 14 15 16  <====================== byte number
+ d8 08 00 00 01 00 00 00  00 00 55 09 00 88 00 02  |..........U.....|
+ |___ d8 08 + 8 bytes ___________| |___ 55 09 + 9 bytes ...
+
+ A type byte of 00 marks the end of the messages in the report, the rest of
+ the report is padding.
+
+ The meaning of the state bytes comes from codes.json, compiled into lookup
+ lists by CodeTables. The decode_* functions read the fields of the known
+ messages, for the platforms and the reader daemon alike.
+
+ This module does not depend on Home Assistant.
+"""
+
+import json
+import os
+
+REPORT_SIZE = 64
+
+# Known message headers, type byte and length byte as one number
+HEADER_JA80_STATE = 0x8201     # JA-80 series state
+HEADER_JA100_STATE = 0x5122    # JA-100 series state
+HEADER_STATUS = 0xd808         # status report with the sensors which are ON
+HEADER_WIRED = 0x5508          # sensor message, wired (unconfirmed)
+HEADER_WIRELESS = 0x5509       # sensor message, wireless (unconfirmed)
+
+KNOWN_HEADERS = frozenset((
+    HEADER_JA80_STATE,
+    HEADER_JA100_STATE,
+    HEADER_STATUS,
+    HEADER_WIRED,
+    HEADER_WIRELESS,
+))
+
+PADDING = 0x00
+
+_SIGNATURES = tuple(header.to_bytes(2, 'big') for header in KNOWN_HEADERS)
+_ZEROS = bytes(REPORT_SIZE)
+
+
+class Report():
+    """A report read from the port and the offsets of the messages it holds.
+
+    The hub reads every report into the same preallocated Report, so handlers
+    decode fields as integers straight from data and must copy (see frame())
+    whatever they want to keep.
+    """
+
+    __slots__ = ('data', 'size', 'offsets')
+
+    def __init__(self, size=REPORT_SIZE):
+        self.data = bytearray(size)
+        self.size = 0
+        self.offsets = []
+
+    def header(self, offset):
+        """Return the header of the message at offset."""
+        return self.data[offset] << 8 | self.data[offset + 1]
+
+    def word(self, offset):
+        """Return the little endian 16 bit number at offset."""
+        return self.data[offset] | self.data[offset + 1] << 8
+
+    def frame(self, offset):
+        """Return a copy of the message at offset."""
+        return bytes(self.data[offset:min(offset + 2 + self.data[offset + 1], self.size)])
+
+
+class FrameParser():
+    """Find the messages in a report.
+
+    Messages are found by walking the length bytes from the start of the
+    report, up to the first padding. The messages of a walk which reaches
+    the padding are complete and kept as they are, known or not. Only when
+    the walk breaks, on a message cut off by the end of the report or on
+    data after the padding, the rest of the report from where it broke is
+    searched for known headers, so a known message after a garbled length
+    or stray padding is still found.
+
+    Known messages cut off by the end of the report are counted as
+    truncated and never handed out, so every offset holds a complete
+    message.
+    """
+
+    def __init__(self):
+        self.reports = 0
+        self.frames = 0
+        self.resyncs = 0
+        self.truncated = 0
+
+    def feed(self, report, size):
+        """Fill report.offsets with the complete messages of the first size bytes, in the order they were sent."""
+        self.reports += 1
+        data = report.data
+        offsets = report.offsets
+        offsets.clear()
+        report.size = size
+        if size < len(data):
+            # clear what is left of the previous report
+            data[size:] = _ZEROS[size:len(data)]
+
+        offset = 0
+        broken = False
+        while offset + 2 <= size:
+            if data[offset] == PADDING:
+                break
+
+            frame_end = offset + 2 + data[offset + 1]
+            if frame_end > size:
+                # cut off by the end of the report, counted by _find_known()
+                broken = True
+                break
+
+            offsets.append(offset)
+            offset = frame_end
+
+        if broken or _has_data(data, offset, size):
+            self._find_known(report, offset, size)
+
+        self.frames += len(offsets)
+        return offsets
+
+    def _find_known(self, report, start, size):
+        """Add the known messages after start, where the walk along the length bytes broke"""
+        data = report.data
+        found = []
+        for signature in _SIGNATURES:
+            offset = data.find(signature, start, size)
+            while offset >= 0:
+                found.append(offset)
+                offset = data.find(signature, offset + 1, size)
+
+        # of overlapping candidates the first one wins
+        end = start
+        for offset in sorted(found):
+            if offset < end:
+                continue
+            frame_end = offset + 2 + data[offset + 1]
+            if frame_end > size:
+                self.truncated += 1
+                break
+            report.offsets.append(offset)
+            self.resyncs += 1
+            end = frame_end
+
+
+def _has_data(data, start, end):
+    """Return True if anything but padding follows start"""
+    return data[start:end].strip(b'\x00') != b''
+
+
+CODES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'codes.json')
+CODES_VERSION = 1
+
+# what a state byte can mean besides an alarm state
+KIND_HEARTBEAT = 'heartbeat'
+KIND_KEY_PRESS = 'key_press'
+
+# what a sensor message is about, see decode_sensor()
+KIND_SENSOR = 'sensor'
+KIND_TAMPER = 'tamper'
+KIND_ARM = 'arm'
+
+STATUS_BITS = 0xffff    # the d8 08 status holds sensors 0 to 15
+
+ALARM_STATES = frozenset((
+    'disarmed', 'arming', 'pending', 'armed_home', 'armed_night', 'armed_away', 'triggered',
+))
+
+# allowed values per table, None allows any description
+TABLES = {
+    'ja80_state': ALARM_STATES | {KIND_HEARTBEAT, KIND_KEY_PRESS},   # 82 01 byte 3
+    'ja100_state': ALARM_STATES | {KIND_HEARTBEAT, KIND_KEY_PRESS},  # 51 22 byte 3
+    'sensor_type': None,                                             # 55 08/09 byte 3, sensor messages
+    'sensor_on': None,                                               # 55 08/09 byte 4, sensor became active
+    'sensor_tamper': None,                                           # 55 08/09 byte 4, sensor reports tamper
+    'arm': frozenset(('armed_home', 'armed_night', 'armed_away', 'disarm')),  # 55 08/09 byte 3, byte 4 is the user
+}
+
+
+def _code(name, key):
+    """Return the byte value of a table key, a hex string.
+
+    Unquoted YAML keys arrive as numbers, 40: is forty and not 0x40, so only
+    strings are accepted.
+    """
+    if not isinstance(key, str):
+        raise ValueError('%s: code %r must be a quoted hex string, like "40"' % (name, key))
+    try:
+        value = int(key, 16)
+    except ValueError:
+        raise ValueError('%s: code %r is not a hex number' % (name, key)) from None
+    if not 0 <= value <= 0xff:
+        raise ValueError('%s: code %r is not a byte' % (name, key))
+    return value
+
+
+def compile_table(name, mapping):
+    """Compile a {byte value: value} mapping into a 256 entry lookup list."""
+    allowed = TABLES[name]
+    table = [None] * 256
+    for code, value in mapping.items():
+        if value is None:
+            continue
+        if allowed is not None and value not in allowed:
+            raise ValueError('%s: %r is not one of %s' % (name, value, ', '.join(sorted(allowed))))
+        table[code] = value
+    return table
+
+
+class CodeTables():
+    """Meaning of the state bytes, compiled into 256 entry lookup lists.
+
+    Every table is indexed with the byte value and holds None for unknown
+    codes, so a lookup is a single index operation.
+    """
+
+    __slots__ = ('version',) + tuple(TABLES)
+
+    def __init__(self, version, tables):
+        self.version = version
+        for name in TABLES:
+            setattr(self, name, compile_table(name, tables.get(name, {})))
+
+    @classmethod
+    def load(cls, overrides=None, path=CODES_FILE):
+        """Load the tables shipped with the component and apply overrides.
+
+        overrides maps table names to {code: value}, codes are hex strings
+        and a value of None removes the code from the shipped table.
+        """
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+
+        version = data.get('version')
+        if version != CODES_VERSION:
+            raise ValueError('%s has version %s, expected %s' % (path, version, CODES_VERSION))
+
+        tables = {}
+        for name in TABLES:
+            table = {_code(name, key): value for key, value in data['tables'].get(name, {}).items()}
+            for key, value in ((overrides or {}).get(name) or {}).items():
+                table[_code(name, key)] = value
+            tables[name] = table
+
+        unknown = set(overrides or {}) - set(TABLES)
+        if unknown:
+            raise ValueError('unknown code tables: %s' % ', '.join(sorted(unknown)))
+
+        return cls(version, tables)
+
+
+def load_tables(path=None):
+    """Load the code tables with the overrides of a jablotron_codes.yaml (or .json) file."""
+    overrides = None
+    if path:
+        with open(path, encoding='utf-8') as f:
+            if path.endswith('.json'):
+                overrides = json.load(f)
+            else:
+                import yaml
+                overrides = yaml.safe_load(f)
+    return CodeTables.load(overrides)
+
+
+def decode_state(codes, report, offset):
+    """Return the meaning of the state byte of a JA-80 (82 01) or JA-100 (51 22) message, None if unknown."""
+    table = codes.ja80_state if report.header(offset) == HEADER_JA80_STATE else codes.ja100_state
+    return table[report.data[offset + 2]]
+
+
+def decode_status(report, offset):
+    """Return the sensors which are ON of a d8 08 status message, bit x is sensor x."""
+    return report.word(offset + 3) & STATUS_BITS
+
+
+def decode_sensor(codes, report, offset):
+    """Decode a 55 08/09 sensor message.
+
+    Returns (KIND_SENSOR, sensor, on), (KIND_TAMPER, sensor, code) or
+    (KIND_ARM, state, user code), None if the type byte (byte 3) is unknown.
+    """
+    data = report.data
+    kind = data[offset + 2]
+    value = data[offset + 3]
+    if codes.sensor_type[kind] is not None:
+        sensor = report.word(offset + 4) // 64
+        if codes.sensor_tamper[value] is not None:
+            return KIND_TAMPER, sensor, value
+        return KIND_SENSOR, sensor, codes.sensor_on[value] is not None
+    if codes.arm[kind] is not None:
+        return KIND_ARM, codes.arm[kind], value
+    return None
+
+
+def decode(codes, report, offset):
+    """Return the message at offset as a dict with its type and fields, None if it cannot be decoded."""
+    header = report.header(offset)
+    if header in (HEADER_JA80_STATE, HEADER_JA100_STATE):
+        state = decode_state(codes, report, offset)
+        if state is None:
+            return None
+        return {'type': 'state', 'model': 'ja80' if header == HEADER_JA80_STATE else 'ja100',
+                'code': '%02x' % report.data[offset + 2], 'state': state}
+    if header == HEADER_STATUS:
+        bits = decode_status(report, offset)
+        return {'type': 'status', 'on': [sensor for sensor in range(bits.bit_length()) if bits >> sensor & 1]}
+    if header in (HEADER_WIRED, HEADER_WIRELESS):
+        decoded = decode_sensor(codes, report, offset)
+        if decoded is None:
+            return None
+        kind, subject, value = decoded
+        if kind == KIND_SENSOR:
+            return {'type': kind, 'sensor': subject, 'state': 'on' if value else 'off'}
+        if kind == KIND_TAMPER:
+            return {'type': kind, 'sensor': subject, 'code': '%02x' % value}
+        return {'type': kind, 'state': subject, 'user': '%02x' % value}
+    return None
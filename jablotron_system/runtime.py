@@ -0,0 +1,230 @@
+"""Jablotron runtime
+
+ All background work of the component runs on two named threads, shared by
+ every configured panel:
+ - jablotron_io     : waits on the ports of all panels and runs the timers
+                      (keepalive, sensor update and startup watchers)
+ - jablotron_worker : runs blocking jobs, like writing packets to a panel
+
+ The io thread waits with a selector (epoll on Linux, so there is no limit on
+ the fd numbers) which also watches the read end of a pipe. Adding or removing
+ a reader and stopping the runtime write to this pipe, so the io thread wakes
+ up at once and registers the change itself, the selector is only used from
+ the io thread. Both threads are joined with a deadline and the time it took
+ is logged.
+
+ This module does not depend on Home Assistant.
+"""
+
+import heapq
+import itertools
+import logging
+import os
+import queue
+import selectors
+import threading
+import time
+
+_LOGGER = logging.getLogger(__name__)
+
+SHUTDOWN_TIMEOUT = 2.0
+SELECT_ERROR_DELAY = 0.5
+
+
+class JablotronRuntime():
+    """Run the I/O and timers of all panels on a fixed set of threads"""
+
+    def __init__(self):
+        self._readers = {}
+        self._changes = []
+        self._selector = selectors.DefaultSelector()
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._jobs = queue.Queue()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        self._threads = [
+            threading.Thread(target=self._io_loop, name='jablotron_io', daemon=True),
+            threading.Thread(target=self._worker_loop, name='jablotron_worker', daemon=True),
+        ]
+
+    @property
+    def stopped(self):
+        """Return True once the runtime has been asked to stop."""
+        return self._stop.is_set()
+
+    @property
+    def threads(self):
+        """Return the threads owned by the runtime."""
+        return list(self._threads)
+
+    def start(self):
+        """Start the io and worker threads."""
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=SHUTDOWN_TIMEOUT):
+        """Stop all threads, returns the number of seconds it took.
+
+        Waits at most timeout seconds for the threads to exit.
+        """
+        started = time.monotonic()
+        self._stop.set()
+        self._wake()
+        self._jobs.put(None)
+
+        deadline = started + timeout
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join(max(0, deadline - time.monotonic()))
+
+        elapsed = time.monotonic() - started
+        alive = [thread.name for thread in self._threads if thread.is_alive()]
+        if alive:
+            _LOGGER.warning('JablotronRuntime.stop(): threads %s did not exit within %.1f s', alive, timeout)
+        else:
+            _LOGGER.info('JablotronRuntime.stop(): all threads exited in %.3f s', elapsed)
+            self._selector.close()
+            os.close(self._wake_r)
+            os.close(self._wake_w)
+            # the fd numbers may be reused, nothing is written to them anymore
+            self._wake_w = None
+        return elapsed
+
+    def wait(self, timeout):
+        """Sleep for timeout seconds, returns True if the runtime got stopped meanwhile."""
+        return self._stop.wait(timeout)
+
+    def add_reader(self, fd, callback):
+        """Call callback() from the io thread whenever fd is readable."""
+        with self._lock:
+            self._readers[fd] = callback
+            self._changes.append((fd, callback))
+        self._wake()
+
+    def remove_reader(self, fd):
+        """Stop watching fd."""
+        with self._lock:
+            self._readers.pop(fd, None)
+            self._changes.append((fd, None))
+        self._wake()
+
+    def call_later(self, delay, callback):
+        """Call callback() from the io thread after delay seconds.
+
+        When callback returns a number, it gets called again after that many
+        seconds.
+        """
+        with self._lock:
+            heapq.heappush(self._timers, (time.monotonic() + delay, next(self._timer_seq), callback))
+        self._wake()
+
+    def submit(self, job):
+        """Run the blocking function job() on the worker thread."""
+        if not self._stop.is_set():
+            self._jobs.put(job)
+
+    def _wake(self):
+        wake_w = self._wake_w
+        if wake_w is None:
+            return
+        try:
+            os.write(wake_w, b'\x00')
+        except (BlockingIOError, OSError):
+            # pipe is full or closed, the io thread will wake up anyway
+            pass
+
+    def _run_timers(self):
+        """Run the timers which are due, returns the seconds until the next one."""
+        while not self._stop.is_set():
+            with self._lock:
+                if not self._timers:
+                    return None
+                deadline, _, callback = self._timers[0]
+                delay = deadline - time.monotonic()
+                if delay > 0:
+                    return delay
+                heapq.heappop(self._timers)
+
+            try:
+                again = callback()
+            except Exception as ex:
+                _LOGGER.error('JablotronRuntime._run_timers(): Unexpected error: %s', format(ex))
+                again = None
+
+            if again is not None:
+                self.call_later(again, callback)
+        return None
+
+    def _update_selector(self):
+        """Apply the added and removed readers to the selector, in the order they were made"""
+        with self._lock:
+            changes, self._changes = self._changes, []
+
+        selector = self._selector
+        for fd, callback in changes:
+            # a closed port may leave its fd behind, and a new port can get the same number
+            try:
+                selector.unregister(fd)
+            except (KeyError, ValueError):
+                pass
+            if callback is None:
+                continue
+            try:
+                selector.register(fd, selectors.EVENT_READ, callback)
+            except (OSError, ValueError) as ex:
+                _LOGGER.error('JablotronRuntime._update_selector(): unable to watch fd %s: %s', fd, format(ex))
+
+    def _io_loop(self):
+        """Wait for data on all ports and run the timers"""
+        try:
+            while not self._stop.is_set():
+                timeout = self._run_timers()
+                self._update_selector()
+
+                try:
+                    events = self._selector.select(timeout)
+                except OSError as ex:
+                    _LOGGER.error('JablotronRuntime._io_loop(): select failed: %s', format(ex))
+                    self._stop.wait(SELECT_ERROR_DELAY)
+                    continue
+
+                for key, _ in events:
+                    if key.fd == self._wake_r:
+                        try:
+                            os.read(self._wake_r, 512)
+                        except BlockingIOError:
+                            pass
+                        continue
+
+                    with self._lock:
+                        # skip a port removed by an earlier callback of this round
+                        current = self._readers.get(key.fd) is key.data
+                    if not current:
+                        continue
+                    try:
+                        key.data()
+                    except Exception as ex:
+                        _LOGGER.error('JablotronRuntime._io_loop(): Unexpected error: %s', format(ex))
+
+        finally:
+            _LOGGER.debug('JablotronRuntime._io_loop(): Exiting _io_loop()')
+
+    def _worker_loop(self):
+        """Run blocking jobs, one at a time"""
+        try:
+            while not self._stop.is_set():
+                job = self._jobs.get()
+                if job is None:
+                    break
+                try:
+                    job()
+                except Exception as ex:
+                    _LOGGER.error('JablotronRuntime._worker_loop(): Unexpected error: %s', format(ex))
+
+        finally:
+            _LOGGER.debug('JablotronRuntime._worker_loop(): Exiting _worker_loop()')
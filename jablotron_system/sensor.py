@@ -0,0 +1,116 @@
+"""Jablotron diagnostic sensor platform
+
+ Every panel gets a few sensors about the health of its link, so many panels
+ can be watched from one dashboard and a degrading USB link is spotted before
+ it fails. They are polled from the counters of the hub (see stats.py), which
+ costs nothing on the io thread:
+ - frames per second, with the rate per message header as attributes
+ - longest gap without data, with the current gap as attribute
+ - reconnects, with the resyncs and the metrics of the transport as
+   attributes
+ - TX queue depth, with the packets written per kind as attributes
+ - dropped frames, with the unknown and cut off messages, the dropped
+   events and the counters of the hand-off to the event loop as attributes
+"""
+import logging
+from datetime import timedelta
+
+from . import DOMAIN, DATA_HUBS, CONF_PANEL
+
+from homeassistant.helpers.entity import Entity
+from homeassistant.helpers.typing import ConfigType, HomeAssistantType
+
+try:
+    from homeassistant.const import EntityCategory
+except ImportError:
+    try:
+        # Home Assistant 2021.12, before it moved to const
+        from homeassistant.helpers.entity import EntityCategory
+    except ImportError:
+        # Home Assistant before 2021.12 takes the plain string
+        EntityCategory = None
+
+_LOGGER = logging.getLogger(__name__)
+
+SCAN_INTERVAL = timedelta(seconds=30)
+
+ENTITY_CATEGORY_DIAGNOSTIC = EntityCategory.DIAGNOSTIC if EntityCategory else 'diagnostic'
+
+# key in the diagnostics of the hub, name, unit, icon
+DIAGNOSTICS = (
+    ('frames_per_second', 'frames per second', 'frames/s', 'mdi:swap-vertical'),
+    ('longest_gap', 'longest gap', 's', 'mdi:timer-sand'),
+    ('reconnects', 'reconnects', None, 'mdi:connection'),
+    ('tx_queue_depth', 'TX queue depth', None, 'mdi:tray-full'),
+    ('dropped_frames', 'dropped frames', None, 'mdi:alert-circle-outline'),
+)
+
+
+async def async_setup_platform(hass: HomeAssistantType, config: ConfigType, async_add_entities, discovery_info=None):
+    hub = hass.data[DOMAIN][DATA_HUBS][discovery_info[CONF_PANEL]]
+    async_add_entities([JablotronDiagnosticSensor(hub, *diagnostic) for diagnostic in DIAGNOSTICS], True)
+
+
+class JablotronDiagnosticSensor(Entity):
+    """Representation of one link health counter of a panel"""
+
+    def __init__(self, hub, key, name, unit, icon):
+        self._hub = hub
+        self._key = key
+        self._name = '%s %s' % (hub.name, name)
+        self._unit = unit
+        self._icon = icon
+        self._state = None
+        self._attributes = {}
+
+    @property
+    def unique_id(self):
+        return '%s_%s' % (self._hub.sensor_prefix, self._key)
+
+    @property
+    def name(self):
+        """Return the name of the sensor."""
+        return self._name
+
+    @property
+    def state(self):
+        """Return the state of the sensor."""
+        return self._state
+
+    @property
+    def unit_of_measurement(self):
+        return self._unit
+
+    @property
+    def icon(self):
+        return self._icon
+
+    @property
+    def entity_category(self):
+        return ENTITY_CATEGORY_DIAGNOSTIC
+
+    @property
+    def extra_state_attributes(self):
+        return self._attributes
+
+    async def async_update(self):
+        """Read the counters of the hub, they live in memory."""
+        diagnostics = self._hub.diagnostics()
+        self._state = diagnostics[self._key]
+
+        if self._key == 'frames_per_second':
+            self._attributes = dict(diagnostics['frames_per_second_by_header'], reports=diagnostics['reports'])
+        elif self._key == 'longest_gap':
+            self._attributes = {'current_gap': diagnostics['current_gap']}
+        elif self._key == 'reconnects':
+            self._attributes = {key: value for key, value in diagnostics['transport'].items() if value is not None}
+            self._attributes['resyncs'] = diagnostics['resyncs']
+        elif self._key == 'tx_queue_depth':
+            self._attributes = dict(diagnostics['tx_sent'], failed=diagnostics['tx_failed'])
+        elif self._key == 'dropped_frames':
+            self._attributes = {
+                'unknown_frames': diagnostics['unknown_frames'],
+                'truncated_frames': diagnostics['truncated_frames'],
+                'dropped_events': {event_type: counts['dropped'] for event_type, counts in diagnostics['events'].items()},
+                'handoff': diagnostics['handoff'],
+            }
@@ -0,0 +1,204 @@
+"""Jablotron link statistics
+
+ Counters and gauges about the link to one panel, updated from the io and
+ worker threads and read by the diagnostic sensors:
+ - messages per second by header, over a rolling window of about a minute,
+   the first MAX_HEADERS headers are counted one by one
+ - current and longest gap without any data from the panel
+ - reconnects of the transport and resyncs of the sensor states
+ - packets waiting to be written (TX queue depth) and written per kind
+   (keepalive, resync, startup, keys), these are queued from the event loop
+   and the io thread and written on the worker thread, so they are only
+   changed through the tx_* methods, under a lock
+ - dropped messages (cut off at the end of a report, or lost to an error)
+ - messages nobody could decode, in a histogram keyed by header and state
+   byte (the third byte) with the first message of every key as sample
+
+ This module does not depend on Home Assistant.
+"""
+
+import collections
+import threading
+import time
+
+WINDOW_SNAPSHOTS = 6
+SNAPSHOT_INTERVAL = 10
+UNKNOWN_KEYS = 1024
+MAX_HEADERS = 16 # headers counted one by one, the others of a garbled link go to OTHER_HEADERS
+OTHER_HEADERS = -1
+
+
+class LinkStats():
+    """Rolling counters and gauges of the link to one panel"""
+
+    def __init__(self):
+        self.reports = 0
+        self.frames = collections.Counter()
+        self.unknown = UnknownFrames()
+        self.dropped_frames = 0
+        self.reconnects = 0
+        self.resyncs = 0
+        self.tx_queue = 0
+        self.tx_sent = collections.Counter()
+        self.tx_failed = 0
+        self._tx_lock = threading.Lock()
+        self.longest_gap = 0.0
+        self.last_rx = None
+        self.started = time.monotonic()
+        self._connected_once = False
+        self._snapshots = collections.deque(maxlen=WINDOW_SNAPSHOTS + 1)
+        self.snapshot()
+
+    def report(self, now):
+        """Count a received report, at monotonic time now."""
+        self.reports += 1
+        if self.last_rx is not None:
+            gap = now - self.last_rx
+            if gap > self.longest_gap:
+                self.longest_gap = gap
+        self.last_rx = now
+
+    def frame(self, header):
+        """Count a received message."""
+        frames = self.frames
+        if header not in frames and len(frames) >= MAX_HEADERS:
+            header = OTHER_HEADERS
+        frames[header] += 1
+
+    def tx_queued(self, count):
+        """Count packets queued for writing."""
+        with self._tx_lock:
+            self.tx_queue += count
+
+    def tx_written(self, kind):
+        """Count a queued packet of that kind written to the panel."""
+        with self._tx_lock:
+            self.tx_queue -= 1
+            self.tx_sent[kind] += 1
+
+    def tx_dropped(self, count):
+        """Count queued packets which could not be written."""
+        with self._tx_lock:
+            self.tx_queue -= count
+            self.tx_failed += count
+
+    def connected(self):
+        """Count a connect of the transport, every connect after the first is a reconnect."""
+        if self._connected_once:
+            self.reconnects += 1
+        self._connected_once = True
+
+    def current_gap(self):
+        """Return the seconds since the last report."""
+        since = self.last_rx if self.last_rx is not None else self.started
+        return time.monotonic() - since
+
+    def snapshot(self):
+        """Remember the counters, for the rolling rates. Returns the seconds until the next snapshot."""
+        self._snapshots.append((time.monotonic(), self.frames.copy()))
+        return SNAPSHOT_INTERVAL
+
+    def rates(self):
+        """Return the messages per second by header over the rolling window."""
+        started, counts = self._snapshots[0]
+        elapsed = time.monotonic() - started
+        if elapsed <= 0:
+            return {}
+        current = self.frames.copy()
+        return {header: (count - counts.get(header, 0)) / elapsed for header, count in current.items()}
+
+    def as_dict(self):
+        """Return all counters and gauges."""
+        rates = self.rates()
+        with self._tx_lock:
+            tx_queue, tx_sent, tx_failed = self.tx_queue, dict(self.tx_sent), self.tx_failed
+        return {
+            'frames_per_second': round(sum(rates.values()), 2),
+            'frames_per_second_by_header': {_format_header(header): round(rate, 2)
+                                            for header, rate in sorted(rates.items())},
+            'reports': self.reports,
+            'current_gap': round(self.current_gap(), 1),
+            'longest_gap': round(self.longest_gap, 1),
+            'reconnects': self.reconnects,
+            'resyncs': self.resyncs,
+            'tx_queue_depth': tx_queue,
+            'tx_sent': tx_sent,
+            'tx_failed': tx_failed,
+            'dropped_frames': self.dropped_frames,
+            'unknown_frames': self.unknown.total,
+        }
+
+
+class UnknownFrames():
+    """Histogram of the messages nobody could decode, keyed by header and state byte"""
+
+    def __init__(self):
+        self.total = 0
+        self.overflow = 0
+        self._counts = {}
+        self._samples = {}
+        self._summarized = {}
+
+    def add(self, report, offset):
+        """Count the message at offset of report, the first message of every key is kept."""
+        self.total += 1
+        data = report.data
+        state = data[offset + 2] if data[offset + 1] and offset + 2 < report.size else None
+        key = (report.header(offset), state)
+        count = self._counts.get(key)
+        if count is None:
+            if len(self._counts) >= UNKNOWN_KEYS:
+                self.overflow += 1
+                return
+            self._samples[key] = report.frame(offset)
+            count = 0
+        self._counts[key] = count + 1
+
+    def reset(self):
+        """Forget all counts and samples."""
+        self.total = 0
+        self.overflow = 0
+        self._counts = {}
+        self._samples = {}
+        self._summarized = {}
+
+    def summary(self):
+        """Return what was counted since the last summary as one line, None if nothing was."""
+        counts = dict(self._counts)
+        changed = []
+        for key, count in sorted(counts.items(), key=_by_header):
+            new = count - self._summarized.get(key, 0)
+            if new:
+                changed.append('%s x%d' % (_format_key(key), new))
+        self._summarized = counts
+        if not changed:
+            return None
+        return ', '.join(changed)
+
+    def dump(self):
+        """Return the histogram as lines of text, most frequent first, with the sample of every key."""
+        counts = dict(self._counts)
+        lines = ['header state %8s  sample' % 'count']
+        for key, count in sorted(counts.items(), key=lambda item: -item[1]):
+            header, state = key
+            lines.append('%04x   %-5s %8d  %s' % (header, '--' if state is None else '%02x' % state,
+                                                  count, self._samples.get(key, b'').hex()))
+        if self.overflow:
+            lines.append('%d messages not counted, more than %d keys' % (self.overflow, UNKNOWN_KEYS))
+        return lines
+
+
+def _by_header(item):
+    header, state = item[0]
+    return header, -1 if state is None else state
+
+
+def _format_header(header):
+    return 'other' if header == OTHER_HEADERS else '%04x' % header
+
+
+def _format_key(key):
+    header, state = key
+    if state is None:
+        return '%04x' % header
+    return '%04x/%02x' % (header, state)
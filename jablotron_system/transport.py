@@ -0,0 +1,477 @@
+"""Jablotron transports
+
+ The port option selects how the panel is reached:
+ - /dev/hidraw0             : local hidraw node (the default)
+ - tcp://192.168.1.10:4000  : raw TCP socket, for example ser2net next to a
+                              remote USB hub
+ - pty:///tmp/jablotron0    : pseudo terminal for testing, /tmp/jablotron0
+                              links to the slave side a simulator can open
+ - unix:///run/jablotron.sock : Unix socket of a reader daemon (see
+                              daemon.py) which owns the port
+
+ Every transport is non-blocking: open() never waits for a connection and
+ read_into() only returns complete 64 byte reports. Stream transports (TCP,
+ pty) collect partial reads until a full report is there. Every transport
+ keeps its own connection metrics.
+
+ This module does not depend on Home Assistant.
+"""
+
+import errno
+import logging
+import os
+import select
+import socket
+import time
+import tty
+from urllib.parse import urlsplit
+
+_LOGGER = logging.getLogger(__name__)
+
+REPORT_SIZE = 64
+CONNECT_TIMEOUT = 5.0
+WRITE_TIMEOUT = 1.0
+RECV_SIZE = 4096
+
+# records on the socket of the reader daemon: kind byte, length byte and payload
+DAEMON_REPORT = 0x01    # daemon to client, a report cut off after its last message
+DAEMON_WRITE = 0x02     # client to daemon, a packet to write to the panel
+DAEMON_FRAME = 0x03     # daemon to client, a decoded message as JSON (see protocol.decode())
+
+
+def open_transport(port):
+    """Return the transport for a port option."""
+    if '://' not in port:
+        return HidrawTransport(port)
+
+    url = urlsplit(port)
+    if url.scheme == 'tcp':
+        if not url.hostname or not url.port:
+            raise ValueError('expected tcp://host:port, got %s' % port)
+        return TcpTransport(url.hostname, url.port)
+    if url.scheme == 'pty':
+        if not url.path:
+            raise ValueError('expected pty:///path/to/link, got %s' % port)
+        return PtyTransport(url.path)
+    if url.scheme == 'unix':
+        if not url.path:
+            raise ValueError('expected unix:///path/to/socket, got %s' % port)
+        return DaemonTransport(url.path)
+    raise ValueError('unsupported port %s' % port)
+
+
+def valid_port(port):
+    """Validate a port option, for use in the config schema."""
+    open_transport(port)
+    return port
+
+
+class Transport():
+    """Base class of all transports"""
+
+    # True when the other end sends the keepalive itself, like the reader daemon
+    sends_keepalive = False
+
+    def __init__(self, name):
+        self.name = name
+        self.connected = False
+        self.metrics = {
+            'connects': 0,
+            'disconnects': 0,
+            'connect_failures': 0,
+            'reports_in': 0,
+            'bytes_in': 0,
+            'packets_out': 0,
+            'bytes_out': 0,
+            'write_failures': 0,
+            'connected_since': None,
+            'last_error': None,
+        }
+
+    @property
+    def buffered(self):
+        """Return True if a complete report can be read without waiting for the fd."""
+        return False
+
+    def fileno(self):
+        """Return the fd to wait on for incoming data."""
+        raise NotImplementedError
+
+    def open(self):
+        """Start connecting, returns True when connected and False while still in progress.
+
+        Raises OSError when connecting failed.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Close the connection."""
+        raise NotImplementedError
+
+    def read_into(self, buffer):
+        """Read a report into buffer.
+
+        Returns the size of the report, None if no complete report is there
+        yet and 0 when the other side closed the connection.
+        """
+        raise NotImplementedError
+
+    def write(self, packet):
+        """Send a packet to the panel, may block, only called from the worker thread."""
+        raise NotImplementedError
+
+    def _connected(self):
+        self.connected = True
+        self.metrics['connects'] += 1
+        self.metrics['connected_since'] = time.time()
+        _LOGGER.info('%s: connected to %s', type(self).__name__, self.name)
+
+    def _disconnected(self):
+        if self.connected:
+            self.metrics['disconnects'] += 1
+        self.connected = False
+        self.metrics['connected_since'] = None
+
+    def _failed(self, ex):
+        self.metrics['connect_failures'] += 1
+        self.metrics['last_error'] = str(ex)
+
+    def _received(self, size):
+        self.metrics['reports_in'] += 1
+        self.metrics['bytes_in'] += size
+
+    def _sent(self, size):
+        self.metrics['packets_out'] += 1
+        self.metrics['bytes_out'] += size
+
+
+class HidrawTransport(Transport):
+    """Local hidraw node, every read returns one report"""
+
+    def __init__(self, path):
+        super().__init__(path)
+        self._path = path
+        self._fd = None
+
+    def fileno(self):
+        return self._fd
+
+    def open(self):
+        try:
+            self._fd = os.open(self._path, os.O_RDONLY | os.O_NONBLOCK)
+        except OSError as ex:
+            self._failed(ex)
+            raise
+        self._connected()
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+        self._disconnected()
+
+    def read_into(self, buffer):
+        try:
+            size = os.readv(self._fd, (buffer,))
+        except BlockingIOError:
+            return None
+        if size:
+            self._received(size)
+        return size
+
+    def write(self, packet):
+        try:
+            with open(self._path, 'wb') as f:
+                f.write(packet)
+        except OSError as ex:
+            self.metrics['write_failures'] += 1
+            self.metrics['last_error'] = str(ex)
+            raise
+        self._sent(len(packet))
+
+
+class StreamTransport(Transport):
+    """Transport over a byte stream, partial reads are collected into reports"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self._filled = 0
+        self._view = None
+
+    def _recv_into(self, view):
+        """Read into view, returns the number of bytes read."""
+        raise NotImplementedError
+
+    def read_into(self, buffer):
+        # partial reads land in the report buffer itself, it is only handed out once full
+        if self._view is None or self._view.obj is not buffer:
+            self._view = memoryview(buffer)
+            self._filled = 0
+
+        try:
+            size = self._recv_into(self._view[self._filled:REPORT_SIZE])
+        except (BlockingIOError, InterruptedError):
+            return None
+        if not size:
+            return 0
+
+        self._filled += size
+        if self._filled < REPORT_SIZE:
+            return None
+
+        self._filled = 0
+        self._received(REPORT_SIZE)
+        return REPORT_SIZE
+
+    def close(self):
+        self._filled = 0
+        self._view = None
+        self._disconnected()
+
+
+class TcpTransport(StreamTransport):
+    """Raw TCP socket, for example ser2net sharing a remote hidraw or serial port"""
+
+    def __init__(self, host, port):
+        super().__init__('tcp://%s:%d' % (host, port))
+        self._address = (host, port)
+        self._sock = None
+        self._connect_started = None
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def open(self):
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                self._sock.setblocking(False)
+                self._sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                self._connect_started = time.monotonic()
+                result = self._sock.connect_ex(self._address)
+                if result not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+                    raise OSError(result, os.strerror(result))
+                if result == 0:
+                    self._connected()
+                    return True
+
+            if not wait_writable(self._sock, 0):
+                if time.monotonic() - self._connect_started > CONNECT_TIMEOUT:
+                    raise TimeoutError('connecting to %s timed out' % self.name)
+                return False
+
+            result = self._sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if result:
+                raise OSError(result, os.strerror(result))
+
+        except OSError as ex:
+            self._failed(ex)
+            self._close_socket()
+            raise
+
+        self._connected()
+        return True
+
+    def _close_socket(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def close(self):
+        self._close_socket()
+        super().close()
+
+    def _recv_into(self, view):
+        return self._sock.recv_into(view)
+
+    def write(self, packet):
+        try:
+            send_all(self._sock, packet)
+        except (OSError, AttributeError) as ex:
+            self.metrics['write_failures'] += 1
+            self.metrics['last_error'] = str(ex)
+            raise OSError('unable to write to %s' % self.name) from ex
+        self._sent(len(packet))
+
+
+class PtyTransport(StreamTransport):
+    """Pseudo terminal for testing, a simulator writes reports to the slave side"""
+
+    def __init__(self, link):
+        super().__init__('pty://' + link)
+        self._link = link
+        self._master = None
+        self._slave = None
+
+    def fileno(self):
+        return self._master
+
+    def open(self):
+        try:
+            self._master, self._slave = os.openpty()
+            tty.setraw(self._slave)
+            os.set_blocking(self._master, False)
+            if os.path.lexists(self._link):
+                os.unlink(self._link)
+            os.symlink(os.ttyname(self._slave), self._link)
+        except OSError as ex:
+            self._failed(ex)
+            self.close()
+            raise
+        self._connected()
+        return True
+
+    def close(self):
+        for fd in (self._master, self._slave):
+            if fd is not None:
+                os.close(fd)
+        self._master = self._slave = None
+        if os.path.islink(self._link):
+            os.unlink(self._link)
+        super().close()
+
+    def _recv_into(self, view):
+        return os.readv(self._master, (view,))
+
+    def write(self, packet):
+        try:
+            os.write(self._master, packet)
+        except (OSError, TypeError) as ex:
+            self.metrics['write_failures'] += 1
+            self.metrics['last_error'] = str(ex)
+            raise OSError('unable to write to %s' % self.name) from ex
+        self._sent(len(packet))
+
+
+def daemon_record(kind, payload):
+    """Return a record for the socket of the reader daemon."""
+    return bytes((kind, len(payload))) + payload
+
+
+def wait_writable(sock, timeout):
+    """Wait at most timeout seconds for room to write, returns True if there is.
+
+    Uses poll(), which unlike select() works for any fd number.
+    """
+    poller = select.poll()
+    poller.register(sock, select.POLLOUT)
+    return bool(poller.poll(timeout * 1000))
+
+
+def send_all(sock, data, timeout=WRITE_TIMEOUT):
+    """Send data on a non-blocking socket, waiting at most timeout seconds for room."""
+    view = memoryview(data)
+    deadline = time.monotonic() + timeout
+    while view:
+        try:
+            view = view[sock.send(view):]
+        except BlockingIOError:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError('unable to send within %s s' % timeout)
+            wait_writable(sock, remaining)
+
+
+class RecordBuffer():
+    """Split the byte stream of a daemon socket into (kind, payload) records"""
+
+    def __init__(self):
+        self._data = bytearray()
+        self._start = 0
+
+    def feed(self, data):
+        """Add received bytes."""
+        if self._start:
+            del self._data[:self._start]
+            self._start = 0
+        self._data += data
+
+    def next(self):
+        """Return the next complete record, None if there is none yet."""
+        data = self._data
+        start = self._start
+        if len(data) - start < 2:
+            return None
+        end = start + 2 + data[start + 1]
+        if end > len(data):
+            return None
+        self._start = end
+        return data[start], bytes(data[start + 2:end])
+
+    def has_record(self):
+        """Return True if a complete record is buffered."""
+        start = self._start
+        return len(self._data) - start >= 2 and start + 2 + self._data[start + 1] <= len(self._data)
+
+    def clear(self):
+        self._data = bytearray()
+        self._start = 0
+
+
+class DaemonTransport(Transport):
+    """Unix socket of a reader daemon, which owns the port and streams the reports it read"""
+
+    sends_keepalive = True
+
+    def __init__(self, path):
+        super().__init__('unix://' + path)
+        self._path = path
+        self._sock = None
+        self._records = RecordBuffer()
+
+    @property
+    def buffered(self):
+        return self._records.has_record()
+
+    def fileno(self):
+        return self._sock.fileno()
+
+    def open(self):
+        try:
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._sock.connect(self._path)
+            self._sock.setblocking(False)
+        except OSError as ex:
+            self._failed(ex)
+            self.close()
+            raise
+        self._connected()
+        return True
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        self._records.clear()
+        self._disconnected()
+
+    def read_into(self, buffer):
+        while True:
+            record = self._records.next()
+            if record is None:
+                try:
+                    data = self._sock.recv(RECV_SIZE)
+                except (BlockingIOError, InterruptedError):
+                    return None
+                if not data:
+                    return 0
+                self._records.feed(data)
+                continue
+
+            kind, payload = record
+            if kind != DAEMON_REPORT or not payload:
+                continue
+            size = len(payload)
+            buffer[:size] = payload
+            self._received(size)
+            return size
+
+    def write(self, packet):
+        try:
+            send_all(self._sock, daemon_record(DAEMON_WRITE, packet))
+        except (OSError, AttributeError) as ex:
+            self.metrics['write_failures'] += 1
+            self.metrics['last_error'] = str(ex)
+            raise OSError('unable to write to %s' % self.name) from ex
+        self._sent(len(packet))
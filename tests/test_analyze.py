@@ -0,0 +1,108 @@
+"""Tests for the capture analyzer, its NumPy and its pure python decoding"""
+
+import csv
+
+import pytest
+
+from jablotron_system import analyze
+from jablotron_system.analyze import Analysis, write_csv
+from jablotron_system.protocol import REPORT_SIZE, load_tables
+
+STATE_DISARMED = b'\x51\x22\x01' + bytes(33)
+STATE_ARMED_AWAY = b'\x51\x22\x03' + bytes(33)
+STATUS = b'\xd8\x08\x00\x05\x00' + bytes(5)           # sensors 0 and 2 ON
+SENSOR_ON = b'\x55\x09\x00\x6c\x00\x01' + bytes(5)     # sensor 4 ON
+UNKNOWN = b'\x12\x02\xaa\xbb'
+
+CAPTURE = (
+    STATE_DISARMED,
+    STATUS + SENSOR_ON,
+    STATE_ARMED_AWAY + UNKNOWN,
+    bytes(14) + STATE_DISARMED,                                 # known message after the padding
+    b'\x12\x01\x00\x13\xf0' + bytes(3) + b'\xd8\x08' + bytes(8),  # garbled length, the status after it is found
+    bytes(60) + SENSOR_ON[:4],                                  # cut off by the end of the report
+    STATE_DISARMED,
+)
+
+
+@pytest.fixture
+def capture(tmp_path):
+    path = tmp_path / 'capture.bin'
+    path.write_bytes(b''.join(report.ljust(REPORT_SIZE, b'\x00') for report in CAPTURE))
+    return str(path)
+
+
+def analyze_capture(path):
+    analysis = Analysis(load_tables())
+    analysis.add_file(path)
+    return analysis.result()
+
+
+def header(row):
+    return row['header']
+
+
+@pytest.fixture
+def pure_python(monkeypatch):
+    monkeypatch.setattr(analyze, 'np', None)
+
+
+def test_pure_python(capture, pure_python):
+    result = analyze_capture(capture)
+    summary = result['summary']
+    assert summary['records'] == len(CAPTURE)
+    assert summary['messages'] == 9
+    assert summary['truncated'] == 1
+    assert summary['resyncs'] == 2
+    assert not summary['vectorised']
+
+    assert {row['header']: (row['count'], row['known']) for row in result['headers']} == {
+        '5122': (4, True), 'd808': (2, True), '5509': (1, True), '1202': (1, False), '1201': (1, False),
+    }
+    assert {'header': '5122', 'byte': 3, 'value': '03', 'count': 1, 'meaning': 'armed_away'} in result['bytes']
+
+    events = [(row['record'], row['event'], row['subject'], row['value']) for row in result['timeline']]
+    assert events == [
+        (0, 'alarm_state', None, 'disarmed'),
+        (1, 'status', 0, 'on'),
+        (1, 'status', 2, 'on'),
+        (1, 'sensor', 4, 'on'),
+        (2, 'alarm_state', 'disarmed', 'armed_away'),
+        (3, 'alarm_state', 'armed_away', 'disarmed'),
+        (4, 'status', 0, 'off'),
+        (4, 'status', 2, 'off'),
+    ]
+
+
+def test_numpy_matches_pure_python(capture, monkeypatch):
+    pytest.importorskip('numpy')
+    vectorised = analyze_capture(capture)
+    assert vectorised['summary'].pop('vectorised')
+
+    monkeypatch.setattr(analyze, 'np', None)
+    expected = analyze_capture(capture)
+    expected['summary'].pop('vectorised')
+
+    assert vectorised['summary'] == expected['summary']
+    # messages counted as often are in no particular order
+    assert sorted(vectorised['headers'], key=header) == sorted(expected['headers'], key=header)
+    assert vectorised['bytes'] == expected['bytes']
+    assert vectorised['timeline'] == expected['timeline']
+
+
+def test_csv(capture, pure_python, tmp_path):
+    result = analyze_capture(capture)
+    paths = write_csv(result, str(tmp_path / 'jablotron'))
+    assert paths == [str(tmp_path / ('jablotron_%s.csv' % part)) for part in ('headers', 'bytes', 'timeline')]
+
+    with open(paths[0], newline='') as f:
+        headers = list(csv.DictReader(f))
+    assert headers[0] == {'header': '5122', 'count': '4', 'known': 'True'}
+
+    with open(paths[2], newline='') as f:
+        reader = csv.DictReader(f)
+        assert tuple(reader.fieldnames) == analyze.TIMELINE_FIELDS
+        timeline = list(reader)
+    assert len(timeline) == len(result['timeline'])
+    assert timeline[1] == {'file': 'capture.bin', 'record': '1', 'header': 'd808', 'event': 'status',
+                           'subject': '0', 'value': 'on', 'code': '0005'}
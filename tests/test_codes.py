@@ -0,0 +1,75 @@
+"""Tests for the code tables"""
+
+import json
+
+import pytest
+
+from jablotron_system.protocol import CodeTables, CODES_VERSION
+
+
+@pytest.fixture
+def codes_file(tmp_path):
+    path = tmp_path / 'codes.json'
+    path.write_text(json.dumps({
+        'version': CODES_VERSION,
+        'tables': {
+            'ja100_state': {'40': 'disarmed', '43': 'armed_away'},
+            'sensor_on': {'6d': 'on'},
+        },
+    }))
+    return str(path)
+
+
+def test_shipped_tables_load():
+    tables = CodeTables.load()
+    assert len(tables.ja100_state) == 256
+    assert len(tables.sensor_on) == 256
+
+
+def test_lookup_by_byte_value(codes_file):
+    tables = CodeTables.load(path=codes_file)
+    assert tables.ja100_state[0x40] == 'disarmed'
+    assert tables.ja100_state[0x43] == 'armed_away'
+    assert tables.ja100_state[0x41] is None
+    assert tables.sensor_on[0x6d] == 'on'
+
+
+def test_overrides_add_change_and_remove(codes_file):
+    tables = CodeTables.load({
+        'ja100_state': {'41': 'armed_home', '43': 'armed_night'},
+        'sensor_on': {'6d': None},
+    }, path=codes_file)
+    assert tables.ja100_state[0x40] == 'disarmed'
+    assert tables.ja100_state[0x41] == 'armed_home'
+    assert tables.ja100_state[0x43] == 'armed_night'
+    assert tables.sensor_on[0x6d] is None
+
+
+@pytest.mark.parametrize('key', [40, 0x40, True, 1.5, None])
+def test_unquoted_key_is_rejected(codes_file, key):
+    # an unquoted YAML key 40: arrives as the number forty, not 0x40
+    with pytest.raises(ValueError, match='quoted hex string'):
+        CodeTables.load({'ja100_state': {key: 'disarmed'}}, path=codes_file)
+
+
+@pytest.mark.parametrize('key', ['zz', '100', '-1'])
+def test_invalid_key_is_rejected(codes_file, key):
+    with pytest.raises(ValueError, match='ja100_state'):
+        CodeTables.load({'ja100_state': {key: 'disarmed'}}, path=codes_file)
+
+
+def test_invalid_value_is_rejected(codes_file):
+    with pytest.raises(ValueError, match='is not one of'):
+        CodeTables.load({'ja100_state': {'41': 'on fire'}}, path=codes_file)
+
+
+def test_unknown_table_is_rejected(codes_file):
+    with pytest.raises(ValueError, match='unknown code tables'):
+        CodeTables.load({'ja100_stat': {'41': 'armed_home'}}, path=codes_file)
+
+
+def test_version_is_checked(tmp_path):
+    path = tmp_path / 'codes.json'
+    path.write_text(json.dumps({'version': CODES_VERSION + 1, 'tables': {}}))
+    with pytest.raises(ValueError, match='version'):
+        CodeTables.load(path=str(path))
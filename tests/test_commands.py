@@ -0,0 +1,51 @@
+"""Tests for the command packets sent to the panel"""
+
+import pytest
+
+from jablotron_system.commands import CommandEncoder, encode, JA100_DIGITS, JA80_KEYS
+
+
+def test_activation():
+    assert CommandEncoder('1234').activation == b'\x80\x08\x03\x39\x39\x39\x31\x32\x33\x34'
+
+
+def test_ja100_submits_the_code_before_the_action():
+    commands = CommandEncoder('1234')
+    assert commands.ja100('*1', '1234') == (b'\x80\x08\x03\x30\x31\x32\x33\x34', b'\x80\x02\x0d\xa0')
+    assert commands.ja100('*0', None) == (b'\x80\x08\x03\x30', b'\x80\x02\x0d\x90')
+
+
+def test_ja100_unknown_action():
+    with pytest.raises(KeyError):
+        CommandEncoder('1234').ja100('*3', '1234')
+
+
+def test_ja80_one_packet_per_key():
+    commands = CommandEncoder('1234')
+    assert commands.ja80('*2', '12') == (b'\x00\x02\x01\x8f', b'\x00\x02\x01\x82',
+                                         b'\x00\x02\x01\x81', b'\x00\x02\x01\x82')
+    assert commands.ja80('*0', None) == (b'\x00\x02\x01\x8f', b'\x00\x02\x01\x80')
+
+
+def test_configured_code_is_served_from_the_cache():
+    commands = CommandEncoder('1234')
+    assert commands.ja100('*2', '1234') is commands.ja100('*2', '1234')
+    assert commands.ja80('*1', '1234') is commands.ja80('*1', '1234')
+    # other codes are built on every call
+    assert commands.ja100('*2', '5678') == commands.ja100('*2', '5678')
+    assert commands.ja100('*2', '5678') is not commands.ja100('*2', '5678')
+
+
+def test_invalid_code_has_no_activation():
+    commands = CommandEncoder('12a4')
+    assert commands.activation is None
+    assert commands.ja100('*0', '') == (b'\x80\x08\x03\x30', b'\x80\x02\x0d\x90')
+    with pytest.raises(ValueError):
+        commands.ja100('*0', '12a4')
+
+
+def test_encode():
+    assert encode('09', JA100_DIGITS) == b'\x30\x39'
+    assert encode('#?*', JA80_KEYS) == b'\x8e\x8e\x8f'
+    with pytest.raises(ValueError, match='invalid key'):
+        encode('1#', JA100_DIGITS)
@@ -0,0 +1,104 @@
+"""Tests for the reader daemon, with a pseudo terminal as panel"""
+
+import json
+import os
+import selectors
+import socket
+import time
+
+import pytest
+
+from jablotron_system.daemon import ReaderDaemon
+from jablotron_system.protocol import CodeTables, CODES_VERSION, REPORT_SIZE
+from jablotron_system.transport import DAEMON_FRAME, DAEMON_REPORT, DAEMON_WRITE, RecordBuffer, daemon_record
+
+TIMEOUT = 5
+
+
+@pytest.fixture(params=[False], ids=['reports'])
+def daemon(request, tmp_path):
+    codes = CodeTables(CODES_VERSION, {'ja100_state': {0x03: 'armed_away'}})
+    daemon = ReaderDaemon('pty://%s' % (tmp_path / 'panel'), str(tmp_path / 'panel.sock'), keepalive=0, codes=codes,
+                          frames=request.param)
+    daemon.start()
+    yield daemon
+    daemon.stop()
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def connect(tmp_path):
+    wait_for(lambda: os.path.exists(tmp_path / 'panel') and os.path.exists(tmp_path / 'panel.sock'))
+    panel = os.open(tmp_path / 'panel', os.O_RDWR | os.O_NOCTTY)
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    client.connect(str(tmp_path / 'panel.sock'))
+    client.settimeout(TIMEOUT)
+    return panel, client
+
+
+def read_records(client, count):
+    records = RecordBuffer()
+    found = []
+    while len(found) < count:
+        records.feed(client.recv(4096))
+        record = records.next()
+        while record is not None:
+            found.append(record)
+            record = records.next()
+    return found
+
+
+def test_reports_are_streamed(daemon, tmp_path):
+    panel, client = connect(tmp_path)
+    try:
+        wait_for(lambda: daemon.transport.connected and daemon.clients)
+        state = b'\x51\x22\x03' + bytes(33)
+        unknown = b'\x12\x02\xaa\xbb'
+        os.write(panel, (state + unknown).ljust(REPORT_SIZE, b'\x00'))
+        os.write(panel, unknown.ljust(REPORT_SIZE, b'\x00'))
+
+        # no decoded frames unless asked for
+        assert read_records(client, 2) == [(DAEMON_REPORT, state + unknown), (DAEMON_REPORT, unknown)]
+        assert not daemon.frames
+    finally:
+        client.close()
+        os.close(panel)
+
+
+@pytest.mark.parametrize('daemon', [True], ids=['frames'], indirect=True)
+def test_reports_and_frames_are_streamed(daemon, tmp_path):
+    panel, client = connect(tmp_path)
+    try:
+        wait_for(lambda: daemon.transport.connected and daemon.clients)
+        state = b'\x51\x22\x03' + bytes(33)
+        unknown = b'\x12\x02\xaa\xbb'
+        os.write(panel, (state + unknown).ljust(REPORT_SIZE, b'\x00'))
+
+        (kind, report), (frame_kind, frame) = read_records(client, 2)
+        assert kind == DAEMON_REPORT
+        assert report == state + unknown
+        assert frame_kind == DAEMON_FRAME
+        assert json.loads(frame) == {'type': 'state', 'model': 'ja100', 'code': '03', 'state': 'armed_away'}
+        assert daemon.frames == {'state': 1, 'unknown': 1}
+    finally:
+        client.close()
+        os.close(panel)
+
+
+def test_packets_are_written_to_the_panel(daemon, tmp_path):
+    panel, client = connect(tmp_path)
+    try:
+        wait_for(lambda: daemon.transport.connected and daemon.clients)
+        client.sendall(daemon_record(DAEMON_WRITE, b'\x52\x01\x02'))
+        with selectors.DefaultSelector() as selector:
+            selector.register(panel, selectors.EVENT_READ)
+            assert selector.select(TIMEOUT)
+        assert os.read(panel, 64) == b'\x52\x01\x02'
+    finally:
+        client.close()
+        os.close(panel)
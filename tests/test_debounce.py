@@ -0,0 +1,137 @@
+"""Tests for the debouncing of sensor states"""
+
+import pytest
+
+from jablotron_system.debounce import SensorDebouncer, STATE_ON, STATE_OFF
+
+
+class Timer():
+    def __init__(self, loop, when, callback):
+        self.loop = loop
+        self.when = when
+        self.callback = callback
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class Loop():
+    """Event loop clock and timers, moved by hand"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.timers = []
+
+    def time(self):
+        return self.now
+
+    def call_later(self, delay, callback):
+        timer = Timer(self, self.now + delay, callback)
+        self.timers.append(timer)
+        return timer
+
+    def advance(self, seconds):
+        self.now += seconds
+        due = [timer for timer in self.timers if timer.when <= self.now and not timer.cancelled]
+        self.timers = [timer for timer in self.timers if timer not in due and not timer.cancelled]
+        for timer in due:
+            timer.callback()
+
+
+class Device():
+    dev_id = 'jablotron_7'
+
+    def __init__(self):
+        self._state = STATE_OFF
+        self.writes = []
+
+    @property
+    def state(self):
+        return self._state
+
+    def async_schedule_update_ha_state(self):
+        self.writes.append(self._state)
+
+
+@pytest.fixture
+def loop():
+    return Loop()
+
+
+@pytest.fixture
+def device():
+    return Device()
+
+
+def test_without_delays_states_pass(loop, device):
+    debouncer = SensorDebouncer(loop, device, 0, 0)
+    debouncer.async_update(STATE_ON)
+    debouncer.async_update(STATE_OFF)
+    assert device.writes == [STATE_ON, STATE_OFF]
+
+
+def test_on_is_written_once(loop, device):
+    debouncer = SensorDebouncer(loop, device, 0, 0)
+    debouncer.async_update(STATE_ON)
+    debouncer.async_update(STATE_ON)
+    assert device.writes == [STATE_ON]
+
+
+def test_off_waits_for_off_delay(loop, device):
+    debouncer = SensorDebouncer(loop, device, 0, 2.0)
+    debouncer.async_update(STATE_ON)
+    debouncer.async_update(STATE_OFF)
+    loop.advance(1.9)
+    assert device.writes == [STATE_ON]
+    loop.advance(0.1)
+    assert device.writes == [STATE_ON, STATE_OFF]
+
+
+def test_on_cancels_pending_off(loop, device):
+    debouncer = SensorDebouncer(loop, device, 0, 2.0)
+    debouncer.async_update(STATE_ON)
+    for _ in range(5):
+        debouncer.async_update(STATE_OFF)
+        loop.advance(1.0)
+        debouncer.async_update(STATE_ON)
+    loop.advance(10)
+    assert device.writes == [STATE_ON]
+    assert debouncer.suppressed == 5
+
+
+def test_off_waits_for_min_on(loop, device):
+    debouncer = SensorDebouncer(loop, device, 5.0, 1.0)
+    debouncer.async_update(STATE_ON)
+    loop.advance(1.0)
+    debouncer.async_update(STATE_OFF)
+    loop.advance(3.9)
+    assert device.writes == [STATE_ON]
+    loop.advance(0.1)
+    assert device.writes == [STATE_ON, STATE_OFF]
+
+
+def test_off_after_min_on_uses_off_delay(loop, device):
+    debouncer = SensorDebouncer(loop, device, 5.0, 1.0)
+    debouncer.async_update(STATE_ON)
+    loop.advance(10)
+    debouncer.async_update(STATE_OFF)
+    loop.advance(0.9)
+    assert device.writes == [STATE_ON]
+    loop.advance(0.1)
+    assert device.writes == [STATE_ON, STATE_OFF]
+
+
+def test_repeated_off_keeps_one_timer(loop, device):
+    debouncer = SensorDebouncer(loop, device, 0, 2.0)
+    debouncer.async_update(STATE_ON)
+    debouncer.async_update(STATE_OFF)
+    debouncer.async_update(STATE_OFF)
+    assert len(loop.timers) == 1
+
+
+def test_off_of_off_sensor_is_ignored(loop, device):
+    debouncer = SensorDebouncer(loop, device, 0, 2.0)
+    debouncer.async_update(STATE_OFF)
+    assert device.writes == []
+    assert loop.timers == []
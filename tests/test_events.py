@@ -0,0 +1,100 @@
+"""Tests for the rate limits and sampling of the event stream"""
+
+import pytest
+
+from jablotron_system import events
+from jablotron_system.events import (EventLimiter, EventStream, EVENT_ARM, EVENT_FIELDS, EVENT_HEARTBEAT, EVENT_SENSOR,
+                                     EVENT_TAMPER, EVENT_TYPES)
+
+
+class Clock():
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(events.time, 'monotonic', clock)
+    return clock
+
+
+def test_no_rate_never_drops(clock):
+    limiter = EventLimiter()
+    assert all(limiter.allow() for _ in range(1000))
+    assert limiter.fired == 1000
+    assert limiter.dropped == 0
+
+
+def test_burst_of_one_second(clock):
+    limiter = EventLimiter(rate=5.0)
+    allowed = [limiter.allow() for _ in range(8)]
+    assert allowed == [True] * 5 + [False] * 3
+    assert (limiter.fired, limiter.dropped) == (5, 3)
+
+
+def test_tokens_refill_with_time(clock):
+    limiter = EventLimiter(rate=5.0)
+    for _ in range(5):
+        limiter.allow()
+    assert not limiter.allow()
+    clock.now += 0.2
+    assert limiter.allow()
+    assert not limiter.allow()
+    clock.now += 10
+    # refill stops at the burst
+    assert sum(limiter.allow() for _ in range(10)) == 5
+
+
+def test_slow_rate_allows_one_event(clock):
+    limiter = EventLimiter(rate=1 / 60)
+    assert limiter.allow()
+    assert not limiter.allow()
+    clock.now += 30
+    assert not limiter.allow()
+    clock.now += 31
+    assert limiter.allow()
+
+
+def test_sampling(clock):
+    limiter = EventLimiter(sample=3)
+    allowed = [limiter.allow() for _ in range(9)]
+    assert allowed == [False, False, True] * 3
+    assert (limiter.fired, limiter.dropped) == (3, 6)
+
+
+def test_stream_adds_type_and_panel(clock):
+    fired = []
+    stream = EventStream(fired.append, 'panel', {EVENT_SENSOR: {'rate': None}})
+    assert stream.fire(EVENT_SENSOR, 3, 'on')
+    assert fired == [{'dev_id': 3, 'state': 'on', 'type': EVENT_SENSOR, 'panel': 'panel'}]
+
+
+def test_stream_names_the_values(clock):
+    assert set(EVENT_FIELDS) == set(EVENT_TYPES)
+    fired = []
+    stream = EventStream(fired.append, 'panel')
+    assert stream.fire(EVENT_ARM, 'armed_away', 'user 1', True)
+    assert fired == [{'state': 'armed_away', 'user': 'user 1', 'local': True, 'type': EVENT_ARM, 'panel': 'panel'}]
+
+
+def test_stream_limits_per_type(clock):
+    fired = []
+    stream = EventStream(fired.append, 'panel')
+    assert stream.fire(EVENT_HEARTBEAT, '21')
+    assert not stream.fire(EVENT_HEARTBEAT, '21')
+    assert stream.fire(EVENT_TAMPER, 1, '6d')
+    stats = stream.stats()
+    assert stats[EVENT_HEARTBEAT] == {'fired': 1, 'dropped': 1}
+    assert stats[EVENT_TAMPER] == {'fired': 1, 'dropped': 0}
+
+
+def test_stream_survives_failing_fire(clock):
+    def fire(data):
+        raise RuntimeError('bus closed')
+
+    stream = EventStream(fire, 'panel')
+    assert not stream.fire(EVENT_TAMPER, 1, '6d')
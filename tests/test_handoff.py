@@ -0,0 +1,130 @@
+"""Tests for the hand-off queue to the event loop"""
+
+import pytest
+
+from jablotron_system.handoff import HandoffQueue
+
+
+class Loop():
+    """call_soon_threadsafe() of an event loop which runs when told to"""
+
+    def __init__(self):
+        self.scheduled = []
+
+    def call_soon_threadsafe(self, callback):
+        self.scheduled.append(callback)
+
+    def run(self):
+        scheduled, self.scheduled = self.scheduled, []
+        for callback in scheduled:
+            callback()
+
+
+@pytest.fixture
+def loop():
+    return Loop()
+
+
+def test_one_wake_up_per_batch(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe)
+    calls = []
+    for index in range(10):
+        queue.put(calls.append, index)
+    assert len(loop.scheduled) == 1
+    loop.run()
+    assert calls == list(range(10))
+    assert queue.stats()['batches'] == 1
+
+
+def test_put_latest_keeps_latest_per_key(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe)
+    calls = []
+    queue.put_latest('sensor_1', calls.append, 'on')
+    queue.put_latest('sensor_2', calls.append, 'on')
+    queue.put_latest('sensor_1', calls.append, 'off')
+    loop.run()
+    # the first position of the key is kept, with the latest call
+    assert calls == ['off', 'on']
+    assert queue.stats()['coalesced'] == 1
+
+
+def test_put_bounded_keeps_every_call(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe)
+    calls = []
+    # a sensor going on and off, and key presses without dev_id, in one batch
+    queue.put_bounded(calls.append, ('sensor', 7, 'on'))
+    queue.put_bounded(calls.append, ('sensor', 7, 'off'))
+    queue.put_bounded(calls.append, ('key_press', '81'))
+    queue.put_bounded(calls.append, ('key_press', '82'))
+    loop.run()
+    assert calls == [('sensor', 7, 'on'), ('sensor', 7, 'off'), ('key_press', '81'), ('key_press', '82')]
+    assert queue.stats()['coalesced'] == 0
+
+
+def test_put_bounded_drops_when_full(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe, maxsize=3)
+    calls = []
+    results = [queue.put_bounded(calls.append, index) for index in range(5)]
+    assert results == [True, True, True, False, False]
+    loop.run()
+    assert calls == [0, 1, 2]
+    stats = queue.stats()
+    assert stats['dropped'] == 2
+    assert stats['max_pending'] == 3
+
+
+def test_put_is_never_dropped(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe, maxsize=2)
+    calls = []
+    queue.put_bounded(calls.append, 'event')
+    queue.put(calls.append, 'arm')
+    queue.put(calls.append, 'alarm_state')
+    assert not queue.put_bounded(calls.append, 'dropped')
+    loop.run()
+    assert calls == ['event', 'arm', 'alarm_state']
+    stats = queue.stats()
+    assert stats['overflow'] == 1
+    assert stats['dropped'] == 1
+
+
+def test_put_latest_is_not_bounded_by_events(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe, maxsize=2)
+    calls = []
+    queue.put_bounded(calls.append, 'event_1')
+    queue.put_bounded(calls.append, 'event_2')
+    # a burst of events does not cost any sensor its latest state
+    assert all(queue.put_latest(('sensor', index), calls.append, index) for index in range(5))
+    assert queue.put_latest(('sensor', 0), calls.append, 'off')
+    loop.run()
+    assert calls == ['event_1', 'event_2', 'off', 1, 2, 3, 4]
+    stats = queue.stats()
+    assert stats['dropped'] == 0
+    assert stats['coalesced'] == 1
+
+    # the bound of the events starts over after the drain
+    assert queue.put_bounded(calls.append, 'event_3')
+
+
+def test_queue_is_empty_after_drain(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe)
+    calls = []
+    queue.put_bounded(calls.append, 1)
+    loop.run()
+    queue.put_bounded(calls.append, 2)
+    assert len(loop.scheduled) == 1
+    loop.run()
+    assert calls == [1, 2]
+    assert queue.stats()['pending'] == 0
+
+
+def test_failing_call_does_not_stop_the_batch(loop):
+    queue = HandoffQueue(loop.call_soon_threadsafe)
+    calls = []
+
+    def fail():
+        raise RuntimeError('entity removed')
+
+    queue.put(fail)
+    queue.put(calls.append, 'next')
+    loop.run()
+    assert calls == ['next']
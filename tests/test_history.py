@@ -0,0 +1,144 @@
+"""Tests for the event history, its ring buffer and its segment on disk"""
+
+import itertools
+import os
+
+import pytest
+
+from jablotron_system import history
+from jablotron_system.history import EventHistory, RECORD
+
+
+@pytest.fixture(autouse=True)
+def clock(monkeypatch):
+    """One second passes between records"""
+    ticks = itertools.count(1_700_000_000_000_000, 1_000_000)
+    monkeypatch.setattr(history, '_now', lambda: next(ticks))
+
+
+def records(path):
+    return os.path.getsize(path) // RECORD.size
+
+
+def test_sensor_records_changes_only():
+    events = EventHistory(capacity=16)
+    assert events.add_sensor(7, True)
+    assert not events.add_sensor(7, True)
+    assert events.add_sensor(7, False)
+
+    sensor = events.sensor(7)
+    assert sensor['state'] == 'off'
+    assert sensor['trips'] == 1
+    assert sensor['last_trip'] is not None
+    assert events.stats()['records'] == 2
+    assert events.sensor(8)['state'] is None
+
+
+def test_ring_evicts_the_oldest_trips():
+    events = EventHistory(capacity=4)
+    for _ in range(4):
+        events.add_sensor(1, True)
+        events.add_sensor(1, False)
+
+    assert events.stats() == {'records': 8, 'in_ring': 4, 'capacity': 4, 'unflushed': 8}
+    # only the trips of the last 4 records are left
+    assert events.sensor(1, window=3600)['trips'] == 2
+
+
+def test_evicted_trips_are_released():
+    events = EventHistory(capacity=16)
+    for _ in range(5000):
+        events.add_sensor(1, True)
+        events.add_sensor(1, False)
+
+    index = events._sensors[1]
+    assert len(index.trips) - index.start == 8
+    assert len(index.trips) <= 2048
+    assert events.sensor(1, window=3600)['trips'] == 8
+
+
+def test_clock_stepping_back(monkeypatch):
+    ticks = iter([1_700_000_100_000_000, 1_700_000_110_000_000, 1_700_000_050_000_000, 1_700_000_060_000_000,
+                  1_700_000_120_000_000])
+    monkeypatch.setattr(history, '_now', lambda: next(ticks))
+    events = EventHistory(capacity=16)
+    events.add_sensor(1, True)
+    events.add_sensor(1, False)
+    # the clock stepped back by 60 s, the records keep the time of the record before them
+    events.add_sensor(1, True)
+    events.add_sensor(1, False)
+
+    trips = list(events._sensors[1].trips)
+    assert trips == [1_700_000_100_000_000, 1_700_000_110_000_000]
+    assert [RECORD.unpack(events._records(index, index + 1))[0] for index in range(4)] == [
+        1_700_000_100_000_000] + [1_700_000_110_000_000] * 3
+    assert events.sensor(1, window=30)['trips'] == 2
+
+
+def test_arm():
+    events = EventHistory(capacity=16)
+    assert events.arm()['state'] is None
+    events.add_arm('armed_away', 0x12)
+    events.add_arm('something', 0x05)
+
+    arm = events.arm()
+    assert arm['state'] == 'unknown'
+    assert arm['user'] == '05'
+    assert arm['changes'] == 2
+
+
+def test_flush_appends_new_records(tmp_path):
+    path = str(tmp_path / 'history.bin')
+    events = EventHistory(path, capacity=16)
+    events.add_sensor(1, True)
+    events.add_sensor(2, True)
+    events.flush()
+    assert records(path) == 2
+
+    events.add_sensor(1, False)
+    events.flush()
+    events.flush()
+    assert records(path) == 3
+    assert events.stats()['unflushed'] == 0
+
+
+def test_flush_compacts_the_segment(tmp_path):
+    path = str(tmp_path / 'history.bin')
+    events = EventHistory(path, capacity=4)
+    for count in range(40):
+        events.add_sensor(1, count % 2 == 0)
+        events.flush()
+        assert records(path) <= 2 * 4
+
+    loaded = EventHistory(path, capacity=4)
+    loaded.load()
+    with open(path, 'rb') as f:
+        data = f.read()
+    # the newest records are at the end of the segment
+    assert data[-4 * RECORD.size:] == events._records(36, 40)
+    assert loaded.sensor(1)['state'] == events.sensor(1)['state'] == 'off'
+
+
+def test_load_reads_the_last_capacity_records(tmp_path):
+    path = str(tmp_path / 'history.bin')
+    events = EventHistory(path, capacity=16)
+    for sensor in range(10):
+        events.add_sensor(sensor, True)
+    events.add_arm('armed_home', 0x03)
+    events.flush()
+
+    loaded = EventHistory(path, capacity=8)
+    assert loaded.load() == 8
+    assert loaded.sensors() == [3, 4, 5, 6, 7, 8, 9]
+    assert loaded.sensor(9)['state'] == 'on'
+    assert loaded.arm()['state'] == 'armed_home'
+
+    # new records are appended after the loaded segment, not written again
+    loaded.add_sensor(9, False)
+    loaded.flush()
+    assert records(path) == 12
+
+
+def test_load_without_segment(tmp_path):
+    assert EventHistory(str(tmp_path / 'missing.bin')).load() == 0
+    assert EventHistory().load() == 0
@@ -0,0 +1,65 @@
+"""Tests for the alarm state machine of the alarm control panel"""
+
+import pytest
+
+from jablotron_system.panel import PANEL_TRANSITIONS, PanelStateMachine
+
+
+def test_arming_and_disarming():
+    machine = PanelStateMachine()
+    for state in ('disarmed', 'arming', 'armed_away', 'pending', 'triggered', 'disarmed'):
+        assert machine.transition(state)
+        assert machine.state == state
+    assert machine.transitions == 6
+    assert machine.unexpected == 0
+
+
+def test_same_state_is_no_transition():
+    machine = PanelStateMachine()
+    assert machine.transition('armed_home')
+    assert not machine.transition('armed_home')
+    assert machine.transitions == 1
+
+
+@pytest.mark.parametrize('state', ['heartbeat', 'key_press', None, 'unknown'])
+def test_only_alarm_states_are_accepted(state):
+    machine = PanelStateMachine()
+    machine.transition('armed_night')
+    assert not machine.transition(state)
+    assert machine.state == 'armed_night'
+
+
+def test_unexpected_transition_is_taken_and_counted(caplog):
+    machine = PanelStateMachine()
+    machine.transition('armed_away')
+    assert 'arming' not in PANEL_TRANSITIONS['armed_away']
+    # the panel is the authority
+    assert machine.transition('arming')
+    assert machine.state == 'arming'
+    assert machine.unexpected == 1
+    assert 'Unexpected Jablotron state transition: armed_away to arming' in caplog.text
+
+
+def test_every_state_is_expected_from_disarmed():
+    for state in PANEL_TRANSITIONS:
+        machine = PanelStateMachine()
+        machine.transition('disarmed')
+        machine.transition(state)
+        assert machine.unexpected == 0
+
+
+def test_link_loss_keeps_the_state():
+    machine = PanelStateMachine()
+    assert not machine.available
+    assert machine.set_available(True)
+    assert not machine.set_available(True)
+    machine.transition('armed_away')
+
+    assert machine.set_available(False)
+    assert not machine.available
+    assert machine.state == 'armed_away'
+
+    assert machine.set_available(True)
+    assert machine.available
+    assert machine.state == 'armed_away'
+    assert machine.transitions == 1
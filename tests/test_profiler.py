@@ -0,0 +1,64 @@
+"""Tests for the sampling profiler of the threads of the component"""
+
+import re
+import threading
+import time
+
+from jablotron_system.profiler import ThreadProfiler
+
+TIMEOUT = 5
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def spin(done):
+    while not done.is_set():
+        sum(range(100))
+
+
+def test_profile_of_the_named_threads(tmp_path):
+    done = threading.Event()
+    threads = [threading.Thread(target=spin, args=(done,), name='busy'),
+               threading.Thread(target=done.wait, name='idle'),
+               threading.Thread(target=spin, args=(done,), name='other')]
+    for thread in threads:
+        thread.start()
+
+    path = tmp_path / 'profiles' / 'profile.txt'
+    profiler = ThreadProfiler(threads[:2], 60, str(path), interval=0.001)
+    try:
+        profiler.start()
+        assert profiler.running
+        time.sleep(0.2)
+        # stopped long before the 60 seconds, the profile is still written
+        profiler.stop()
+        wait_for(lambda: not profiler.running)
+    finally:
+        done.set()
+        for thread in threads:
+            thread.join()
+
+    lines = path.read_text().splitlines()
+    elapsed = float(re.match(r'# Jablotron profile, ([\d.]+) s', lines[0]).group(1))
+    assert elapsed < TIMEOUT
+
+    busy = {match.group(1): (int(match.group(2)), int(match.group(3)))
+            for match in map(re.compile(r'(\w+) +(\d+) of +(\d+) samples busy').match, lines) if match}
+    assert set(busy) == {'busy', 'idle'}
+    assert busy['busy'][0] > 0
+    # waiting for the event is idle
+    assert busy['idle'][0] == 0
+
+    stacks = lines[lines.index('## collapsed stacks') + 1:]
+    assert stacks
+    for line in stacks:
+        stack, count = line.rsplit(' ', 1)
+        frames = stack.split(';')
+        assert frames[0] == 'busy'
+        assert 'spin' in frames
+        assert int(count) > 0
@@ -0,0 +1,172 @@
+"""Tests for the report parser"""
+
+import pytest
+
+from jablotron_system.protocol import (
+    CodeTables, FrameParser, Report, CODES_VERSION, REPORT_SIZE, HEADER_JA100_STATE, HEADER_STATUS, HEADER_WIRELESS,
+    KIND_ARM, KIND_HEARTBEAT, KIND_SENSOR, KIND_TAMPER, decode, decode_sensor)
+
+
+def message(header, fill=0x11):
+    """Return a complete message with that header"""
+    length = header & 0xff
+    return header.to_bytes(2, 'big') + bytes((fill,)) * length
+
+
+def parse(data, size=None):
+    data = bytes(data)
+    if size is None:
+        size = len(data)
+    report = Report()
+    report.data[:len(data)] = data
+    parser = FrameParser()
+    offsets = list(parser.feed(report, size))
+    return parser, report, offsets
+
+
+def test_messages_walked_by_length():
+    data = message(HEADER_STATUS) + message(HEADER_WIRELESS)
+    parser, report, offsets = parse(data.ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0, 10]
+    assert [report.header(offset) for offset in offsets] == [HEADER_STATUS, HEADER_WIRELESS]
+    assert parser.resyncs == 0
+    assert parser.truncated == 0
+
+
+def test_known_message_after_padding():
+    data = bytes(14) + message(HEADER_JA100_STATE, 0x03)
+    parser, report, offsets = parse(data.ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [14]
+    assert report.header(14) == HEADER_JA100_STATE
+    assert parser.resyncs == 1
+
+
+def test_complete_chain_is_kept():
+    # a walk which reaches the padding is not searched, the d8 08 inside the 13 08 message is payload
+    data = bytes((0x12, 0x01, 0x00, 0x13, 0x08)) + bytes(3) + message(HEADER_STATUS)
+    parser, report, offsets = parse(data.ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0, 3, 13]
+    assert parser.resyncs == 0
+
+
+def test_known_header_in_known_payload_is_not_a_message():
+    # the 82 01 inside the unknown 12 05 message after a JA-100 state is not a JA-80 state
+    data = bytes((0x51, 0x22, 0x03)) + bytes(33) + bytes((0x12, 0x05, 0xaa, 0x82, 0x01, 0x40, 0xbb))
+    parser, report, offsets = parse(data.ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0, 36]
+    assert parser.resyncs == 0
+
+
+def test_known_header_in_unknown_payload_is_not_a_message():
+    # the 55 09 inside the unknown 40 0c message is not sensor 256 ON
+    data = bytes((0x40, 0x0c, 0x00, 0x55, 0x09, 0x00, 0x6c, 0x00, 0x40)) + bytes(5)
+    parser, report, offsets = parse(data.ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0]
+    assert parser.resyncs == 0
+
+
+def test_known_message_after_cut_off_chain():
+    # a garbled length runs past the end of the report, the known message after it is still found
+    data = bytes((0x12, 0x01, 0x00, 0x13, 0xf0)) + bytes(3) + message(HEADER_STATUS)
+    parser, report, offsets = parse(data.ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0, 8]
+    assert report.header(8) == HEADER_STATUS
+    assert parser.resyncs == 1
+
+
+@pytest.mark.parametrize('header, offset', [(0x5509, 60), (0xd808, 62), (0x5122, 40)])
+def test_truncated_message_is_not_handed_out(header, offset):
+    data = bytearray(REPORT_SIZE)
+    data[offset:offset + 2] = header.to_bytes(2, 'big')
+    parser, report, offsets = parse(data)
+    assert offsets == []
+    assert parser.truncated == 1
+
+
+def test_short_report_does_not_decode_padding():
+    data = message(HEADER_STATUS) + message(HEADER_JA100_STATE)
+    parser, report, offsets = parse(data, size=20)
+    assert offsets == [0]
+    assert parser.truncated == 1
+    assert report.data[20:] == bytes(REPORT_SIZE - 20)
+
+
+def test_every_offset_holds_a_complete_message():
+    data = bytearray(REPORT_SIZE)
+    data[0:10] = message(HEADER_STATUS)
+    data[30:41] = message(HEADER_WIRELESS)
+    data[58:60] = HEADER_WIRELESS.to_bytes(2, 'big')
+    parser, report, offsets = parse(data)
+    assert offsets == [0, 30]
+    for offset in offsets:
+        assert offset + 2 + report.data[offset + 1] <= report.size
+
+
+def test_signature_inside_known_message_is_ignored():
+    data = bytearray(message(HEADER_JA100_STATE))
+    data[5:7] = HEADER_STATUS.to_bytes(2, 'big')
+    parser, report, offsets = parse(bytes(data).ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0]
+    assert parser.resyncs == 0
+
+
+def test_report_is_reused():
+    report = Report()
+    parser = FrameParser()
+    first = message(HEADER_JA100_STATE) + message(HEADER_STATUS)
+    report.data[:len(first)] = first
+    parser.feed(report, len(first))
+    report.data[:10] = message(HEADER_STATUS)
+    assert parser.feed(report, 10) == [0]
+    assert report.data[10:] == bytes(REPORT_SIZE - 10)
+
+
+@pytest.fixture
+def codes():
+    return CodeTables(CODES_VERSION, {
+        'ja80_state': {0x40: 'disarmed', 0xff: KIND_HEARTBEAT},
+        'ja100_state': {0x03: 'armed_away'},
+        'sensor_type': {0x01: 'sensor'},
+        'sensor_on': {0x6c: 'door'},
+        'sensor_tamper': {0x6d: 'tamper'},
+        'arm': {0x2e: 'armed_away'},
+    })
+
+
+def decode_one(codes, data):
+    parser, report, offsets = parse(bytes(data).ljust(REPORT_SIZE, b'\x00'))
+    assert offsets == [0]
+    return decode(codes, report, 0)
+
+
+def test_decode_state(codes):
+    assert decode_one(codes, b'\x82\x01\x40') == {'type': 'state', 'model': 'ja80', 'code': '40', 'state': 'disarmed'}
+    assert decode_one(codes, b'\x82\x01\xff')['state'] == KIND_HEARTBEAT
+    assert decode_one(codes, b'\x51\x22\x03' + bytes(33))['state'] == 'armed_away'
+    assert decode_one(codes, b'\x51\x22\x04' + bytes(33)) is None
+
+
+def test_decode_status(codes):
+    data = b'\xd8\x08\x00\x05\x80' + bytes(5)
+    assert decode_one(codes, data) == {'type': 'status', 'on': [0, 2, 15]}
+
+
+def test_decode_sensor(codes):
+    # the sensor number is the little endian word of bytes 5 and 6 divided by 64
+    on = b'\x55\x09\x01\x6c\xc0\x01' + bytes(5)
+    off = b'\x55\x09\x01\x6e\xc0\x01' + bytes(5)
+    tamper = b'\x55\x08\x01\x6d\xc0\x01' + bytes(4)
+    assert decode_one(codes, on) == {'type': KIND_SENSOR, 'sensor': 7, 'state': 'on'}
+    assert decode_one(codes, off) == {'type': KIND_SENSOR, 'sensor': 7, 'state': 'off'}
+    assert decode_one(codes, tamper) == {'type': KIND_TAMPER, 'sensor': 7, 'code': '6d'}
+
+
+def test_decode_arm(codes):
+    data = b'\x55\x09\x2e\x05' + bytes(7)
+    assert decode_one(codes, data) == {'type': KIND_ARM, 'state': 'armed_away', 'user': '05'}
+    parser, report, offsets = parse(bytes(data).ljust(REPORT_SIZE, b'\x00'))
+    assert decode_sensor(codes, report, 0) == (KIND_ARM, 'armed_away', 0x05)
+
+
+def test_decode_unknown_sensor_type(codes):
+    assert decode_one(codes, b'\x55\x09\x77\x6c' + bytes(7)) is None
@@ -0,0 +1,120 @@
+"""Tests for the shared io and worker threads"""
+
+import os
+import resource
+import socket
+import threading
+
+import pytest
+
+from jablotron_system.runtime import JablotronRuntime
+from jablotron_system.transport import wait_writable
+
+HIGH_FD = 1500
+
+
+@pytest.fixture
+def runtime():
+    runtime = JablotronRuntime()
+    runtime.start()
+    yield runtime
+    runtime.stop()
+
+
+def high_fd_pair():
+    """Return a socket pair whose reading end has an fd number select() cannot handle"""
+    if resource.getrlimit(resource.RLIMIT_NOFILE)[0] <= HIGH_FD:
+        pytest.skip('needs more than %d open files' % HIGH_FD)
+    left, right = socket.socketpair()
+    os.dup2(left.fileno(), HIGH_FD)
+    left.close()
+    return socket.socket(fileno=HIGH_FD), right
+
+
+def test_reader_with_high_fd(runtime):
+    reader, writer = high_fd_pair()
+    called = threading.Event()
+
+    def readable():
+        reader.recv(16)
+        called.set()
+
+    try:
+        runtime.add_reader(reader.fileno(), readable)
+        writer.send(b'x')
+        assert called.wait(2)
+        assert wait_writable(reader, 0)
+    finally:
+        runtime.remove_reader(reader.fileno())
+        reader.close()
+        writer.close()
+
+
+def test_removed_reader_is_not_called(runtime):
+    reader, writer = socket.socketpair()
+    calls = []
+    runtime.add_reader(reader.fileno(), lambda: calls.append(reader.recv(16)))
+    runtime.remove_reader(reader.fileno())
+    writer.send(b'x')
+    assert runtime.wait(0.2) is False
+    assert calls == []
+    reader.close()
+    writer.close()
+
+
+def test_reused_fd_is_watched(runtime):
+    first, writer = socket.socketpair()
+    fd = first.fileno()
+    runtime.add_reader(fd, lambda: None)
+    # the port is closed without removing the reader, the next one gets the same fd
+    first.close()
+    writer.close()
+    reader, writer = socket.socketpair()
+    if reader.fileno() != fd:
+        os.dup2(reader.fileno(), fd)
+        reader.close()
+        reader = socket.socket(fileno=fd)
+    called = threading.Event()
+    runtime.add_reader(fd, lambda: called.set() or reader.recv(16))
+    writer.send(b'x')
+    assert called.wait(2)
+    runtime.remove_reader(fd)
+    reader.close()
+    writer.close()
+
+
+def test_timers_repeat(runtime):
+    calls = []
+    done = threading.Event()
+
+    def tick():
+        calls.append(1)
+        if len(calls) == 3:
+            done.set()
+            return None
+        return 0.01
+
+    runtime.call_later(0, tick)
+    assert done.wait(2)
+
+
+def test_nothing_written_after_stop():
+    runtime = JablotronRuntime()
+    wake_w = runtime._wake_w
+    runtime.start()
+    runtime.stop()
+    # a new socket gets the fd of the wake up pipe, a late remove_reader() must not write to it
+    pairs = [socket.socketpair() for _ in range(3)]
+    try:
+        partners = [other for pair in pairs for sock, other in (pair, pair[::-1]) if sock.fileno() == wake_w]
+        if not partners:
+            pytest.skip('the fd of the wake up pipe was not reused')
+        runtime.remove_reader(partners[0].fileno())
+        runtime.call_later(0, lambda: None)
+        partners[0].setblocking(False)
+        with pytest.raises(BlockingIOError):
+            partners[0].recv(16)
+    finally:
+        for left, right in pairs:
+            left.close()
+            right.close()
@@ -0,0 +1,85 @@
+"""Tests for the link statistics"""
+
+import threading
+
+from jablotron_system import stats as stats_module
+from jablotron_system.protocol import REPORT_SIZE, Report
+from jablotron_system.stats import LinkStats, UnknownFrames
+
+
+def test_tx_counters_from_several_threads():
+    stats = LinkStats()
+    rounds = 20000
+
+    def queue():
+        for _ in range(rounds):
+            stats.tx_queued(2)
+
+    def write():
+        for _ in range(rounds):
+            stats.tx_written('keys')
+            stats.tx_dropped(1)
+
+    threads = [threading.Thread(target=queue), threading.Thread(target=write)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    diagnostics = stats.as_dict()
+    assert diagnostics['tx_queue_depth'] == 0
+    assert diagnostics['tx_sent'] == {'keys': rounds}
+    assert diagnostics['tx_failed'] == rounds
+
+
+def report(data):
+    report = Report()
+    report.data[:len(data)] = data
+    report.size = REPORT_SIZE
+    return report
+
+
+def test_unknown_frames_are_counted_per_header_and_state():
+    frames = UnknownFrames()
+    first = report(b'\x12\x02\xaa\x01' + b'\x12\x02\xaa\x02' + b'\x12\x02\xbb\x03' + b'\x13\x00')
+    for offset in (0, 4, 8, 12):
+        frames.add(first, offset)
+    assert frames.total == 4
+
+    # the summary holds what was counted since the last one
+    assert frames.summary() == '1202/aa x2, 1202/bb x1, 1300 x1'
+    assert frames.summary() is None
+    frames.add(first, 8)
+    assert frames.summary() == '1202/bb x1'
+
+    # most frequent first, with the first message of every key as sample
+    assert frames.dump() == [
+        'header state    count  sample',
+        '1202   aa           2  1202aa01',
+        '1202   bb           2  1202bb03',
+        '1300   --           1  1300',
+    ]
+
+
+def test_unknown_frames_overflow(monkeypatch):
+    monkeypatch.setattr(stats_module, 'UNKNOWN_KEYS', 2)
+    frames = UnknownFrames()
+    data = report(bytes((0x12, 0x01, 0x01, 0x12, 0x01, 0x02, 0x12, 0x01, 0x03)))
+    for offset in (0, 3, 6, 0):
+        frames.add(data, offset)
+    assert frames.total == 4
+    assert frames.overflow == 1
+    assert frames.dump()[-1] == '1 messages not counted, more than 2 keys'
+
+
+def test_unknown_frames_reset():
+    frames = UnknownFrames()
+    data = report(b'\x12\x02\xaa\x01')
+    frames.add(data, 0)
+    frames.summary()
+    frames.reset()
+    assert frames.total == frames.overflow == 0
+    assert frames.dump() == ['header state    count  sample']
+    # counts after the reset are new to the summary
+    frames.add(data, 0)
+    assert frames.summary() == '1202/aa x1'
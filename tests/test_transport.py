@@ -0,0 +1,171 @@
+"""Tests for the stream transports, with a local TCP server and a pseudo terminal as panel"""
+
+import os
+import selectors
+import socket
+import time
+
+import pytest
+
+from jablotron_system.transport import REPORT_SIZE, PtyTransport, TcpTransport, open_transport
+
+TIMEOUT = 5
+
+REPORT = bytes(range(REPORT_SIZE))
+
+
+def wait_for(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+def read(transport, buffer):
+    """Wait for the fd of the transport and read once, like the io thread does"""
+    with selectors.DefaultSelector() as selector:
+        selector.register(transport.fileno(), selectors.EVENT_READ)
+        assert selector.select(TIMEOUT)
+    return transport.read_into(buffer)
+
+
+@pytest.fixture
+def server():
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    server.settimeout(TIMEOUT)
+    yield server
+    server.close()
+
+
+def connect(server):
+    transport = TcpTransport(*server.getsockname())
+    wait_for(transport.open)
+    conn, _ = server.accept()
+    return transport, conn
+
+
+def test_open_transport():
+    assert isinstance(open_transport('tcp://192.168.1.10:4000'), TcpTransport)
+    assert isinstance(open_transport('pty:///tmp/jablotron0'), PtyTransport)
+    with pytest.raises(ValueError):
+        open_transport('tcp://192.168.1.10')
+    with pytest.raises(ValueError):
+        open_transport('udp://192.168.1.10:4000')
+
+
+def test_tcp_reports_are_reassembled(server):
+    transport, conn = connect(server)
+    try:
+        buffer = bytearray(REPORT_SIZE)
+        for start, end in ((0, 10), (10, 11), (11, 63)):
+            conn.sendall(REPORT[start:end])
+            assert read(transport, buffer) is None
+        # the end of the first report and the start of the next one in one segment
+        conn.sendall(REPORT[63:] + REPORT[:5])
+        assert read(transport, buffer) == REPORT_SIZE
+        assert buffer == REPORT
+
+        conn.sendall(REPORT[5:])
+        assert read(transport, buffer) == REPORT_SIZE
+        assert buffer == REPORT
+        assert transport.metrics['reports_in'] == 2
+    finally:
+        conn.close()
+        transport.close()
+
+
+def test_tcp_write(server):
+    transport, conn = connect(server)
+    try:
+        transport.write(b'\x52\x01\x02')
+        assert conn.recv(64) == b'\x52\x01\x02'
+        assert transport.metrics['packets_out'] == 1
+    finally:
+        conn.close()
+        transport.close()
+
+    with pytest.raises(OSError):
+        transport.write(b'\x52\x01\x02')
+    assert transport.metrics['write_failures'] == 1
+
+
+def test_tcp_reconnect(server):
+    transport, conn = connect(server)
+    buffer = bytearray(REPORT_SIZE)
+    conn.sendall(REPORT[:20])
+    assert read(transport, buffer) is None
+    conn.close()
+    assert read(transport, buffer) == 0
+    transport.close()
+    assert not transport.connected
+
+    wait_for(transport.open)
+    conn, _ = server.accept()
+    try:
+        # the part of the report from before the reconnect is gone
+        conn.sendall(REPORT)
+        assert read(transport, buffer) == REPORT_SIZE
+        assert buffer == REPORT
+        assert transport.metrics['connects'] == 2
+        assert transport.metrics['disconnects'] == 1
+    finally:
+        conn.close()
+        transport.close()
+
+
+def test_tcp_connect_refused(server):
+    address = server.getsockname()
+    server.close()
+    transport = TcpTransport(*address)
+    with pytest.raises(OSError):
+        wait_for(transport.open)
+    assert transport.metrics['connect_failures'] == 1
+    assert not transport.connected
+
+
+def test_pty_reports_are_reassembled(tmp_path):
+    link = str(tmp_path / 'panel')
+    transport = PtyTransport(link)
+    assert transport.open()
+    panel = os.open(link, os.O_RDWR | os.O_NOCTTY)
+    try:
+        buffer = bytearray(REPORT_SIZE)
+        os.write(panel, REPORT[:30])
+        assert read(transport, buffer) is None
+        os.write(panel, REPORT[30:])
+        assert read(transport, buffer) == REPORT_SIZE
+        assert buffer == REPORT
+
+        transport.write(b'\x52\x01\x02')
+        assert os.read(panel, 64) == b'\x52\x01\x02'
+    finally:
+        os.close(panel)
+        transport.close()
+    assert not os.path.lexists(link)
+
+
+def test_pty_reopen(tmp_path):
+    link = str(tmp_path / 'panel')
+    transport = PtyTransport(link)
+    transport.open()
+    buffer = bytearray(REPORT_SIZE)
+    panel = os.open(link, os.O_RDWR | os.O_NOCTTY)
+    os.write(panel, REPORT[:30])
+    assert read(transport, buffer) is None
+    os.close(panel)
+    transport.close()
+
+    # the link points to the new pseudo terminal
+    transport.open()
+    panel = os.open(link, os.O_RDWR | os.O_NOCTTY)
+    try:
+        os.write(panel, REPORT)
+        assert read(transport, buffer) == REPORT_SIZE
+        assert buffer == REPORT
+        assert transport.metrics['connects'] == 2
+        assert transport.metrics['disconnects'] == 1
+    finally:
+        os.close(panel)
+        transport.close()
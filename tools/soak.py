@@ -0,0 +1,699 @@
+"""Jablotron soak test
+
+ Long running test of the integration, for installations which run for
+ months without a restart. A simulated JA-100 panel streams reports over
+ TCP, like ser2net sharing the hidraw node of a panel, for hours of
+ simulated time (one report per simulated second) as fast as the stack
+ takes them:
+
+   simulated panel --tcp--> ReaderDaemon --unix--> JablotronHub --> DeviceScanner
+
+ The daemon, the hub and the scanner of the binary sensors are the ones of
+ the integration, configured through its schema and run on their own
+ JablotronRuntime. Home Assistant itself is a stub (StubHass): a real event
+ loop on its own thread, a bus which counts the events fired on it, and
+ entities which count their state writes. Along the way:
+ - sensors        : sensors go on and off, as a d8 08 status followed by a
+                    55 09 message like the panel sends them, now and then a
+                    user arms or disarms
+ - resyncs        : the panel answers the status request of the scanner
+                    with its d8 08 status
+ - reconnects     : every --reconnect simulated minutes the panel closes
+                    its connection or, every other time, the daemon is
+                    restarted and the hub has to connect again
+ - unknown frames : messages with random unknown headers, and garbled
+                    reports
+ - commands       : every --burst simulated minutes arm and disarm commands
+                    are sent through the hub, they are counted by the panel
+
+ The panel stays at most WINDOW reports ahead of the hub, and waits for the
+ hub to have read everything before every reconnect, so nothing has to get
+ lost. The test fails when the hub did not read every report with messages,
+ the panel did not get every command, the bus missed events which were not
+ dropped on purpose, or the sensors and the event history do not end up in
+ the state the panel has them in.
+
+ Every --sample simulated minutes the memory allocated by python
+ (tracemalloc), the open fds and the threads are sampled. The first quarter
+ of the run is the warm up, in which caches and histograms fill up. The test
+ also fails when the highest sample of the last quarter is above the highest
+ sample of the second quarter by more than the allowed growth, or when fds
+ or threads are left over after everything got stopped, including the hub
+ with JablotronHub.stop() as on homeassistant_stop.
+
+ Home Assistant has to be installed, run it with its python, on Linux, from
+ a checkout of the repository:
+
+   python tools/soak.py --hours 24
+
+ The exit status is 0 when everything arrived and stayed bounded, 1 when not.
+"""
+
+import argparse
+import asyncio
+import collections
+import logging
+import os
+import random
+import selectors
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# the integration is next to this directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from homeassistant.const import CONF_CODE, CONF_PORT
+
+from jablotron_system import (PANEL_SCHEMA, CONF_DEBOUNCE, CONF_DEVICES_FILE, CONF_HISTORY_FILE, CONF_MIN_ON,
+                              CONF_OFF_DELAY, _panel_defaults, load_codes, make_config_dir)
+from jablotron_system.binary_sensor import DeviceScanner, async_load_config
+from jablotron_system.commands import JA100_ACTIONS, CommandEncoder
+from jablotron_system.daemon import KEEPALIVE_PACKET, ReaderDaemon
+from jablotron_system.hub import JablotronHub
+from jablotron_system.protocol import (FrameParser, Report, HEADER_JA100_STATE, HEADER_STATUS, HEADER_WIRELESS,
+                                       KNOWN_HEADERS, REPORT_SIZE, STATUS_BITS)
+from jablotron_system.runtime import JablotronRuntime
+
+_LOGGER = logging.getLogger(__name__)
+
+ACCEPT_TIMEOUT = 0.1
+BATCH = 50 # reports sent by the panel between checks for commands and pacing
+WINDOW = 200 # reports the panel may be ahead of the hub, the daemon drops a client which does not keep up
+POLL = 0.005
+SETTLE_TIMEOUT = 30.0
+CLOSE_TIMEOUT = 2.0
+
+CODE = '1234'
+SENSORS = 24 # sensors 0 to 15 are in the d8 08 status as well
+DOORS = 4 # sensors configured in the devices file, without debounce, the others are found as motion sensors
+MOTION_DEBOUNCE = {'motion': {CONF_MIN_ON: 1.0, CONF_OFF_DELAY: 2.0}}
+JA100_STATES = (0x01, 0x21, 0x03, 0x23, 0x02, 0x83)
+SENSOR_TYPE = 0x00
+SENSOR_ON = 0x6c
+SENSOR_OFF = 0x6e
+ARM_TYPES = (0xae, 0x0c, 0x2e)
+STATUS_REQUEST = b'\x52\x02\x13\x05\x9a'
+
+GARBLED = 0.01
+CHANGE = 0.2
+ARM = 0.002
+UNKNOWN = 0.2
+
+DEFAULT_HOURS = 24
+DEFAULT_RATE = 2000
+DEFAULT_SAMPLE = 10
+DEFAULT_RECONNECT = 60
+DEFAULT_BURST = 30
+DEFAULT_BURST_SIZE = 2
+DEFAULT_MEMORY_GROWTH = 512 # KiB
+DEFAULT_FD_GROWTH = 2
+DEFAULT_THREAD_GROWTH = 0
+
+
+class SimulatedPanel():
+    """TCP server streaming the reports of a JA-100 panel, one report per simulated second
+
+    driver is the integration reading the panel, see Integration.
+    """
+
+    def __init__(self, hours, rate, reconnect, driver, seed=None):
+        self._end = int(hours * 3600)
+        self._rate = rate
+        self._reconnect = max(1, int(reconnect * 60))
+        self._driver = driver
+        self._random = random.Random(seed)
+        self._parser = FrameParser()
+        self._check = Report()
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(('127.0.0.1', 0))
+        self._server.listen(1)
+        self._server.settimeout(ACCEPT_TIMEOUT)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._serve, name='soak_panel', daemon=True)
+        self._rx = bytearray()
+        self._answers = []
+        commands = CommandEncoder(CODE)
+        self._actions = frozenset(JA100_ACTIONS.values())
+        self._packets = sorted(set(commands.ja100(action, CODE)[0] for action in JA100_ACTIONS)
+                               | self._actions | {commands.activation, STATUS_REQUEST, KEEPALIVE_PACKET},
+                               key=len, reverse=True)
+        self.sensors = {}
+        self.seconds = 0
+        self.reports = 0
+        self.connects = 0
+        self.commands = 0
+        self.status_requests = 0
+        self.keepalives = 0
+        self.garbage = 0
+        self.changes = 0
+        self.arms = 0
+        self.unknown = 0
+        self.garbled = 0
+        self.stalls = 0
+
+    @property
+    def port(self):
+        """Return the port option to reach the panel."""
+        return 'tcp://127.0.0.1:%d' % self._server.getsockname()[1]
+
+    @property
+    def done(self):
+        """Return True once all simulated time got streamed."""
+        return self.seconds >= self._end
+
+    @property
+    def running(self):
+        return self._thread.is_alive()
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.ident is not None:
+            self._thread.join()
+        self._server.close()
+
+    def _serve(self):
+        while not self._stop.is_set() and not self.done:
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            self.connects += 1
+            selector = selectors.DefaultSelector()
+            try:
+                selector.register(conn, selectors.EVENT_READ)
+                self._stream(conn, selector)
+                if not self._wait(conn, selector, self._driver.settled):
+                    _LOGGER.error('SimulatedPanel: the hub did not read everything before the reconnect')
+                    self.stalls += 1
+                if not self.done:
+                    self._driver.reconnect(self.connects)
+                self._close(conn, selector)
+            except OSError as ex:
+                _LOGGER.error('SimulatedPanel._serve(): connection lost: %s', format(ex))
+            finally:
+                selector.close()
+                conn.close()
+
+    def _stream(self, conn, selector):
+        """Stream reports until the next reconnect"""
+        until = min(self._end, (self.seconds // self._reconnect + 1) * self._reconnect)
+        started = time.monotonic()
+        sent = 0
+        while self.seconds < until and not self._stop.is_set():
+            self._driver.tick(self.seconds)
+            self._send_answers(conn)
+            count = min(BATCH, until - self.seconds)
+            conn.sendall(b''.join(self._report() for _ in range(count)))
+            sent += count
+
+            # stay at most WINDOW reports ahead of the hub, so the daemon never drops it
+            if not self._wait(conn, selector, lambda: self.reports - self._driver.delivered() <= WINDOW):
+                _LOGGER.error('SimulatedPanel: the hub stopped reading')
+                self.stalls += 1
+            # keep to the rate, so the stack is busy but never falls behind for long
+            ahead = sent / self._rate - (time.monotonic() - started)
+            if ahead > 0 and self._receive(conn, selector, ahead) == 0:
+                raise ConnectionError('closed by the other side')
+
+    def _wait(self, conn, selector, condition, timeout=SETTLE_TIMEOUT):
+        """Read commands and answer status requests until condition() is True, returns False after timeout seconds"""
+        deadline = time.monotonic() + timeout
+        while not condition():
+            if self._answers:
+                self._send_answers(conn)
+            if time.monotonic() > deadline or self._stop.is_set():
+                return False
+            if self._receive(conn, selector, POLL) == 0:
+                raise ConnectionError('closed by the other side')
+        return True
+
+    def _close(self, conn, selector):
+        """Close the connection without losing what the other side still sends"""
+        conn.shutdown(socket.SHUT_WR)
+        try:
+            while self._receive(conn, selector, CLOSE_TIMEOUT):
+                pass
+        except ConnectionError:
+            pass
+
+    def _receive(self, conn, selector, timeout):
+        """Read the packets sent to the panel, returns the bytes read, 0 when closed and None after timeout seconds."""
+        if not selector.select(timeout):
+            return None
+        data = conn.recv(4096)
+        self._rx += data
+        self._read_packets()
+        return len(data)
+
+    def _read_packets(self):
+        """Count the packets received so far, the packets the hub sends are written one after the other"""
+        data = self._rx
+        start = 0
+        while start < len(data):
+            for packet in self._packets:
+                if data.startswith(packet, start):
+                    self._packet(packet)
+                    start += len(packet)
+                    break
+            else:
+                rest = bytes(data[start:])
+                if any(packet.startswith(rest) for packet in self._packets):
+                    # the rest of the packet is still on its way
+                    break
+                self.garbage += 1
+                start += 1
+        del data[:start]
+
+    def _packet(self, packet):
+        if packet in self._actions:
+            self.commands += 1
+        elif packet == STATUS_REQUEST:
+            self.status_requests += 1
+            self._answers.append(self._checked(self._status(), [0]))
+        elif packet == KEEPALIVE_PACKET:
+            self.keepalives += 1
+
+    def _send_answers(self, conn):
+        """Send the status reports asked for"""
+        answers, self._answers = self._answers, []
+        conn.sendall(b''.join(answers))
+        self.reports += len(answers)
+
+    def _status(self):
+        """Return the d8 08 status message, bit x is sensor x"""
+        bits = sum(1 << sensor for sensor, on in self.sensors.items() if on) & STATUS_BITS
+        return HEADER_STATUS.to_bytes(2, 'big') + b'\x00' + bits.to_bytes(2, 'little') + bytes(5)
+
+    def _checked(self, report, offsets):
+        """Pad report and make sure the parser finds exactly the messages at offsets, returns None if not"""
+        report = bytes(report).ljust(REPORT_SIZE, b'\x00')
+        self._check.data[:] = report
+        if self._parser.feed(self._check, REPORT_SIZE) != offsets:
+            return None
+        return report
+
+    def _report(self):
+        """Return the report of the next simulated second"""
+        self.seconds += 1
+        rnd = self._random
+        if rnd.random() < GARBLED:
+            self.garbled += 1
+            return self._garbled()
+
+        self.reports += 1
+        offsets = [0]
+        report = bytearray(HEADER_JA100_STATE.to_bytes(2, 'big'))
+        report.append(rnd.choice(JA100_STATES))
+        report += bytes(0x22 - 1)
+        if rnd.random() < ARM:
+            offsets.append(len(report))
+            report += HEADER_WIRELESS.to_bytes(2, 'big') + bytes((rnd.choice(ARM_TYPES), rnd.randrange(0x40))) + bytes(7)
+            self.arms += 1
+        elif rnd.random() < CHANGE:
+            sensor = rnd.randrange(SENSORS)
+            on = not self.sensors.get(sensor, False)
+            self.sensors[sensor] = on
+            offsets.append(len(report))
+            report += self._status()
+            offsets.append(len(report))
+            report += HEADER_WIRELESS.to_bytes(2, 'big') + bytes((SENSOR_TYPE, SENSOR_ON if on else SENSOR_OFF))
+            report += (sensor * 64).to_bytes(2, 'little') + bytes(5)
+            self.changes += 1
+
+        if rnd.random() < UNKNOWN and len(report) + 2 <= REPORT_SIZE:
+            length = rnd.randrange(REPORT_SIZE - len(report) - 1)
+            header = rnd.randrange(0x01, 0x100) << 8 | length
+            while header in KNOWN_HEADERS:
+                header = rnd.randrange(0x01, 0x100) << 8 | length
+            # the random payload must not look like a known message
+            for _ in range(10):
+                checked = self._checked(report + header.to_bytes(2, 'big') + rnd.randbytes(length),
+                                        offsets + [len(report)])
+                if checked is not None:
+                    self.unknown += 1
+                    return checked
+        return self._checked(report, offsets)
+
+    def _garbled(self):
+        """Return a report of random bytes without any known message in it"""
+        rnd = self._random
+        while True:
+            report = rnd.randbytes(REPORT_SIZE)
+            self._check.data[:] = report
+            offsets = self._parser.feed(self._check, REPORT_SIZE)
+            if not any(self._check.header(offset) in KNOWN_HEADERS for offset in offsets):
+                if offsets:
+                    # the daemon passes on the unknown messages it found
+                    self.reports += 1
+                return report
+
+
+class StubBus():
+    """Bus counting the events fired on it"""
+
+    def __init__(self):
+        self.events = collections.Counter()
+
+    def async_fire(self, event_type, event_data=None):
+        self.events[event_data['type']] += 1
+
+
+class StubConfig():
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+
+    def path(self, *path):
+        return os.path.join(self.config_dir, *path)
+
+
+class StubServices():
+    def has_service(self, domain, service):
+        return False
+
+
+class StubHass():
+    """The parts of Home Assistant used by the hub and the scanner, with a real event loop on its own thread"""
+
+    def __init__(self, config_dir):
+        self.loop = asyncio.new_event_loop()
+        self.bus = StubBus()
+        self.config = StubConfig(config_dir)
+        self.services = StubServices()
+        self.data = {}
+        self.entities = {}
+        self.state_writes = 0
+        self._thread = threading.Thread(target=self.loop.run_forever, name='soak_loop')
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self.run(self.loop.shutdown_default_executor())
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+
+    def run(self, coro):
+        """Run a coroutine on the event loop and return its result."""
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result()
+
+    def call(self, fn, *args):
+        """Run fn(*args) on the event loop and return its result."""
+        async def call():
+            return fn(*args)
+        return self.run(call())
+
+    def async_create_task(self, coro):
+        return self.loop.create_task(coro)
+
+    def async_add_executor_job(self, target, *args):
+        return self.loop.run_in_executor(None, target, *args)
+
+    def async_add_entities(self, entities):
+        """Add binary sensors, their state writes are counted instead of written to a state machine"""
+        for entity in entities:
+            entity.hass = self
+            entity.entity_id = 'binary_sensor.' + entity.dev_id
+            entity.async_schedule_update_ha_state = self._async_state_written
+            self.entities[entity.dev_id] = entity
+
+    def _async_state_written(self, force_refresh=False):
+        self.state_writes += 1
+
+
+class Integration():
+    """The reader daemon, the hub and the scanner of one panel, on a StubHass"""
+
+    def __init__(self, hass, burst, burst_size, seed=None):
+        self._hass = hass
+        self._burst = max(1, int(burst * 60))
+        self._burst_size = burst_size
+        self._next_burst = self._burst
+        self._random = random.Random(seed)
+        self._path = hass.config.path('panel.sock')
+        self.panel = None
+        self.daemon = None
+        self.hub = None
+        self.scanner = None
+        self.runtime = JablotronRuntime()
+        self.commands = 0
+        self.daemon_restarts = 0
+
+    def start(self, panel):
+        """Configure and start the hub and the scanner, on the reader daemon of panel."""
+        self.panel = panel
+        hass = self._hass
+        config = _panel_defaults(0, dict(PANEL_SCHEMA({CONF_PORT: 'unix://' + self._path, CONF_CODE: CODE,
+                                                       CONF_DEBOUNCE: MOTION_DEBOUNCE})))
+        make_config_dir(hass)
+        with open(hass.config.path(config[CONF_DEVICES_FILE]), 'w') as out:
+            for sensor in range(DOORS):
+                out.write('jablotron_%d:\n  dev_id: jablotron_%d\n  device_class: door\n' % (sensor, sensor))
+
+        self._start_daemon()
+        self.hub = JablotronHub(hass, 0, config, self.runtime, load_codes(hass, config))
+        self.hub.history.load()
+        devices = hass.run(async_load_config(hass.config.path(config[CONF_DEVICES_FILE]), hass, {},
+                                             hass.async_add_entities))
+        self.runtime.start()
+        self.hub.start()
+        self.scanner = hass.call(self._start_scanner, devices)
+        self._wait_for_hub()
+
+    def _start_scanner(self, devices):
+        scanner = DeviceScanner(self._hass, self.hub, self._hass.async_add_entities, devices, [])
+        scanner.start()
+        return scanner
+
+    def _start_daemon(self):
+        self.daemon = ReaderDaemon(self.panel.port, self._path)
+        self.daemon.start()
+
+    def _wait_for_hub(self):
+        """Wait until the hub is a client of the daemon, reports sent before that are lost"""
+        deadline = time.monotonic() + SETTLE_TIMEOUT
+        while not self.daemon.clients:
+            if time.monotonic() > deadline:
+                raise TimeoutError('the hub did not connect to the reader daemon')
+            time.sleep(POLL)
+
+    def delivered(self):
+        """Return the number of reports read by the hub."""
+        return self.hub.stats.reports
+
+    def settled(self):
+        """Return True once the hub read every report and the panel got every command."""
+        return self.delivered() == self.panel.reports and self.panel.commands == self.commands
+
+    def tick(self, seconds):
+        """Send the commands which are due, called by the panel while it is connected."""
+        while seconds >= self._next_burst:
+            for _ in range(self._burst_size):
+                action = self._random.choice(sorted(JA100_ACTIONS))
+                self.hub.send_packets(self.hub.commands.ja100(action, CODE), 'keys')
+                self.commands += 1
+            self._next_burst += self._burst
+
+    def reconnect(self, connects):
+        """Restart the daemon every other reconnect of the panel, called once the hub read everything."""
+        if connects % 2:
+            return
+        self.daemon.stop()
+        self._start_daemon()
+        self.daemon_restarts += 1
+        self._wait_for_hub()
+
+    def sensors(self):
+        """Return the state of the sensors of the scanner by number, runs on the event loop."""
+        prefix = self.hub.sensor_prefix + '_'
+        return {int(dev_id[len(prefix):]): device.state for dev_id, device in self.scanner.devices.items()
+                if dev_id.startswith(prefix) and dev_id[len(prefix):].isdigit()}
+
+    def debounce(self):
+        """Return the longest a sensor may wait before its state is written."""
+        return max([max(settings[CONF_MIN_ON], settings[CONF_OFF_DELAY])
+                    for settings in self.hub.config[CONF_DEBOUNCE].values()] + [0])
+
+    def stop(self):
+        """Stop like on homeassistant_stop, then stop the daemon."""
+        self.runtime.stop()
+        if self.hub is not None:
+            self.hub.stop()
+        if self.daemon is not None:
+            self.daemon.stop()
+
+
+def open_fds():
+    """Return the number of open fds of this process, None where that is unknown."""
+    try:
+        return len(os.listdir('/proc/self/fd'))
+    except OSError:
+        return None
+
+
+def sample(hours):
+    return (hours, tracemalloc.get_traced_memory()[0], open_fds(), threading.active_count())
+
+
+def grown(samples, index):
+    """Return how much the highest value of the last quarter is above that of the second quarter."""
+    quarter = len(samples) // 4
+    values = [s[index] for s in samples]
+    if quarter < 1 or None in values:
+        return 0
+    return max(values[-quarter:]) - max(values[quarter:2 * quarter])
+
+
+def check_delivery(panel, integration, hass, sensors):
+    """Return the failures of reports, commands, events and sensor states which did not arrive."""
+    failures = []
+    hub = integration.hub
+    if hub.stats.reports != panel.reports:
+        failures.append('the hub read %d of %d reports with messages' % (hub.stats.reports, panel.reports))
+    if panel.commands != integration.commands:
+        failures.append('the panel got %d of %d commands' % (panel.commands, integration.commands))
+    if panel.stalls:
+        failures.append('the panel waited %d times for the hub in vain' % panel.stalls)
+
+    fired = sum(limits['fired'] for limits in hub.events.stats().values())
+    dropped = hub.handoff.stats()['dropped']
+    if sum(hass.bus.events.values()) + dropped != fired:
+        failures.append('%d events fired, %d arrived on the bus and %d got dropped'
+                        % (fired, sum(hass.bus.events.values()), dropped))
+
+    for sensor, on in sorted(panel.sensors.items()):
+        expected = 'on' if on else 'off'
+        if sensors.get(sensor) != expected:
+            failures.append('sensor %d is %s, the panel has it %s' % (sensor, sensors.get(sensor), expected))
+        recorded = hub.history.sensor(sensor)['state']
+        if recorded != expected:
+            failures.append('the history has sensor %d %s, the panel has it %s' % (sensor, recorded, expected))
+
+    history = hub.history.stats()
+    path = hass.config.path(hub.config[CONF_HISTORY_FILE])
+    if not history['records'] or history['unflushed'] or not os.path.exists(path):
+        failures.append('the event history was not written: %s' % history)
+    return failures
+
+
+def run(args):
+    """Run the soak test, returns True when everything arrived and stayed bounded."""
+    tracemalloc.start()
+    fds_before = open_fds()
+    threads_before = threading.active_count()
+
+    config_dir = tempfile.mkdtemp(prefix='jablotron_soak')
+    hass = StubHass(config_dir)
+    integration = Integration(hass, args.burst, args.burst_size, args.seed)
+    panel = SimulatedPanel(args.hours, args.rate, args.reconnect, integration, args.seed)
+
+    samples = []
+    baseline = None
+    next_sample = 0
+    started = time.monotonic()
+    hass.start()
+    try:
+        integration.start(panel)
+        panel.start()
+        print('%8s %12s %6s %8s' % ('hours', 'memory KiB', 'fds', 'threads'))
+        while panel.running:
+            time.sleep(POLL * 10)
+            if panel.seconds >= next_sample:
+                samples.append(sample(panel.seconds / 3600))
+                print('%8.2f %12.1f %6s %8d' % (samples[-1][0], samples[-1][1] / 1024, samples[-1][2], samples[-1][3]))
+                if baseline is None and len(samples) * 4 >= args.hours * 60 / args.sample:
+                    baseline = tracemalloc.take_snapshot()
+                next_sample += args.sample * 60
+        elapsed = time.monotonic() - started
+
+        # the last OFF states are written once the debounce is over
+        time.sleep(integration.debounce() + 0.5)
+        sensors = hass.call(integration.sensors)
+    finally:
+        integration.stop()
+        panel.stop()
+        # the events handed off before the runtime stopped are fired by now
+        hass.call(lambda: None)
+        hass.stop()
+
+    stats = integration.hub.stats.as_dict()
+    print('simulated %.1f h in %.1f s: %d reports, %d sensor changes, %d arms, %d unknown frames, %d garbled reports'
+          % (panel.seconds / 3600, elapsed, panel.reports, panel.changes, panel.arms, panel.unknown, panel.garbled))
+    print('panel connects %d, daemon restarts %d, hub reconnects %d, resyncs %d, status requests %d, keepalives %d'
+          % (panel.connects, integration.daemon_restarts, stats['reconnects'], stats['resyncs'],
+             panel.status_requests, panel.keepalives))
+    print('commands sent %d, arrived %d, sensors %d, state writes %d, events %s'
+          % (integration.commands, panel.commands, len(sensors), hass.state_writes, dict(hass.bus.events)))
+    print('handoff %s' % integration.hub.handoff.stats())
+    print('history %s' % integration.hub.history.stats())
+
+    failures = check_delivery(panel, integration, hass, sensors)
+    shutil.rmtree(config_dir)
+
+    for index, name, limit, unit in ((1, 'memory', args.max_memory_growth * 1024, 'bytes'),
+                                     (2, 'fds', args.max_fd_growth, ''),
+                                     (3, 'threads', args.max_thread_growth, '')):
+        growth = grown(samples, index)
+        if growth > limit:
+            failures.append('%s grew by %d %s after the warm up, allowed %d' % (name, growth, unit, limit))
+
+    fds_after = open_fds()
+    if fds_before is not None and fds_after > fds_before:
+        failures.append('%d fds left open after stopping' % (fds_after - fds_before))
+    threads_after = threading.active_count()
+    if threads_after > threads_before:
+        failures.append('%d threads left running after stopping: %s' % (
+            threads_after - threads_before, [thread.name for thread in threading.enumerate()]))
+
+    if baseline is not None and failures:
+        print('largest growth since the warm up:')
+        for stat in tracemalloc.take_snapshot().compare_to(baseline, 'lineno')[:10]:
+            print('  %s' % stat)
+    tracemalloc.stop()
+
+    for failure in failures:
+        print('FAIL: %s' % failure)
+    if not failures:
+        print('OK: everything arrived, memory, fds and threads stayed bounded')
+    return not failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Soak test the integration reading a simulated Jablotron panel.')
+    parser.add_argument('--hours', type=float, default=DEFAULT_HOURS,
+                        help='simulated hours, one report per simulated second (default %(default)s)')
+    parser.add_argument('--rate', type=int, default=DEFAULT_RATE,
+                        help='reports sent per real second at most (default %(default)s)')
+    parser.add_argument('--sample', type=float, default=DEFAULT_SAMPLE,
+                        help='simulated minutes between samples (default %(default)s)')
+    parser.add_argument('--reconnect', type=float, default=DEFAULT_RECONNECT,
+                        help='simulated minutes between reconnects (default %(default)s)')
+    parser.add_argument('--burst', type=float, default=DEFAULT_BURST,
+                        help='simulated minutes between command bursts (default %(default)s)')
+    parser.add_argument('--burst-size', type=int, default=DEFAULT_BURST_SIZE,
+                        help='commands in a burst (default %(default)s)')
+    parser.add_argument('--max-memory-growth', type=int, default=DEFAULT_MEMORY_GROWTH,
+                        help='KiB the memory may grow after the warm up (default %(default)s)')
+    parser.add_argument('--max-fd-growth', type=int, default=DEFAULT_FD_GROWTH,
+                        help='fds that may be added after the warm up (default %(default)s)')
+    parser.add_argument('--max-thread-growth', type=int, default=DEFAULT_THREAD_GROWTH,
+                        help='threads that may be added after the warm up (default %(default)s)')
+    parser.add_argument('--seed', type=int, help='seed of the simulated panel, for repeatable runs')
+    parser.add_argument('--log-level', default='ERROR')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper(), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    return 0 if run(args) else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())